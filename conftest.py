@@ -0,0 +1,66 @@
+"""
+Stand-ins for `juicer` and `emailyzer`, which are installed from git (see
+`dependency_links` in setup.py) and need Java and the Stanford NER models.
+They are only used when the real modules aren't installed, so that the
+tests, which don't depend on either, can import katatasso.
+
+Also the options of the synthetic corpus of the benchmarks (see
+`katatasso/tests/benchmarks`), registered here so they are accepted
+whatever the tests are run from.
+"""
+import importlib.util
+import sys
+import types
+
+
+class WhitespaceTagger(object):
+    """Tags every token as outside of a named entity"""
+
+    def tag(self, tokens):
+        return [(token, 'O') for token in tokens]
+
+    def tag_sents(self, sentences):
+        return [self.tag(tokens) for tokens in sentences]
+
+
+def _juicer():
+    module = types.ModuleType('juicer')
+    module.STANDIN = True
+    module.initStanfordNERTagger = WhitespaceTagger
+    module.extract_stanford = lambda text, named_only=False, stemming=False, tagger=None: text
+    return module
+
+
+def _emailyzer():
+    def from_file(path):
+        raise NotImplementedError('`emailyzer` is not installed')
+
+    module = types.ModuleType('emailyzer')
+    module.STANDIN = True
+    module.from_file = from_file
+    return module
+
+
+for name, standin in (('juicer', _juicer), ('emailyzer', _emailyzer)):
+    if name not in sys.modules and importlib.util.find_spec(name) is None:
+        sys.modules[name] = standin()
+
+
+def _size(arg):
+    """`1000`, `10k` or `1M`"""
+    units = {'k': 1000, 'm': 1000000}
+    arg = arg.strip().lower()
+    if arg[-1:] in units:
+        return int(float(arg[:-1]) * units[arg[-1]])
+    return int(arg)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('katatasso', 'synthetic corpus of the benchmarks')
+    group.addoption('--corpus-size', type=_size, default=1000,
+                    help='Number of emails in the database, e.g. 1000, 100k or 1M. (Default: 1k)')
+    group.addoption('--corpus-files', type=_size, default=1000,
+                    help='Number of them written as .eml files, to parse and classify. (Default: 1000)')
+    group.addoption('--corpus-seed', type=int, default=0, help='Seed of the corpus. (Default: 0)')
+    group.addoption('--corpus-dir', default='.katatasso_bench',
+                    help='Directory of the generated corpora, reused by later runs. (Default: .katatasso_bench)')
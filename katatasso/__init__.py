@@ -2,5 +2,5 @@
 # -*- coding: utf-8 -*-
 
 from .katatasso import (
-    classify, classifyv2, train, trainv2
+    classify, classify_many, classifyv2, sweep, train, train_many, trainv2
 )
\ No newline at end of file
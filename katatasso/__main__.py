@@ -5,16 +5,19 @@ import os
 import sys
 
 import katatasso
+from katatasso.helpers import profiling
 from katatasso.helpers.logger import increase_log_level, log_to_file
 from katatasso.helpers.logger import rootLogger as logger
-from katatasso.helpers.const import CATEGORIES
+from katatasso.helpers.const import (CATEGORIES, CLF_DEDUP, CLF_SAMPLING,
+                                     CLF_SEED, CLF_SELECT_K, CLF_SELECT_METHOD)
+from katatasso.helpers.selection import SELECTION_METHODS
 
 current = os.path.realpath(os.path.dirname(__file__))
 APPNAME = 'katatasso'
 
 
 INDENT = '  '
-HELPMSG = f'''usage: {APPNAME} (-f <INPUT_FILE> | -s) [-n] [-a <ALGO>] [-l <NUM_SAMPLES>] [-t <VERSION>] [-c <VERSION>] [-d <FORMAT>] [-o <OUTPUT_FILE>] [-v] [-l]
+HELPMSG = f'''usage: {APPNAME} (-f <INPUT_FILE> | -s) [-n] [-a <ALGO>] [-l <NUM_SAMPLES> [--sampling <STRATEGY>] [--seed <SEED>]] [--select <NUM_FEATURES>] [--dedup] [-t <VERSION>] [--curve [--background]] [-c <VERSION>] [--sweep] [-d <FORMAT>] [-o <OUTPUT_FILE>] [--profile] [--pstats <FILE>] [-v] [-l]
     Input:
     {INDENT * 1}-f, --infile        {INDENT * 2}Extract entities from file.
     {INDENT * 1}-s, --stdin         {INDENT * 2}Extract entities from STDIN.
@@ -22,13 +25,31 @@ HELPMSG = f'''usage: {APPNAME} (-f <INPUT_FILE> | -s) [-n] [-a <ALGO>] [-l <NUM_
     Options:
     {INDENT * 1}-n, --std           {INDENT * 2}Standardize the data. Used with `--train`.
     {INDENT * 1}-a, --algo          {INDENT * 2}Specify the algorithm to use.
-                              Can be either `cnb` (Complement NB) or `mnb` (Multinomial NB)
+                              Can be either `cnb` (Complement NB) or `mnb` (Multinomial NB).
+                              Several can be trained at once, e.g. `-a mnb,cnb`
     {INDENT * 1}-l, --limit         {INDENT * 2}Use n samples from each category.
+    {INDENT * 1}--sampling          {INDENT * 2}How to sample with `--limit`. Can be either `balanced` (default),
+                              n from each category, or `proportional`, n per category on average,
+                              divided according to the size of each category.
+    {INDENT * 1}--seed              {INDENT * 2}Seed for a reproducible sample with `--limit`.
+    {INDENT * 1}--select            {INDENT * 2}Keep only the n most informative features. Used with `--train`.
+                              Reports model size, latency and accuracy at the `CLF_SELECT_CUTOFFS`.
+    {INDENT * 1}--select-method     {INDENT * 2}How to score features for `--select`.
+                              Can be either `chi2` (default), `mi` (mutual information) or `logodds`
+    {INDENT * 1}--dedup             {INDENT * 2}Collapse near-duplicate emails (MinHash LSH) before training. Used with `--train`.
+                              Configured with the `CLF_DEDUP_*` env vars.
+    {INDENT * 1}--curve             {INDENT * 2}Plot learning curves after training. Used with `--train`.
+                              Configured with the `CLF_LC_*` env vars.
+    {INDENT * 1}--background        {INDENT * 2}Plot the learning curves in a background process. Used with `--curve`.
 
     Action:
-    {INDENT * 1}-t, --train         {INDENT * 2}Train and create a model for classification. Specify either `v1` or `v2` as arg.
+    {INDENT * 1}-t, --train         {INDENT * 2}Train and create a model for classification. Specify either `v1` or `v2` as arg,
+                              or both, e.g. `-t v1,v2`.
     {INDENT * 1}-c, --classify      {INDENT * 2}Classify the text. Specify either `v1` or `v2` as arg,
                               depending on what mode was used for training.
+    {INDENT * 1}--sweep             {INDENT * 2}Evaluate a grid of hyperparameters (alpha, algo, std, norm, dictionary size)
+                              on a single vectorization of the data set, and write a ranked table.
+                              The grid is configured with the `CLF_SWEEP_*` env vars.
 
     Output:
     {INDENT * 1}-o, --outfile       {INDENT * 2}Output results to this file.
@@ -38,6 +59,9 @@ HELPMSG = f'''usage: {APPNAME} (-f <INPUT_FILE> | -s) [-n] [-a <ALGO>] [-l <NUM_
     General options:
     {INDENT * 1}-v, --verbose       {INDENT * 2}Increase verbosity (can be used several times, e.g. -vvv).
     {INDENT * 1}-l, --log-file      {INDENT * 2}Write log events to the file `{APPNAME}.log`.
+    {INDENT * 1}--profile           {INDENT * 2}Print the time spent in each stage (count, total, p50, p99) as JSON to STDERR,
+                              and write it to `CLF_PROFILE_FILE`.
+    {INDENT * 1}--pstats            {INDENT * 2}Also write a cProfile of the run to this file, for `pstats`/snakeviz.
     {INDENT * 1}--help              {INDENT * 2}Print this message.
 '''
 
@@ -56,7 +80,7 @@ def main():
     argv = sys.argv[1:]
 
     try:
-        opts, args = getopt.getopt(argv, 'hf:st:c:na:l:o:d:v', ['help', 'infile=', 'stdin', 'std', 'algo=', '--limit', 'train=', 'classify=', 'outfile=', 'format=', 'verbose', 'log-file'])
+        opts, args = getopt.getopt(argv, 'hf:st:c:na:l:o:d:v', ['help', 'infile=', 'stdin', 'std', 'algo=', 'limit=', 'sampling=', 'seed=', 'train=', 'classify=', 'sweep', 'select=', 'select-method=', 'dedup', 'curve', 'background', 'outfile=', 'format=', 'verbose', 'log-file', 'profile', 'pstats='])
     except getopt.GetoptError:
         print(HELPMSG)
         sys.exit(2)
@@ -83,6 +107,13 @@ def main():
         enable_logfile = list(filter(lambda opt: opt[0] in ('--log-file'), opts))
         if enable_logfile:
             log_to_file()
+
+    """
+    Profile
+    """
+    pstats_file = next((arg for opt, arg in opts if opt == '--pstats'), None)
+    if pstats_file or ('--profile', '') in opts:
+        profiling.enable(pstats_file)
     
     for opt, arg in opts:
         if opt == '--help':
@@ -113,44 +144,92 @@ def main():
             logger.debug(f'OPTION: Standardizing data.')
             CONFIG['std'] = True
         elif opt in ('-a', '--algo'):
-            logger.debug('OPTION: Using Complement Naïve Bayes algorithm')
-            if arg not in ['mnb', 'cnb']:
-                print(HELPMSG)
-                logger.critical(f'The specified algorithm `{arg}` is not available.')
-                sys.exit(2)
-            else:
-                CONFIG['algo'] = arg
+            algos = arg.split(',')
+            for algo in algos:
+                if algo not in ['mnb', 'cnb']:
+                    print(HELPMSG)
+                    logger.critical(f'The specified algorithm `{algo}` is not available.')
+                    sys.exit(2)
+            logger.debug(f'OPTION: Using algorithm(s) {algos}')
+            CONFIG['algo'] = algos
         elif opt in ('-l', '--limit'):
-            if arg.isnumeric:
+            if arg.isnumeric():
                 logger.debug(f'OPTION: Using n={arg} samples.')
                 CONFIG['n'] = int(arg)
             else:
                 print(HELPMSG)
                 logger.critical(f'n={arg} is non-numeric.')
                 sys.exit(2)
+        elif opt == '--sampling':
+            if arg not in ['balanced', 'proportional']:
+                print(HELPMSG)
+                logger.critical(f'The specified sampling strategy `{arg}` is not available.')
+                sys.exit(2)
+            logger.debug(f'OPTION: Using {arg} sampling.')
+            CONFIG['strategy'] = arg
+        elif opt == '--seed':
+            if arg.isnumeric():
+                logger.debug(f'OPTION: Using seed {arg}.')
+                CONFIG['seed'] = int(arg)
+            else:
+                print(HELPMSG)
+                logger.critical(f'seed={arg} is non-numeric.')
+                sys.exit(2)
+        elif opt == '--select':
+            if arg.isnumeric():
+                logger.debug(f'OPTION: Selecting {arg} features.')
+                CONFIG['select_k'] = int(arg)
+            else:
+                print(HELPMSG)
+                logger.critical(f'--select={arg} is non-numeric.')
+                sys.exit(2)
+        elif opt == '--select-method':
+            if arg not in SELECTION_METHODS:
+                print(HELPMSG)
+                logger.critical(f'The specified feature selection method `{arg}` is not available.')
+                sys.exit(2)
+            logger.debug(f'OPTION: Using feature selection method {arg}.')
+            CONFIG['select_method'] = arg
+        elif opt == '--dedup':
+            logger.debug(f'OPTION: Removing near-duplicates.')
+            CONFIG['dedup'] = True
+        elif opt == '--curve':
+            logger.debug(f'OPTION: Plotting learning curves.')
+            CONFIG['curve'] = True
+        elif opt == '--background':
+            logger.debug(f'OPTION: Plotting in the background.')
+            CONFIG['background'] = True
         elif opt in ('-t', '--train'):
             logger.debug(f'ACTION: Creating model from dataset')
-            if arg == 'v1':
-                katatasso.train(
-                    std=CONFIG.get('std', False),
-                    algo=CONFIG.get('algo', 'mnb')
-                )
-            elif arg == 'v2':
-                katatasso.trainv2(
+            versions = arg.split(',')
+            if all(version in ['v1', 'v2'] for version in versions):
+                katatasso.train_many(
+                    versions=versions,
+                    algos=CONFIG.get('algo', ['mnb']),
                     std=CONFIG.get('std', False),
-                    algo=CONFIG.get('algo', 'mnb'),
-                    n=CONFIG.get('n', None)
+                    n=CONFIG.get('n', None),
+                    seed=CONFIG.get('seed', CLF_SEED),
+                    strategy=CONFIG.get('strategy', CLF_SAMPLING),
+                    curve=CONFIG.get('curve', False),
+                    select_k=CONFIG.get('select_k', CLF_SELECT_K),
+                    select_method=CONFIG.get('select_method', CLF_SELECT_METHOD),
+                    dedup=CONFIG.get('dedup', CLF_DEDUP),
+                    background=CONFIG.get('background', False)
                 )
             else:
                 logger.critical(f'Please specify either `v1` or `v2`. E.g. `katatasso -t v2`')
                 sys.exit(2)
+        elif opt == '--sweep':
+            logger.debug(f'ACTION: Sweeping hyperparameters')
+            katatasso.sweep(
+                n=CONFIG.get('n', None),
+                seed=CONFIG.get('seed', CLF_SEED),
+                strategy=CONFIG.get('strategy', CLF_SAMPLING)
+            )
         elif opt in ('-c', '--classify'):
             if TEXT:
                 logger.debug(f'ACTION: Classifying input')
-                if CONFIG.get('cnb'):
-                    algo = 'cnb'
-                else:
-                    algo = 'mnb'
+                algo = CONFIG.get('algo', ['mnb'])[0]
                 if arg == 'v1':
                     category = katatasso.classify(TEXT, algo=algo)
                 elif arg == 'v2':
@@ -172,6 +251,10 @@ def main():
             else:
                 logger.critical('Invalid format. Must be one of [plain, json]')
                 sys.exit(2)
+
+    if profiling.enabled():
+        # STDERR, so it doesn't mix with the results
+        print(profiling.finish(), file=sys.stderr)
         
     if result:
         outformat = CONFIG.get('format')
@@ -1,7 +1,7 @@
 import os
-import sqlite3
 import sys
 
+from katatasso.helpers import manifest, storage, watch
 from katatasso.helpers.const import CATEGORIES, DBFILE, CLF_TRAININGDATA_PATH
 from katatasso.helpers.extraction import get_file_paths
 
@@ -34,39 +34,33 @@ def load_emails():
     return emails
 
 def create_conn():
-    return sqlite3.connect(DBFILE)
+    return storage.connect()
 
 def init_db():
-    conn = create_conn()
-    c = conn.cursor()
-    c.execute('CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY AUTOINCREMENT, filepath TEXT NOT NULL, tag INTEGER)')
+    # Creates the tables, or brings an existing schema up to date
+    create_conn()
+
+def _insert(conn, pending, entries):
+    conn.executemany('INSERT INTO tags (filepath, tag) VALUES (?,?) ON CONFLICT (filepath) DO UPDATE SET tag=excluded.tag', pending)
+    # In the autotagger's own manifest entries, since the text isn't parsed
+    manifest.record(conn, entries, [filepath for filepath, _ in pending], ingester='autotagger')
     conn.commit()
-    conn.close()
+    return len(pending)
 
-def tag():
+def tag(prune=False):
     conn = create_conn()
-    c = conn.cursor()
     tags = load_emails()
-    c.executemany('INSERT INTO tags (filepath, tag) VALUES (?,?)', tags)
-    conn.commit()
-    conn.close()
+    pending, entries, deleted, summary = manifest.scan(conn, tags, ingester='autotagger', parsed=False)
+    _insert(conn, pending, entries)
+    if prune and deleted:
+        manifest.prune(conn, deleted)
+    manifest.print_summary(summary, pruned=prune)
 
 def count():
-    conn = create_conn()
-    c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM tags')
-    total = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (0,))
-    legit = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (1,))
-    spam = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (2,))
-    phish = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (3,))
-    malware = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (4,))
-    fraud = c.fetchone()[0]
-    
+    stats = storage.category_stats()
+    total = sum(stats.values())
+    legit, spam, phish, malware, fraud = (stats.get(tag, 0) for tag in range(5))
+
     print(f'''DB: {total} emails
     => Legit:       {legit}
     => Spam:        {spam}
@@ -80,7 +74,12 @@ def main():
     if not os.path.isfile(DBFILE):
         print('DB not present. Creating..')
         init_db()
-    tag()
+    if '--watch' in sys.argv[1:]:
+        # Tag the emails as they land in CLF_TRAININGDATA_PATH, until interrupted
+        conn = create_conn()
+        watch.watch(lambda pending, entries: _insert(conn, pending, entries), watcher='autotagger', parsed=False)
+    else:
+        tag(prune='--prune' in sys.argv[1:])
     count()
 
 if __name__ == '__main__':
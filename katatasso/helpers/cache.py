@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of vectorized training corpora.
+
+Entries are keyed on a fingerprint of the `tags` table together with the
+preprocessing/vectorizer config, so any change to either yields a new key.
+Each entry consists of
+    <key>.npz           the sparse feature matrix
+    <key>.labels.npy    the labels
+    <key>.extra.p       a pickled object (e.g. the fitted vectorizer), or None
+An entry missing any of them, or that can't be read, is a miss.
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import sys
+
+from katatasso.helpers import storage
+from katatasso.helpers.const import (CLF_CACHE, CLF_CACHE_DIR,
+                                     CLF_CACHE_MAX_MB)
+from katatasso.helpers.logger import rootLogger as logger
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+# Bump when the layout of the cache entries changes
+CACHE_FORMAT = 6
+
+
+def fingerprint():
+    """Summarize the state of the `tags` table: max id, row count and its change
+    counter, which every write of a tag, text or hosts bumps (see `storage.changes`)"""
+    conn = storage.connect()
+    return [*conn.execute('SELECT MAX(id), COUNT(*) FROM tags').fetchone(), storage.changes()]
+
+
+def make_key(config, n=None, seed=None, strategy=None):
+    """Create a cache key from the DB fingerprint and a config dict.
+    `n`, `seed` and `strategy` describe the sample the data is drawn from, if any.
+    Returns None if caching is disabled, the sample is random (no seed), or
+    the DB can't be fingerprinted."""
+    if not CLF_CACHE or (n and seed is None):
+        return None
+    if n:
+        config = dict(config, sample={'n': n, 'seed': seed, 'strategy': strategy})
+    try:
+        state = {'format': CACHE_FORMAT, 'db': fingerprint(), 'config': config}
+    except sqlite3.Error as e:
+        logger.warning(f'Unable to fingerprint the database, not caching. ({e})')
+        return None
+    raw = json.dumps(state, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _path(key, suffix):
+    return os.path.join(CLF_CACHE_DIR, f'{key}{suffix}')
+
+
+def load(key):
+    """Load a cached entry.
+
+        Returns
+        -------
+        (X, y, extra) or None on cache miss
+    """
+    if key is None:
+        return None
+    matrix, labels, extra = _path(key, '.npz'), _path(key, '.labels.npy'), _path(key, '.extra.p')
+    if not (os.path.isfile(matrix) and os.path.isfile(labels) and os.path.isfile(extra)):
+        logger.debug(f'Cache miss for `{key[:12]}`')
+        return None
+    try:
+        X = sp.load_npz(matrix)
+        y = np.load(labels, allow_pickle=False)
+        with open(extra, 'rb') as f:
+            obj = pickle.load(f)
+    except Exception as e:
+        logger.warning(f'Unable to read cache entry `{key[:12]}`, ignoring it. ({e})')
+        return None
+    # Mark as recently used
+    for fn in (matrix, labels, extra):
+        os.utime(fn)
+    logger.info(f'Cache hit for `{key[:12]}`: {X.shape[0]} samples, {X.shape[1]} features')
+    return X, y, obj
+
+
+def save(key, X, y, extra=None):
+    """Store a feature matrix, its labels and an optional object, then evict
+    old entries to stay within `CLF_CACHE_MAX_MB`"""
+    if key is None:
+        return
+    try:
+        os.makedirs(CLF_CACHE_DIR, exist_ok=True)
+        # Write to temporary names first, so a partial write is never read back
+        tmp_matrix, tmp_labels = _path(key, '.tmp.npz'), _path(key, '.tmp.labels.npy')
+        tmp_extra = _path(key, '.tmp.extra.p')
+        sp.save_npz(tmp_matrix, sp.csr_matrix(X) if not sp.issparse(X) else X, compressed=False)
+        np.save(tmp_labels, np.asarray(y), allow_pickle=False)
+        with open(tmp_extra, 'wb') as f:
+            pickle.dump(extra, f)
+        os.replace(tmp_extra, _path(key, '.extra.p'))
+        os.replace(tmp_labels, _path(key, '.labels.npy'))
+        # Last, as an entry without its matrix is never read
+        os.replace(tmp_matrix, _path(key, '.npz'))
+        logger.debug(f'Cached feature matrix as `{key[:12]}`')
+    except Exception as e:
+        logger.warning(f'Unable to write cache entry `{key[:12]}`. ({e})')
+        return
+    evict(keep=key)
+
+
+def evict(max_mb=CLF_CACHE_MAX_MB, keep=None):
+    """Remove the least recently used entries until the cache fits in `max_mb`"""
+    entries = {}
+    for fn in glob.glob(os.path.join(CLF_CACHE_DIR, '*')):
+        key = os.path.basename(fn).split('.')[0]
+        stat = os.stat(fn)
+        size, used = entries.get(key, (0, 0))
+        entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+
+    total = sum(size for size, _ in entries.values())
+    limit = max_mb * 1024 * 1024
+    for key, (size, _) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+        if total <= limit:
+            break
+        if key == keep:
+            continue
+        for fn in glob.glob(_path(key, '.*')):
+            os.remove(fn)
+        total -= size
+        logger.debug(f'Evicted cache entry `{key[:12]}` ({size} bytes)')
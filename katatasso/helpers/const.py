@@ -13,8 +13,99 @@ CATEGORIES = {
 }
 
 FN_MODEL = os.getenv('CLF_MODEL_PRE', 'model_')
+FN_VECTORIZER = os.getenv('CLF_VECTORIZER_PRE', 'vectorizer_')
 CLF_DICT_NUM = int(os.getenv('CLF_DICT_NUM', 5000))
 CLF_TRAININGDATA_PATH = os.getenv('CLF_TRAININGDATA_PATH', 'trainingdata/emails/')
 DBFILE = os.getenv('DBFILE', 'tagger.db')
+# How long (ms) to wait for a lock held by another connection to the database
+CLF_DB_BUSY_TIMEOUT = int(os.getenv('CLF_DB_BUSY_TIMEOUT', 5000))
+# Sampling with `-l/--limit`: `balanced` (n per category) or `proportional`
+CLF_SAMPLING = os.getenv('CLF_SAMPLING', 'balanced')
+# Seed for reproducible sampling (unset = random)
+CLF_SEED = int(os.environ['CLF_SEED']) if os.getenv('CLF_SEED') else None
+# Number of parallel jobs (joblib semantics, -1 uses all cores)
+CLF_N_JOBS = int(os.getenv('CLF_N_JOBS', -1))
+# Evaluation metrics are appended to this file (JSON lines)
+CLF_METRICS_FILE = os.getenv('CLF_METRICS_FILE', 'metrics.jsonl')
+
+# Ingestion (dataset_generator): number of worker processes (1 = serial),
+# and the number of emails each worker parses per chunk
+CLF_INGEST_WORKERS = int(os.getenv('CLF_INGEST_WORKERS', 1))
+CLF_INGEST_CHUNK = int(os.getenv('CLF_INGEST_CHUNK', 100))
+# Number of parsed emails written to the database per transaction
+CLF_INGEST_BATCH = int(os.getenv('CLF_INGEST_BATCH', 500))
+# Number of documents tagged per call to the NER tagger
+CLF_NER_BATCH = int(os.getenv('CLF_NER_BATCH', 64))
+# Text extraction at ingestion: `emailyzer` (html_as_text) or `fast` (see helpers/plaintext.py)
+CLF_TEXT_MODE = os.getenv('CLF_TEXT_MODE', 'emailyzer')
+# Watch mode (--watch): seconds between polls, number of new emails ingested at a time,
+# and how long (seconds) a file must be left unmodified before it is ingested
+CLF_WATCH_INTERVAL = float(os.getenv('CLF_WATCH_INTERVAL', 5))
+CLF_WATCH_BATCH = int(os.getenv('CLF_WATCH_BATCH', 50))
+CLF_WATCH_SETTLE = float(os.getenv('CLF_WATCH_SETTLE', 2))
+
+# Tagging server (katag): emails listed per page, and how long (seconds) the category counts are cached
+CLF_TAGGER_PAGE = int(os.getenv('CLF_TAGGER_PAGE', 100))
+CLF_TAGGER_STATS_TTL = float(os.getenv('CLF_TAGGER_STATS_TTL', 30))
+# Number of rendered emails kept in memory, and how many of the next emails are rendered ahead
+CLF_TAGGER_CACHE = int(os.getenv('CLF_TAGGER_CACHE', 64))
+CLF_TAGGER_PREFETCH = int(os.getenv('CLF_TAGGER_PREFETCH', 5))
+
+# Active learning: score untagged emails by the uncertainty (`margin` or `entropy`)
+# of the v2 model trained with CLF_AL_ALGO, CLF_AL_BATCH emails at a time,
+# and rescore them whenever that model is trained (CLF_AL_RESCORE, 0 = disabled).
+# Rescoring after training skips the emails without stored text (only tagged, not ingested).
+CLF_AL_METHOD = os.getenv('CLF_AL_METHOD', 'margin')
+CLF_AL_ALGO = os.getenv('CLF_AL_ALGO', 'mnb')
+CLF_AL_BATCH = int(os.getenv('CLF_AL_BATCH', 500))
+CLF_AL_RESCORE = bool(int(os.getenv('CLF_AL_RESCORE', '1')))
+
+# Search in the tagging server: results shown per search, number of distinctive
+# terms of an email queried to find similar ones, how many of the best matches
+# are compared with it, and the minimum Jaccard similarity of their words
+CLF_SEARCH_LIMIT = int(os.getenv('CLF_SEARCH_LIMIT', 200))
+CLF_SEARCH_TERMS = int(os.getenv('CLF_SEARCH_TERMS', 16))
+CLF_SEARCH_CANDIDATES = int(os.getenv('CLF_SEARCH_CANDIDATES', 5000))
+CLF_SEARCH_SIMILARITY = float(os.getenv('CLF_SEARCH_SIMILARITY', 0.5))
+
+# Stage timings (`--profile`, 1 = enabled), written as JSON to CLF_PROFILE_FILE
+CLF_PROFILE = bool(int(os.getenv('CLF_PROFILE', '0')))
+CLF_PROFILE_FILE = os.getenv('CLF_PROFILE_FILE', 'profile.json')
+
+# Near-duplicate removal with MinHash LSH (1 = enabled)
+CLF_DEDUP = bool(int(os.getenv('CLF_DEDUP', '0')))
+# Approximate Jaccard similarity above which emails are near-duplicates
+CLF_DEDUP_THRESHOLD = float(os.getenv('CLF_DEDUP_THRESHOLD', 0.8))
+CLF_DEDUP_NUM_PERM = int(os.getenv('CLF_DEDUP_NUM_PERM', 128))
+# Number of consecutive words per shingle
+CLF_DEDUP_SHINGLE = int(os.getenv('CLF_DEDUP_SHINGLE', 3))
+
+# Feature selection: keep the CLF_SELECT_K most informative features (0 = keep all)
+CLF_SELECT_K = int(os.getenv('CLF_SELECT_K', 0))
+# One of `chi2`, `mi` (mutual information) or `logodds`
+CLF_SELECT_METHOD = os.getenv('CLF_SELECT_METHOD', 'chi2')
+# Cut-offs to report model size, latency and accuracy for
+CLF_SELECT_CUTOFFS = [int(k) for k in os.getenv('CLF_SELECT_CUTOFFS', '500,1000,2500,5000').split(',')]
+
+# Learning curve stage (`--curve`)
+CLF_LC_SPLITS = int(os.getenv('CLF_LC_SPLITS', 10))
+# Stop adding splits once the score's 95% CI is within +/- CLF_LC_TOLERANCE
+CLF_LC_ADAPTIVE = bool(int(os.getenv('CLF_LC_ADAPTIVE', '0')))
+CLF_LC_TOLERANCE = float(os.getenv('CLF_LC_TOLERANCE', 0.01))
+CLF_LC_BATCH = int(os.getenv('CLF_LC_BATCH', 5))
+CLF_LC_N_JOBS = int(os.getenv('CLF_LC_N_JOBS', CLF_N_JOBS))
+
+# On-disk cache of vectorized training data
+CLF_CACHE = bool(int(os.getenv('CLF_CACHE', '1')))
+CLF_CACHE_DIR = os.getenv('CLF_CACHE_DIR', '.katatasso_cache')
+CLF_CACHE_MAX_MB = int(os.getenv('CLF_CACHE_MAX_MB', 1024))
+# Pre-tokenized corpus store, written at ingestion time (see helpers/corpus_store.py)
+CLF_CORPUS_DIR = os.getenv('CLF_CORPUS_DIR', '.katatasso_corpus')
+
+# Hyperparameter sweep grid (comma-separated values)
+SWEEP_ALPHAS = [float(a) for a in os.getenv('CLF_SWEEP_ALPHAS', '0.01,0.1,0.5,1.0').split(',')]
+SWEEP_DICT_NUMS = [int(d) for d in os.getenv('CLF_SWEEP_DICT_NUMS', '1000,2500,5000,10000').split(',')]
+SWEEP_NORMS = [None if n == 'none' else n for n in os.getenv('CLF_SWEEP_NORMS', 'l1,l2,none').split(',')]
+SWEEP_ALGOS = os.getenv('CLF_SWEEP_ALGOS', 'mnb,cnb').split(',')
 
 categories = ['Legit', 'Spam', 'Phishing', 'Fraud', 'Malware']
\ No newline at end of file
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pre-tokenized corpus store, written at ingestion time.
+
+The text of every row of `tags` is tokenized once, and stored as ids into a
+global vocabulary, so training doesn't split strings again. The store is a
+directory of
+    vocab.json      the terms, in order of first occurrence (id = index)
+    tokens.bin      the token ids of all documents, contiguous (int32)
+    offsets.npy     document i is tokens[offsets[i]:offsets[i + 1]]
+    ids.npy         the `tags.id` of each document
+    labels.npy      the tag of each document
+    valid.npy       whether the document has text
+    meta.json       the DB fingerprint, change counter and normalizer version
+                    it was written from
+
+Ingestion and training bring it up to date with `update`, which appends the
+rows stored since (see `storage.changes`), relabels the tagged ones, and only
+rebuilds it when the normalizer changed or stored documents were deleted or
+re-parsed. Rebuild it with
+`python -m katatasso.helpers.corpus_store`.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import sys
+
+from katatasso.helpers import cache, storage
+from katatasso.helpers.const import CLF_CORPUS_DIR
+from katatasso.helpers.extraction import sample_tag_ids, warn_failed
+from katatasso.helpers.logger import rootLogger as logger
+from katatasso.helpers.normalize import NORMALIZER
+from katatasso.helpers.utils import progress_bar
+
+try:
+    from sklearn.feature_extraction.text import CountVectorizer
+    import numpy as np
+    import scipy.sparse as sp
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+
+def build(path=CLF_CORPUS_DIR, batch_size=1000):
+    """Tokenize the `tags` table into a corpus store, in a single streaming pass.
+    Memory is bounded by the vocabulary and the number of documents."""
+    tmp = f'{path}.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    vocab = {}
+    offsets = [0]
+    ids, labels, valid = [], [], []
+    # Read before the rows, so rows written meanwhile are taken again by `update`
+    version = storage.changes()
+    fingerprint = cache.fingerprint()
+    rows = storage.iter_rows('SELECT id, tag, text FROM tags ORDER BY id', batch_size=batch_size)
+    with open(os.path.join(tmp, 'tokens.bin'), 'wb') as f:
+        for id, tag, text in progress_bar(rows):
+            tokens = [vocab.setdefault(word, len(vocab)) for word in NORMALIZER.tokenize(text or '')]
+            np.asarray(tokens, dtype=np.int32).tofile(f)
+            offsets.append(offsets[-1] + len(tokens))
+            ids.append(id)
+            labels.append(tag)
+            valid.append(text is not None)
+
+    _save(tmp, list(vocab), offsets, ids, labels, valid, _meta(fingerprint, version))
+
+    # Swap in the new store
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    logger.info(f'Corpus store: {len(ids)} documents, {offsets[-1]} tokens, {len(vocab)} terms')
+    return CorpusStore(path)
+
+
+def _meta(fingerprint, version):
+    return {'db': fingerprint, 'version': version, 'normalizer': NORMALIZER.version}
+
+
+def _save(path, vocab, offsets, ids, labels, valid, meta):
+    """Write everything but the tokens, the metadata last. Each file is
+    replaced as a whole, and `CorpusStore` checks that they agree."""
+    def replace(name, write):
+        fn = os.path.join(path, name)
+        with open(f'{fn}.tmp', 'wb') as f:
+            write(f)
+        os.replace(f'{fn}.tmp', fn)
+
+    replace('vocab.json', lambda f: f.write(json.dumps(vocab, ensure_ascii=False).encode('utf-8')))
+    replace('offsets.npy', lambda f: np.save(f, np.asarray(offsets, dtype=np.int64)))
+    replace('ids.npy', lambda f: np.save(f, np.asarray(ids, dtype=np.int64)))
+    replace('labels.npy', lambda f: np.save(f, np.asarray(labels, dtype=np.int64)))
+    replace('valid.npy', lambda f: np.save(f, np.asarray(valid, dtype=bool)))
+    replace('meta.json', lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+
+def update(path=CLF_CORPUS_DIR, batch_size=1000):
+    """Bring the corpus store up to date with the `tags` table
+
+        The rows written since the store was (last) written are tokenized:
+        new rows are appended, and rows whose tag changed are relabelled.
+        The store is rebuilt instead if it is missing, if the normalizer
+        changed, or if stored documents were deleted or their text changed.
+    """
+    try:
+        store = CorpusStore(path)
+    except FileNotFoundError:
+        return build(path, batch_size)
+    except Exception as e:
+        logger.warning(f'Unable to read the corpus store, rebuilding it. ({e})')
+        return build(path, batch_size)
+    if store.meta.get('normalizer') != NORMALIZER.version or 'version' not in store.meta:
+        return build(path, batch_size)
+    if store.is_fresh():
+        return store
+
+    conn = storage.connect()
+    last = int(store.ids[-1]) if len(store) else 0
+    if conn.execute('SELECT COUNT(*) FROM tags WHERE id <= ?', (last,)).fetchone()[0] != len(store):
+        logger.info('Documents were deleted from the database, rebuilding the corpus store')
+        return build(path, batch_size)
+
+    version = storage.changes()
+    fingerprint = cache.fingerprint()
+    vocab = {term: i for i, term in enumerate(store.vocab)}
+    offsets = [int(store.offsets[-1])]
+    ids, labels, valid = [], [], []
+    relabelled = store.labels.copy()
+    rows = storage.iter_rows('SELECT id, tag, text FROM tags WHERE modified > ? ORDER BY id',
+                             (store.meta['version'],), batch_size=batch_size)
+    with open(os.path.join(path, 'tokens.bin'), 'r+b' if offsets[0] else 'wb') as f:
+        # Leftovers of an interrupted update are overwritten
+        f.truncate(offsets[0] * 4)
+        f.seek(offsets[0] * 4)
+        for id, tag, text in progress_bar(rows):
+            if id <= last:
+                row = int(np.searchsorted(store.ids, id))
+                tokens = [vocab.get(word, -1) for word in NORMALIZER.tokenize(text or '')]
+                if (text is not None) != store.valid[row] or not np.array_equal(tokens, store.document(row)):
+                    rows.close()
+                    logger.info('Documents were parsed again, rebuilding the corpus store')
+                    return build(path, batch_size)
+                relabelled[row] = tag
+                continue
+            tokens = [vocab.setdefault(word, len(vocab)) for word in NORMALIZER.tokenize(text or '')]
+            np.asarray(tokens, dtype=np.int32).tofile(f)
+            offsets.append(offsets[-1] + len(tokens))
+            ids.append(id)
+            labels.append(tag)
+            valid.append(text is not None)
+
+    _save(path, list(vocab), np.concatenate([store.offsets, offsets[1:]]), np.concatenate([store.ids, ids]),
+          np.concatenate([relabelled, labels]), np.concatenate([store.valid, valid]), _meta(fingerprint, version))
+    logger.info(f'Corpus store: appended {len(ids)} documents, {offsets[-1] - offsets[0]} tokens, '
+                f'{len(vocab) - len(store.vocab)} new terms')
+    return CorpusStore(path)
+
+
+class CorpusStore(object):
+    """A corpus store, with the token ids memory-mapped"""
+
+    def __init__(self, path=CLF_CORPUS_DIR):
+        self.path = path
+        with open(os.path.join(path, 'vocab.json'), encoding='utf-8') as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.ids = np.load(os.path.join(path, 'ids.npy'))
+        self.labels = np.load(os.path.join(path, 'labels.npy'))
+        self.valid = np.load(os.path.join(path, 'valid.npy'))
+        if not len(self.offsets) == len(self.ids) + 1 == len(self.labels) + 1 == len(self.valid) + 1:
+            raise ValueError('the files of the store disagree on the number of documents')
+        if self.offsets[-1]:
+            # Only up to the last document, an interrupted update may have left more
+            self.tokens = np.memmap(os.path.join(path, 'tokens.bin'), dtype=np.int32, mode='r',
+                                    shape=(int(self.offsets[-1]),))
+        else:
+            # A zero-length file can't be mapped
+            self.tokens = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def document(self, row):
+        """The token ids of a document"""
+        return self.tokens[self.offsets[row]:self.offsets[row + 1]]
+
+    def is_fresh(self):
+        """Whether the store matches the current database and normalizer"""
+        try:
+            return (self.meta.get('db'), self.meta.get('normalizer')) == (cache.fingerprint(), NORMALIZER.version)
+        except sqlite3.Error:
+            return False
+
+    def select(self, n=None, seed=None, strategy=None):
+        """Documents (store rows) to train on: all of them, or the same sample as
+        `extraction.get_n_tags`. Documents without text are left out."""
+        if n:
+            ids = sample_tag_ids(n, seed=seed, strategy=strategy)
+            # `get_tags_by_id` returns each chunk of 500 ids in id order
+            ids = np.concatenate([np.sort(ids[i:i + 500]) for i in range(0, len(ids), 500)] or [[]])
+            rows = np.searchsorted(self.ids, ids)
+        else:
+            rows = np.arange(len(self))
+        missing = rows[~self.valid[rows]]
+        if len(missing):
+            warn_failed([str(id) for id in self.ids[missing]])
+        return rows[self.valid[rows]]
+
+    def _indices(self, rows):
+        """The token ids of the documents, concatenated, and the boundaries of each"""
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        # Positions of the documents' tokens in the contiguous array
+        positions = np.arange(indptr[-1]) + np.repeat(starts - indptr[:-1], lengths)
+        return np.asarray(self.tokens[positions]), indptr
+
+    def counts(self, rows):
+        """Term counts of the documents, shape (len(rows), len(vocab))"""
+        indices, indptr = self._indices(rows)
+        counts = sp.csr_matrix((np.ones(len(indices), dtype=np.int64), indices, indptr),
+                               shape=(len(rows), len(self.vocab)))
+        counts.sum_duplicates()
+        return counts
+
+    def dictionary(self, rows, k):
+        """The `k` most common alphabetic words of the documents, like `extraction.make_dictionary`
+
+            Returns
+            -------
+            dictionary : list of (word, count)
+            ids : numpy.ndarray
+                The vocabulary ids of the words
+        """
+        indices, _ = self._indices(rows)
+        frequencies = np.bincount(indices, minlength=len(self.vocab))
+        # `Counter.most_common` breaks ties by first occurrence
+        first = np.full(len(self.vocab), len(indices))
+        present, index = np.unique(indices, return_index=True)
+        first[present] = index
+        alpha = np.fromiter((word.isalpha() for word in self.vocab), dtype=bool, count=len(self.vocab))
+        candidates = np.flatnonzero(alpha & (frequencies > 0))
+        top = candidates[np.lexsort((first[candidates], -frequencies[candidates]))[:k]]
+        return [(self.vocab[i], int(frequencies[i])) for i in top], top
+
+    def count_words(self, counts):
+        """The count matrix and fitted vectorizer `extraction.count_words` would
+        produce: only the terms that occur, in alphabetical order"""
+        present = np.flatnonzero(np.asarray(counts.sum(axis=0)).ravel())
+        terms = [self.vocab[i] for i in present]
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        vectorizer = CountVectorizer(analyzer=NORMALIZER)
+        vectorizer.vocabulary_ = {terms[i]: column for column, i in enumerate(order)}
+        return counts[:, present[order]], vectorizer
+
+
+def open_store(path=CLF_CORPUS_DIR, refresh=False):
+    """The corpus store, or None if it's missing or out of date
+
+        Parameters
+        ----------
+        refresh : bool
+            Bring an out of date store up to date with `update` (e.g. after
+            emails were tagged), rather than ignoring it
+    """
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+        return None
+    try:
+        store = CorpusStore(path)
+    except Exception as e:
+        logger.warning(f'Unable to read the corpus store, ignoring it. ({e})')
+        return None
+    if not store.is_fresh():
+        if refresh:
+            return update(path)
+        logger.info('The corpus store is out of date, reading the database instead. '
+                    'Rebuild it with `python -m katatasso.helpers.corpus_store`')
+        return None
+    return store
+
+
+if __name__ == '__main__':
+    build()
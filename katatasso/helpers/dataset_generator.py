@@ -1,11 +1,21 @@
+import collections
+import contextlib
+import functools
+import getopt
+import itertools
+import multiprocessing
 import os
-import sqlite3
+import signal
 import sys
 
-from katatasso.helpers.const import CATEGORIES, DBFILE, CLF_TRAININGDATA_PATH
+from katatasso.helpers.const import (CATEGORIES, CLF_INGEST_BATCH,
+                                     CLF_INGEST_CHUNK, CLF_INGEST_WORKERS,
+                                     CLF_TEXT_MODE, DBFILE, CLF_TRAININGDATA_PATH)
+from katatasso.helpers import corpus_store, manifest, ner, plaintext, profiling, sources, storage, watch
 from katatasso.helpers.extraction import get_file_paths, warn_failed
+from katatasso.helpers.logger import rootLogger as logger
+from katatasso.helpers.normalize import NORMALIZER
 from katatasso.helpers.utils import progress_bar
-import juicer
 import emailyzer
 
 DATAPATH = CLF_TRAININGDATA_PATH
@@ -16,8 +26,6 @@ mal_dir = DATAPATH + 'malware/'
 fraud_dir = DATAPATH + 'fraud/'
 emails = []
 
-DBFILE = 'tagger.db'
-
 def load_emails():
     legit = [ (legit_dir + fname, 0) for fname in os.listdir(legit_dir) ]
     spam = [ (spam_dir + fname, 1) for fname in os.listdir(spam_dir) ]
@@ -39,64 +47,324 @@ def load_emails():
 
 
 def parse_emails(tags):
+    return [row[:4] for rows in iter_parsed(tags, workers=1) for row in rows]
+
+
+def _init_worker():
+    # Load the NER tagger of this process once, up front
+    ner.get_tagger()
+
+
+def _read(item, text_mode=CLF_TEXT_MODE):
+    """The text content and hosts of an email file (filepath, tag),
+    or of a message streamed from an archive (filepath, tag, raw, source, offset)"""
+    fast = text_mode == 'fast'
+    if len(item) > 2:
+        content, hosts = plaintext.message_text(item[2], prefer_plain=fast)
+        return content, '|'.join(hosts), item[3], item[4]
+    if fast and not item[0].lower().endswith('.msg'):
+        # Outlook .msg files aren't MIME, so they are left to emailyzer
+        with open(item[0], 'rb') as f:
+            content, hosts = plaintext.message_text(f.read())
+        return content, '|'.join(hosts), None, None
+    email = emailyzer.from_file(item[0])
+    return email.html_as_text, '|'.join(email.hosts), None, None
+
+
+def _parse_chunk(chunk, text_mode=CLF_TEXT_MODE):
+    """Parse a chunk of emails, tagging their text in one NER batch"""
+    emails = []
     failed = []
-    parsed = []
-    tagger = juicer.initStanfordNERTagger()
-    for tag in progress_bar(tags):
+    for item in chunk:
         try:
-            filepath = tag[0]
-            email = emailyzer.from_file(filepath)
-            content = email.html_as_text
-            # Preprocess, extract entities
-            words = juicer.extract_stanford(content, named_only=False, stemming=False, tagger=tagger)
-            hosts = '|'.join(email.hosts)
-            tagged = (filepath, tag[1], words, hosts)
-            parsed.append(tagged)
-        except:
-            failed.append(filepath.replace(CLF_TRAININGDATA_PATH, ''))
-            pass
+            with profiling.stage(f'extract.{text_mode}'):
+                emails.append((item, *_read(item, text_mode)))
+        except Exception:
+            failed.append(item[0].replace(CLF_TRAININGDATA_PATH, ''))
+
+    try:
+        with profiling.stage('ner'):
+            words = list(ner.extract_batch([content for _, content, *_ in emails]))
+    except Exception as e:
+        # Find the culprit(s) by tagging one email at a time
+        logger.debug(f'Batched NER failed, retrying per email. ({e})')
+        words = []
+        for item, content, *_ in emails:
+            try:
+                words.extend(ner.extract_batch([content]))
+            except Exception:
+                failed.append(item[0].replace(CLF_TRAININGDATA_PATH, ''))
+                words.append(None)
+
+    with profiling.stage('normalize'):
+        parsed = [
+            # Store the text the way training and classification tokenize it
+            (item[0], item[1], ' '.join(NORMALIZER.tokenize(text)), hosts, source, offset, text_mode)
+            for (item, _, hosts, source, offset), text in zip(emails, words)
+            if text is not None
+        ]
+    # The timings of a worker process go back to the parent with the chunk
+    return parsed, failed, profiling.drain() if profiling.enabled() else None
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _init_pool_worker():
+    # Ctrl+C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker()
+
+
+def _pool(workers):
+    ctx = multiprocessing.get_context('spawn')
+    return ctx.Pool(workers, initializer=_init_pool_worker)
+
+
+def iter_parsed(tags, workers=CLF_INGEST_WORKERS, chunk_size=CLF_INGEST_CHUNK, text_mode=CLF_TEXT_MODE, pool=None):
+    """Parse emails a chunk at a time, in a pool of worker processes
+    (each with its own tagger) or in this process if `workers` is 1
+
+        Parameters
+        ----------
+        tags : iterable of (filepath, tag) or (filepath, tag, raw, source, offset)
+            Email files, or messages streamed from an archive (see `helpers.sources`).
+            Read lazily, so at most two chunks per worker are in memory.
+
+        workers : int
+            Number of worker processes
+
+        chunk_size : int
+            Number of emails sent to a worker at a time
+
+        text_mode : str
+            How the text is extracted, one of `plaintext.TEXT_MODES`
+
+        pool : multiprocessing.Pool
+            A pool of `workers` processes to reuse, instead of starting one
+
+        Yields
+        ------
+        rows : list of (filepath, tag, text, hosts, source, source_offset, text_mode)
+            The parsed emails of a chunk
+    """
+    failed = []
+    if workers > 1:
+        with contextlib.nullcontext(pool) if pool is not None else _pool(workers) as pool:
+            pending = collections.deque()
+            for chunk in progress_bar(_chunks(tags, chunk_size)):
+                pending.append(pool.apply_async(_parse_chunk, (chunk, text_mode)))
+                # Don't read ahead of the workers
+                while len(pending) >= 2 * workers:
+                    parsed, errors, timings = pending.popleft().get()
+                    failed.extend(errors)
+                    if timings:
+                        profiling.merge(timings)
+                    yield parsed
+            while pending:
+                parsed, errors, timings = pending.popleft().get()
+                failed.extend(errors)
+                if timings:
+                    profiling.merge(timings)
+                yield parsed
+    else:
+        _init_worker()
+        parse = functools.partial(_parse_chunk, text_mode=text_mode)
+        for parsed, errors, timings in map(parse, progress_bar(_chunks(tags, chunk_size))):
+            failed.extend(errors)
+            if timings:
+                profiling.merge(timings)
+            yield parsed
 
     if failed:
         warn_failed(failed)
 
-    return parsed 
-
 
 def create_conn():
-    return sqlite3.connect(DBFILE)
+    return storage.connect()
+
 
 def init_db():
-    conn = create_conn()
-    c = conn.cursor()
-    c.execute('CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY AUTOINCREMENT, filepath TEXT NOT NULL, tag INTEGER, text TEXT, hosts TEXT)')
-    conn.commit()
-    conn.close()
+    # Creates the tables, or brings an existing schema up to date
+    create_conn()
+
+
+UPSERT = (
+    'INSERT INTO tags (filepath, tag, text, hosts, source, source_offset, text_mode) VALUES (?,?,?,?,?,?,?) '
+    'ON CONFLICT (filepath) DO UPDATE SET tag=excluded.tag, text=excluded.text, hosts=excluded.hosts, '
+    'source=excluded.source, source_offset=excluded.source_offset, text_mode=excluded.text_mode'
+)
+
+
+def _store(conn, chunks, batch_size, run, entries=None):
+    """Write parsed rows in transactions of `batch_size` rows. Each transaction
+    records the stored files in the manifest (given their `entries`) and
+    the progress of the run. Returns the number of rows stored."""
+    stored = 0
+    batch = []
+    @profiling.timed('db.write')
+    def write():
+        conn.executemany(UPSERT, batch)
+        if entries is not None:
+            # Failed files are left out of the manifest, and retried on the next run
+            manifest.record(conn, entries, [row[0] for row in batch])
+        manifest.checkpoint(conn, run, len(batch))
+        conn.commit()
+        batch.clear()
+
+    for parsed in chunks:
+        batch.extend(parsed)
+        stored += len(parsed)
+        if len(batch) >= batch_size:
+            write()
+    if batch:
+        write()
+    return stored
 
-def tag():
+
+def tag(workers=CLF_INGEST_WORKERS, chunk_size=CLF_INGEST_CHUNK, batch_size=CLF_INGEST_BATCH, prune=False,
+        text_mode=CLF_TEXT_MODE):
+    """Parse the new and changed emails into the database
+
+        Parsed emails are written in transactions of `batch_size` rows, each
+        one recording the stored files in the manifest. An interrupted run
+        resumes after the last committed batch.
+
+        Parameters
+        ----------
+        workers : int
+            Number of worker processes
+
+        chunk_size : int
+            Number of emails sent to a worker at a time
+
+        batch_size : int
+            Number of rows written per transaction
+
+        prune : bool
+            Remove emails that no longer exist on disk
+
+        text_mode : str
+            How the text is extracted, one of `plaintext.TEXT_MODES`
+    """
     conn = create_conn()
-    c = conn.cursor()
     tags = load_emails()
-    tags = parse_emails(tags)
-    c.executemany('INSERT INTO tags (filepath, tag, text, hosts) VALUES (?,?,?,?)', tags)
-    conn.commit()
-    conn.close()
+    interrupted = manifest.last_run(conn)
+    pending, entries, deleted, summary = manifest.scan(conn, tags)
+    if interrupted and not interrupted['finished']:
+        print(f'Resuming an interrupted run: {interrupted["stored"]} emails were stored, {len(pending)} left')
+    run = manifest.start_run(conn, len(pending))
 
-def count():
+    chunks = iter_parsed(pending, workers=workers, chunk_size=chunk_size, text_mode=text_mode)
+    stored = _store(conn, chunks, batch_size, run, entries=entries)
+    manifest.finish_run(conn, run)
+    if prune and deleted:
+        manifest.prune(conn, deleted)
+    manifest.print_summary(summary, failed=len(pending) - stored, pruned=prune)
+
+    if stored or (prune and deleted) or corpus_store.open_store() is None:
+        print('Updating the corpus store..')
+        corpus_store.update()
+
+
+def tag_sources(specs, workers=CLF_INGEST_WORKERS, chunk_size=CLF_INGEST_CHUNK, batch_size=CLF_INGEST_BATCH,
+                text_mode=CLF_TEXT_MODE):
+    """Stream the messages of mbox files and Maildirs into the database
+
+        Sources that haven't changed since they were last ingested are
+        skipped, as are the messages already stored, so an interrupted run
+        resumes where it stopped and an mbox that grew only has its new
+        messages parsed.
+
+        Parameters
+        ----------
+        specs : list of str
+            The sources, as `<mbox|maildir>:<path>[=<category>]` (see `helpers.sources`)
+
+        workers : int
+            Number of worker processes
+
+        chunk_size : int
+            Number of emails sent to a worker at a time
+
+        batch_size : int
+            Number of rows written per transaction
+
+        text_mode : str
+            How the text is extracted, one of `plaintext.TEXT_MODES`
+    """
+    conn = create_conn()
+    total = 0
+    for spec in specs:
+        paths = sources.source_paths(spec)
+        stats = {path: os.stat(path) for path in paths}
+        recorded = {
+            row[0]: row[1:3] for row in conn.execute(
+                f"SELECT filepath, size, mtime FROM manifest WHERE ingester='ingest' "
+                f'AND filepath IN ({",".join("?" * len(paths))})', paths
+            )
+        }
+        if paths and all(recorded.get(path) == (stats[path].st_size, stats[path].st_mtime) for path in paths):
+            print(f'{spec}: unchanged')
+            continue
+
+        # The messages of the source that are already stored
+        names = sources.source_names(spec)
+        known = {row[0] for row in storage.iter_rows(
+            f'SELECT filepath FROM tags WHERE source IN ({",".join("?" * len(names))})', names
+        )}
+        messages = (message for message in sources.iter_source(spec) if message[0] not in known)
+        run = manifest.start_run(conn, None)
+        chunks = iter_parsed(messages, workers=workers, chunk_size=chunk_size, text_mode=text_mode)
+        stored = _store(conn, chunks, batch_size, run)
+        manifest.finish_run(conn, run)
+        conn.executemany(
+            "INSERT OR REPLACE INTO manifest (ingester, filepath, size, mtime, hash) VALUES ('ingest',?,?,?,NULL)",
+            [(path, stats[path].st_size, stats[path].st_mtime) for path in paths]
+        )
+        conn.commit()
+        print(f'{spec}: {stored} new messages ({len(known)} already stored)')
+        total += stored
+
+    if total or corpus_store.open_store() is None:
+        print('Updating the corpus store..')
+        corpus_store.update()
+
+
+def watch_dir(workers=CLF_INGEST_WORKERS, chunk_size=CLF_INGEST_CHUNK, batch_size=CLF_INGEST_BATCH,
+              text_mode=CLF_TEXT_MODE):
+    """Parse the emails into the database as they land in CLF_TRAININGDATA_PATH,
+    until interrupted (see `helpers.watch`). The worker processes, and their
+    taggers, are started once."""
     conn = create_conn()
-    c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM tags')
-    total = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (0,))
-    legit = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (1,))
-    spam = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (2,))
-    phish = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (3,))
-    malware = c.fetchone()[0]
-    c.execute('SELECT COUNT(*) FROM tags WHERE tag=?', (4,))
-    fraud = c.fetchone()[0]
-    
+    with _pool(workers) if workers > 1 else contextlib.nullcontext() as pool:
+        def ingest(pending, entries):
+            run = manifest.start_run(conn, len(pending))
+            chunks = iter_parsed(pending, workers=workers, chunk_size=chunk_size, text_mode=text_mode, pool=pool)
+            stored = _store(conn, chunks, batch_size, run, entries=entries)
+            manifest.finish_run(conn, run)
+            return stored
+
+        total = watch.watch(ingest, path=DATAPATH)
+
+    # Updated once, rather than after every batch. Training reads the
+    # database in the meantime.
+    if total:
+        print('Updating the corpus store..')
+        corpus_store.update()
+
+
+def count():
+    stats = storage.category_stats()
+    total = sum(stats.values())
+    legit, spam, phish, malware, fraud = (stats.get(tag, 0) for tag in range(5))
+
     print(f'''DB: {total} emails
     => Legit:       {legit}
     => Spam:        {spam}
@@ -106,12 +374,97 @@ def count():
     ''')
 
 
+HELPMSG = '''usage: python -m katatasso.helpers.dataset_generator [-w <WORKERS>] [-k <CHUNK_SIZE>] [-b <BATCH_SIZE>] [--prune] [-S <SOURCE> ...]
+        [-t <TEXT_MODE>] [--watch] [--profile] [--pstats <FILE>]
+    -w, --workers       Number of worker processes parsing emails. (Default: CLF_INGEST_WORKERS)
+    -k, --chunk-size    Number of emails each worker parses at a time. (Default: CLF_INGEST_CHUNK)
+    -b, --batch-size    Number of emails written per transaction. (Default: CLF_INGEST_BATCH)
+    --prune             Remove emails that no longer exist on disk from the database.
+    -S, --source        Ingest an mbox file or a Maildir instead of CLF_TRAININGDATA_PATH.
+                        Given as `mbox:<path>[=<category>]` or `maildir:<path>[=<category>]`.
+                        Without a category, each mbox/folder goes to the category of its name.
+                        Can be used several times.
+    -t, --text-mode     How the text of an email is extracted: `emailyzer` (html_as_text),
+                        or `fast` (the text/plain part, or the HTML through a one-pass tokenizer).
+                        Only new and changed emails are parsed, so use a new DBFILE when switching.
+                        (Default: CLF_TEXT_MODE)
+    --watch             Keep running, and parse the emails as they land in CLF_TRAININGDATA_PATH
+                        (nested folders included). See the `CLF_WATCH_*` env vars.
+    --profile           Print the time spent in each stage (extraction, NER, normalization, writes)
+                        as JSON to STDERR, also written to CLF_PROFILE_FILE.
+    --pstats            Also write a cProfile of the run to this file (implies --profile).
+    -h, --help          Print this message.
+'''
+
+
 def main():
+    workers, chunk_size, batch_size, prune = CLF_INGEST_WORKERS, CLF_INGEST_CHUNK, CLF_INGEST_BATCH, False
+    text_mode = CLF_TEXT_MODE
+    watching = False
+    specs = []
+    profile, pstats_file = False, None
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], 'hw:k:b:S:t:', ['help', 'workers=', 'chunk-size=', 'batch-size=', 'prune',
+                                                              'source=', 'text-mode=', 'watch', 'profile', 'pstats='])
+    except getopt.GetoptError:
+        print(HELPMSG)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print(HELPMSG)
+            sys.exit(0)
+        elif opt == '--prune':
+            prune = True
+        elif opt == '--watch':
+            watching = True
+        elif opt == '--profile':
+            profile = True
+        elif opt == '--pstats':
+            profile, pstats_file = True, arg
+        elif opt in ('-S', '--source'):
+            try:
+                sources.parse_spec(arg)
+            except ValueError as e:
+                print(HELPMSG)
+                print(e)
+                sys.exit(2)
+            specs.append(arg)
+        elif opt in ('-t', '--text-mode'):
+            text_mode = arg
+        elif not arg.isnumeric() or int(arg) < 1:
+            print(HELPMSG)
+            print(f'{opt}={arg} must be a positive number.')
+            sys.exit(2)
+        elif opt in ('-w', '--workers'):
+            workers = int(arg)
+        elif opt in ('-k', '--chunk-size'):
+            chunk_size = int(arg)
+        elif opt in ('-b', '--batch-size'):
+            batch_size = int(arg)
+
+    if text_mode not in plaintext.TEXT_MODES:
+        print(HELPMSG)
+        print(f'Unknown text mode `{text_mode}`, expected one of {plaintext.TEXT_MODES}')
+        sys.exit(2)
+    if watching and (specs or prune):
+        print(HELPMSG)
+        print('--watch can\'t be combined with --source or --prune')
+        sys.exit(2)
+    if profile:
+        # Before the worker processes are started, so they time their stages too
+        profiling.enable(pstats_file)
     if not os.path.isfile(DBFILE):
         print('DB not present. Creating..')
         init_db()
-    tag()
+    if watching:
+        watch_dir(workers=workers, chunk_size=chunk_size, batch_size=batch_size, text_mode=text_mode)
+    elif specs:
+        tag_sources(specs, workers=workers, chunk_size=chunk_size, batch_size=batch_size, text_mode=text_mode)
+    else:
+        tag(workers=workers, chunk_size=chunk_size, batch_size=batch_size, prune=prune, text_mode=text_mode)
     count()
+    if profiling.enabled():
+        print(profiling.finish(), file=sys.stderr)
 
 if __name__ == '__main__':
     main()
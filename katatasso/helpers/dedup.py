@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import array
+import sqlite3
+import sys
+import time
+import zlib
+
+from katatasso.helpers.const import (CLF_DEDUP_NUM_PERM, CLF_DEDUP_SHINGLE,
+                                     CLF_DEDUP_THRESHOLD)
+from katatasso.helpers.logger import rootLogger as logger
+from katatasso.helpers.normalize import NORMALIZER
+from katatasso.helpers.utils import progress_bar
+
+try:
+    import numpy as np
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+
+def lsh_bands(threshold, num_perm):
+    """Choose the number of bands `b` and rows per band `r` (b * r = num_perm)
+    so that the LSH S-curve crosses 50% near the Jaccard `threshold`"""
+    best = None
+    for r in range(1, num_perm + 1):
+        if num_perm % r:
+            continue
+        b = num_perm // r
+        error = abs((1 / b) ** (1 / r) - threshold)
+        if best is None or error < best[0]:
+            best = (error, b, r)
+    return best[1], best[2]
+
+
+def _hash_params(num_perm, seed=1):
+    rng = np.random.RandomState(seed)
+    # Odd multipliers for multiply-shift hashing
+    a = rng.randint(1, 2 ** 63 - 1, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.randint(0, 2 ** 63 - 1, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def signature(text, params, shingle_size=CLF_DEDUP_SHINGLE):
+    """MinHash signature of the word shingles of `text`"""
+    a, b = params
+    words = NORMALIZER.tokenize(text)
+    if not words:
+        return np.zeros(len(a), dtype=np.uint32)
+    hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+    # Combine consecutive word hashes into shingle hashes
+    size = min(shingle_size, len(hashes))
+    shingles = np.zeros(len(hashes) - size + 1, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for i in range(size):
+            shingles = shingles * np.uint64(1000003) + hashes[i:len(hashes) - size + 1 + i]
+        shingles = np.unique(shingles)
+        # Multiply-shift: (a * x + b) mod 2^64, keeping the high 32 bits
+        permuted = (np.outer(shingles, a) + b) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def deduplicate(tags, threshold=CLF_DEDUP_THRESHOLD, num_perm=CLF_DEDUP_NUM_PERM,
+                shingle_size=CLF_DEDUP_SHINGLE):
+    """Collapse clusters of near-duplicate documents with MinHash LSH
+
+        Documents are compared within their category only. The first document
+        of each cluster is kept as its representative, weighted by the size of
+        the cluster. The LSH buckets live in a temporary on-disk SQLite
+        database, and only the ids of the representatives are kept, so their
+        text is read again to build the features (see `extraction.iter_tags_by_id`).
+
+        Parameters
+        ----------
+        tags : iterable of (id, tag, text)
+
+        threshold : float
+            Approximate Jaccard similarity above which documents are duplicates
+
+        num_perm : int
+            Number of hash permutations in each signature
+
+        shingle_size : int
+            Number of consecutive words in each shingle
+
+        Returns
+        -------
+        ids : numpy.ndarray
+            The id of the representative of each cluster, in the order of `tags`
+        weights : numpy.ndarray
+            The number of documents in each cluster
+    """
+    start = time.perf_counter()
+    bands, rows = lsh_bands(threshold, num_perm)
+    params = _hash_params(num_perm)
+    logger.debug(f'Deduplicating with threshold={threshold}: {bands} bands of {rows} rows')
+
+    # An empty filename creates a temporary database on disk
+    conn = sqlite3.connect('')
+    conn.execute('CREATE TABLE buckets (band INTEGER, hash INTEGER, rep INTEGER, PRIMARY KEY (band, hash)) WITHOUT ROWID')
+    kept = array.array('q')
+    weights = array.array('q')
+    total = skipped = 0
+    try:
+        for id, tag, text in progress_bar(tags):
+            total += 1
+            if text is None:
+                skipped += 1
+                continue
+            sig = signature(text, params, shingle_size=shingle_size)
+            keys = [hash((tag, sig[band * rows:(band + 1) * rows].tobytes())) for band in range(bands)]
+            rep = None
+            for band, key in enumerate(keys):
+                hit = conn.execute('SELECT rep FROM buckets WHERE band=? AND hash=?', (band, key)).fetchone()
+                if hit:
+                    rep = hit[0]
+                    break
+            if rep is None:
+                rep = len(kept)
+                kept.append(id)
+                weights.append(1)
+                conn.executemany('INSERT OR IGNORE INTO buckets VALUES (?,?,?)',
+                                 [(band, key, rep) for band, key in enumerate(keys)])
+            else:
+                weights[rep] += 1
+    finally:
+        conn.close()
+
+    if skipped:
+        logger.warning(f'Skipped {skipped} entries without text')
+    removed = total - skipped - len(kept)
+    elapsed = time.perf_counter() - start
+    print(f'Deduplication: kept {len(kept)} of {total - skipped} documents '
+          f'({removed} near-duplicates, {round(100 * removed / max(total - skipped, 1), 1)}% reduction) '
+          f'in {round(elapsed, 2)}s')
+    return np.asarray(kept, dtype=np.int64), np.asarray(weights, dtype=np.float64)
@@ -1,20 +1,25 @@
 #!/usr/bin/env python3
 import os
-import sqlite3
 import sys
 import random
 from collections import Counter
 
-from katatasso.helpers.const import CLF_DICT_NUM, CLF_TRAININGDATA_PATH, DBFILE
+from katatasso.helpers import ner, plaintext, profiling, storage
+from katatasso.helpers.const import (CLF_DICT_NUM, CLF_SAMPLING,
+                                     CLF_TRAININGDATA_PATH)
 from katatasso.helpers.logger import rootLogger as logger
-from katatasso.helpers.utils import (load_vectorizer, progress_bar,
+from katatasso.helpers.normalize import NORMALIZER
+from katatasso.helpers.utils import (load_vectorizer, peak_rss_mb, progress_bar,
                                      save_vectorizer)
 
 try:
     from sklearn.preprocessing import StandardScaler
-    from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+    from sklearn.feature_extraction.text import (CountVectorizer,
+                                                 TfidfTransformer,
+                                                 TfidfVectorizer)
     import emailyzer
     import juicer
+    import numpy as np
     import pandas as pd
 except ModuleNotFoundError as e:
     logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
@@ -38,38 +43,110 @@ def warn_failed(failed):
         f.write('\n'.join(failed))
 
 
+def iter_all_tags(batch_size=1000, columns='filepath, tag, text, hosts'):
+    """Stream all tags from the database, `batch_size` rows at a time"""
+    rows = storage.iter_rows(f'SELECT {columns} FROM tags ORDER BY id', batch_size=batch_size)
+    return profiling.iterate('db.read', rows)
+
+
 def get_all_tags():
     try:
-        conn = sqlite3.connect(DBFILE)
-        c = conn.cursor()
-        c.execute('SELECT filepath, tag, text, hosts FROM tags')
-        res = c.fetchall()
-        return res
+        with profiling.stage('db.read'):
+            c = storage.connect().execute('SELECT filepath, tag, text, hosts FROM tags ORDER BY id')
+            return c.fetchall()
     except Exception as e:
         logger.critical(f'Unable to fetch tags from database.')
         logger.error(e)
         sys.exit(2)
 
 
-def get_n_tags(n):
+def _reservoir(rows, k, rng):
+    """Uniformly sample k items from an iterable of unknown length in O(k) memory"""
+    sample = []
+    for i, row in enumerate(rows):
+        if i < k:
+            sample.append(row)
+        else:
+            j = rng.randint(0, i)
+            if j < k:
+                sample[j] = row
+    return sample
+
+
+def sample_tag_ids(n, seed=None, strategy=CLF_SAMPLING):
+    """Draw a stratified sample of ids from the database, without reading any text
+
+        Parameters
+        ----------
+        n : int
+            Number of samples per category. With the `proportional` strategy,
+            `n` times the number of categories are drawn in total, divided
+            according to the size of each category.
+
+        seed : int
+            Seed for a reproducible sample. (Default: random)
+
+        strategy : str
+            `balanced` (n from each category) or `proportional`
+
+        Returns
+        -------
+        ids : list of int
+    """
     cats = [0, 1, 2, 3, 4]
+    rng = random.Random(seed)
+    stats = storage.category_stats()
+    sizes = {cat: stats.get(cat, 0) for cat in cats}
+    total = sum(sizes.values())
+    ids = []
+    for cat in cats:
+        size = sizes[cat]
+        if strategy == 'proportional':
+            k = round(n * len(cats) * size / total) if total else 0
+        else:
+            k = n
+        if k > size:
+            logger.warn(f'n={k} is higher than the number of samples in {cat}. Selecting {size} (all) samples.')
+        rows = storage.iter_rows('SELECT id FROM tags WHERE tag=? ORDER BY id', (cat,))
+        ids += sorted(_reservoir((row[0] for row in rows), k, rng))
+    return ids
+
+
+@profiling.timed('db.read')
+def get_tags_by_id(ids, chunk_size=500):
+    c = storage.connect().cursor()
     res = []
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        c.execute(f'SELECT filepath, tag, text, hosts FROM tags WHERE id IN ({",".join("?" * len(chunk))}) ORDER BY id', chunk)
+        res += c.fetchall()
+    return res
+
+
+def iter_tags_by_id(ids, chunk_size=500, columns='filepath, tag, text, hosts'):
+    """Stream the tags of `ids` in that order, `chunk_size` rows at a time.
+    Ids that no longer exist are skipped."""
+    return profiling.iterate('db.read', _iter_tags_by_id(ids, chunk_size, columns))
+
+
+def _iter_tags_by_id(ids, chunk_size, columns):
+    conn = storage.connect()
+    for i in range(0, len(ids), chunk_size):
+        chunk = [int(id) for id in ids[i:i + chunk_size]]
+        c = conn.execute(f'SELECT id, {columns} FROM tags WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+        rows = {row[0]: row[1:] for row in c}
+        for id in chunk:
+            if id in rows:
+                yield rows[id]
+
+
+def get_n_tags(n, seed=None, strategy=CLF_SAMPLING):
+    """Fetch a stratified sample of tags. Ids are sampled first,
+    so only the text of the selected rows is read."""
     try:
-        conn = sqlite3.connect(DBFILE)
-        c = conn.cursor()
-        for cat in cats:
-            try:
-                c.execute('SELECT filepath, tag, text, hosts FROM tags WHERE tag=?', (cat,))
-                tags = c.fetchall()
-                if n <= len(tags):
-                    res += random.sample(tags, n)
-                else:
-                    logger.warn(f'n={n} is higher than the number of samples in {cat}. Selecting {len(tags)} (all) samples.')
-                    res += random.sample(tags, len(tags))
-            except Exception as e:
-                logger.critical(f'Unable to fetch {n} tags for category {cat}.')
-                logger.error(e)
-        return res
+        ids = sample_tag_ids(n, seed=seed, strategy=strategy)
+        logger.debug(f'Sampled {len(ids)} ids ({strategy}, seed={seed})')
+        return get_tags_by_id(ids)
     except Exception as e:
         logger.critical(f'Unable to fetch tags from database.')
         logger.error(e)
@@ -87,50 +164,52 @@ def get_file_paths():
     return file_paths
 
 
+def dictionary_vectorizer(dictionary):
+    """A vectorizer counting the occurrences of the words of a (v1) dictionary"""
+    return CountVectorizer(analyzer=NORMALIZER, vocabulary=[word for word, count in dictionary])
+
+
 # Create a data set for the classification
-def make_dataset(dictionary):
+def make_dataset(dictionary, tags=None):
     failed = []
-    features = []
     labels = []
-    tags = get_all_tags()
+    if tags is None:
+        tags = get_all_tags()
     if tags:
         logger.debug(f'Creating dataset from {len(tags)} entries')
-        for filepath, tag, text, hosts in progress_bar(tags):
-            try:
-                data = []
-                words = text.split()
-                for entry in dictionary:
-                    data.append(words.count(entry[0]))
-                features.append(data)
+
+        def documents():
+            for filepath, tag, text, hosts in progress_bar(tags):
+                if text is None:
+                    failed.append(filepath.replace(CLF_TRAININGDATA_PATH, ''))
+                    continue
                 labels.append(tag)
-            except AttributeError:
-                failed.append(filepath.replace(CLF_TRAININGDATA_PATH, ''))
-                pass
+                yield text
+
+        with profiling.stage('vectorize'):
+            features = dictionary_vectorizer(dictionary).transform(documents())
         if failed:
             warn_failed(failed)
-        
-    return features, labels
+        return features, labels
+
+    return [], labels
 
 
 # Make a dictionary of the most frequent words
-def make_dictionary():
+def make_dictionary(tags=None):
     failed = []
-    tags = get_all_tags()
-    words = []
+    if tags is None:
+        tags = get_all_tags()
     logger.debug('Creating dictionary..')
     if tags:
-        for filepath, tag, text, hosts in progress_bar(tags):
-            try:
-                words += text.split()
-            except AttributeError:
-                failed.append(filepath.replace(CLF_TRAININGDATA_PATH, ''))
-                pass
-
-        # Remove non-alphanumeric values
-        words = [word for word in words if word.isalpha()]
-
-        # Get the count of each word
-        dictionary = Counter(words)
+        dictionary = Counter()
+        with profiling.stage('dictionary'):
+            for filepath, tag, text, hosts in progress_bar(tags):
+                if text is None:
+                    failed.append(filepath.replace(CLF_TRAININGDATA_PATH, ''))
+                    continue
+                # Only keep alphabetic words
+                dictionary.update(word for word in NORMALIZER.tokenize(text) if word.isalpha())
 
         if failed:
             warn_failed(failed)
@@ -141,24 +220,6 @@ def make_dictionary():
         return None
 
 
-def create_dataframe(n=None):
-    labels = []
-    contents = []
-    if n:
-        tags = get_n_tags(n)
-    else:
-        tags = get_all_tags()
-    if tags:
-        for filepath, tag, text, hosts in progress_bar(tags):
-            contents.append(text)
-            labels.append(tag)
-
-        return pd.DataFrame(list(zip(labels, contents)), columns = ['label', 'message'])
-    else:
-        logger.error('No tags were found in the database.')
-        return None
-
-
 def __create_dataframe():
     failed = []
     labels = []
@@ -188,33 +249,149 @@ def __create_dataframe():
         return None
 
 
+def count_words(tags):
+    """Count the words of every document in a single streaming pass
+
+        The text is fed to the vectorizer straight from `tags`, which may be
+        a generator (see `iter_all_tags`), so the corpus is never copied.
+
+        Returns
+        -------
+        counts : sparse matrix
+        labels : numpy.ndarray
+        vectorizer : CountVectorizer
+    """
+    failed = []
+    labels = []
+
+    def documents():
+        for filepath, tag, text, hosts in progress_bar(tags):
+            if text is None:
+                failed.append(filepath.replace(CLF_TRAININGDATA_PATH, ''))
+                continue
+            labels.append(tag)
+            yield text
+
+    vectorizer = CountVectorizer(analyzer=NORMALIZER)
+    # Includes reading the stream of tags (also timed as `db.read`)
+    with profiling.stage('vectorize'):
+        counts = vectorizer.fit_transform(documents())
+    if failed:
+        warn_failed(failed)
+    logger.debug(f'Counted {counts.shape[1]} words in {counts.shape[0]} documents. Peak RSS: {peak_rss_mb()} MB')
+
+    return counts, np.asarray(labels), vectorizer
+
+
+def training_text_mode():
+    """The text mode of the training data (see `helpers.plaintext`), the most
+    common one if the database mixes several"""
+    modes = storage.text_modes()
+    if len(modes) > 1:
+        logger.warning(f'The database mixes text modes {modes}, re-ingest it with a single one. '
+                       f'Classifying with the most common one.')
+    return max(modes, key=modes.get) if modes else 'emailyzer'
+
+
+def create_dataframe(n=None):
+    """The tags (a stratified sample of `n` per category, or all of them) as a
+    DataFrame of `label` and `message`. Training streams them instead, see
+    `count_words`."""
+    tags = get_n_tags(n) if n else get_all_tags()
+    if not tags:
+        logger.error('No tags were found in the database.')
+        return None
+    return pd.DataFrame([(tag, text) for filepath, tag, text, hosts in tags], columns=['label', 'message'])
+
+
 def process_dataframe(df, algo='mnb'):
-    df['message'] = df.message.map(lambda val: val.lower())
-    df['message'] = df.message.str.replace('[^\w\s]', '')
-
-    # Count occurrences
-    vectorizer = CountVectorizer()
-    counts = vectorizer.fit_transform(df['message'])
-    save_vectorizer(vectorizer, algo=algo)
-    # Term Frequency Inverse Document Frequency
+    """Vectorize a DataFrame from `create_dataframe` like v2 training does
+    (`count_words`, then TF-IDF), and save the vectorizer for v2.
+    Rows without a message are dropped.
+
+        Returns
+        -------
+        counts : sparse matrix
+        df : pandas.DataFrame
+    """
+    df = df[df.message.notna()]
+    counts, _, vectorizer = count_words((None, label, message, None) for label, message in zip(df.label, df.message))
     transformer = TfidfTransformer().fit(counts)
-    counts = transformer.transform(counts)
+    tfidf = tfidf_vectorizer(vectorizer, transformer)
+    setattr(tfidf, plaintext.TEXT_MODE_ATTR, training_text_mode())
+    save_vectorizer(tfidf, version='v2')
+    return transformer.transform(counts), df
+
+
+def tfidf_vectorizer(vectorizer, transformer):
+    """Combine a fitted CountVectorizer and TfidfTransformer into a single
+    TfidfVectorizer, which is saved with the (v2) model so classification
+    applies the same IDF weights as training"""
+    tfidf = TfidfVectorizer(analyzer=vectorizer.analyzer, vocabulary=vocabulary_terms(vectorizer),
+                            **transformer.get_params())
+    tfidf.idf_ = transformer.idf_
+    return tfidf
+
+
+def vocabulary_terms(vectorizer):
+    """The terms of a vectorizer, in column order"""
+    vocabulary = getattr(vectorizer, 'vocabulary_', None) or vectorizer.vocabulary
+    if isinstance(vocabulary, dict):
+        return sorted(vocabulary, key=vocabulary.get)
+    return list(vocabulary)
+
+
+@profiling.timed('vectorize')
+def transform(vectorizer, words, version='v2'):
+    """Vectorize extracted words (like the `text` of `tags`) with a saved vectorizer"""
+    counts = vectorizer.transform(words)
+    if version == 'v2' and not isinstance(vectorizer, TfidfVectorizer):
+        # Vectorizers saved by older versions only count words
+        counts = TfidfTransformer().fit_transform(counts)
+    return counts
 
-    return counts, df
+
+def get_counts(input, version='v2', algo='mnb'):
+    """Vectorize a single text with the vectorizer saved for the model version"""
+    vectorizer = load_vectorizer(algo=algo, version=version)
+    if vectorizer is None:
+        return None
+    with profiling.stage('extract'):
+        text = plaintext.input_text(input, getattr(vectorizer, plaintext.TEXT_MODE_ATTR, None))
+    with profiling.stage('ner'):
+        words = list(ner.extract_batch([text]))
+    return transform(vectorizer, words, version=version)
 
 
 def get_tfidf_counts(input, algo='mnb'):
-    words = juicer.extract_stanford(input, named_only=False, stemming=False)
-    text = words.lower()
-    text = text.replace('[^\w\s]', '')
+    return get_counts(input, version='v2', algo=algo)
 
-    vectorizer = load_vectorizer(algo=algo)
-    counts = vectorizer.transform([text])
 
-    # Term Frequency Inverse Document Frequency
-    transformer = TfidfTransformer().fit(counts)
-    counts = transformer.transform(counts)
-    return counts
+def get_counts_many(inputs, version='v2', algo='mnb'):
+    """Vectorize many texts at once, extracting their entities in NER batches
+    (see `helpers.ner`) instead of one tagger call per text"""
+    vectorizer = load_vectorizer(algo=algo, version=version)
+    if vectorizer is None:
+        return None
+    text_mode = getattr(vectorizer, plaintext.TEXT_MODE_ATTR, None)
+    with profiling.stage('extract'):
+        texts = [plaintext.input_text(input, text_mode) for input in inputs]
+    with profiling.stage('ner'):
+        words = list(ner.extract_batch(texts))
+    return transform(vectorizer, words, version=version)
+
+
+def sort_by_frequency(counts, vocabulary):
+    """Reorder the columns of a count matrix by descending corpus frequency,
+    so that the first `k` columns hold the `k` most common terms.
+    Returns the reordered matrix (CSC, cheap to slice by column) and the terms.
+    `vocabulary` is a fitted `CountVectorizer.vocabulary_` mapping.
+    """
+    freqs = np.asarray(counts.sum(axis=0)).ravel()
+    order = np.argsort(-freqs, kind='stable')
+    columns = sorted(vocabulary, key=vocabulary.get)
+    terms = [columns[i] for i in order]
+    return counts.tocsc()[:, order], terms
 
 
 def standardize(x_train, x_test):
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Manifest of the ingested email files, so ingestion only parses what changed.
+
+Each file is recorded with its size, mtime and content hash. A file whose
+size and mtime are unchanged is skipped without being read, and one that was
+only touched (same hash) is not parsed again.
+
+Each ingester keeps its own entries: `ingest` (dataset_generator), which
+parses the text, and `autotagger`, which only stores the tags. A file only
+counts as ingested by `ingest` once its text is stored, whoever wrote its row.
+
+Files are recorded in the same transaction as their rows, so the manifest is
+also the checkpoint of an interrupted run. The `ingest_runs` table keeps the
+progress of each run. Both tables are created by `storage.migrate`.
+"""
+import hashlib
+import os
+
+from katatasso.helpers.utils import progress_bar
+
+
+def file_hash(filepath, block_size=1 << 20):
+    """SHA-1 of the contents of a file"""
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan(conn, tags, ingester='ingest', parsed=True):
+    """Compare the files on disk with the manifest
+
+        Parameters
+        ----------
+        conn : sqlite3.Connection
+
+        tags : list of (filepath, tag)
+            The files on disk
+
+        ingester : str
+            Whose manifest entries to compare with
+
+        parsed : bool
+            Whether the ingester stores the text of the files. If so, a file
+            whose row has no text (e.g. one stored by the autotagger) is parsed.
+
+        Returns
+        -------
+        pending : list of (filepath, tag)
+            New and changed files, to be parsed
+        entries : dict
+            filepath => (size, mtime, hash) of the pending files,
+            to be recorded with `record` once they are stored
+        deleted : list of str
+            Files in the database that are no longer on disk
+        summary : dict
+            Number of new, changed, unchanged and deleted files
+    """
+    text = ' AND t.text IS NOT NULL' if parsed else ''
+    c = conn.cursor()
+    c.execute('SELECT m.filepath, m.size, m.mtime, m.hash FROM manifest m JOIN tags t ON t.filepath = m.filepath '
+              f'WHERE m.ingester=?{text}', (ingester,))
+    known = {row[0]: row[1:] for row in c.fetchall()}
+    c.execute('SELECT filepath FROM manifest WHERE ingester=?', (ingester,))
+    recorded = {row[0] for row in c.fetchall()}
+    # Rows stored before the manifest existed, or by another ingester, are adopted as they
+    # are. Messages of archives are tracked by their source file instead (see `helpers.sources`).
+    c.execute('SELECT t.filepath FROM tags t WHERE t.source IS NULL '
+              f'AND t.filepath NOT IN (SELECT filepath FROM manifest WHERE ingester=?){text}', (ingester,))
+    legacy = {row[0] for row in c.fetchall()}
+
+    pending = []
+    entries = {}
+    adopted = []
+    summary = {'new': 0, 'changed': 0, 'unchanged': 0, 'deleted': 0}
+    for filepath, tag in progress_bar(tags):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            continue
+        if filepath in known:
+            size, mtime, digest = known[filepath]
+            if (size, mtime) == (stat.st_size, stat.st_mtime):
+                summary['unchanged'] += 1
+                continue
+        try:
+            entry = (stat.st_size, stat.st_mtime, file_hash(filepath))
+        except OSError:
+            continue
+        if filepath in legacy:
+            adopted.append((filepath, *entry))
+            summary['unchanged'] += 1
+        elif filepath not in known:
+            pending.append((filepath, tag))
+            entries[filepath] = entry
+            summary['new'] += 1
+        elif known[filepath][2] == entry[2]:
+            # Touched, but the contents are the same
+            adopted.append((filepath, *entry))
+            summary['unchanged'] += 1
+        else:
+            pending.append((filepath, tag))
+            entries[filepath] = entry
+            summary['changed'] += 1
+
+    if adopted:
+        c.executemany('INSERT OR REPLACE INTO manifest (ingester, filepath, size, mtime, hash) VALUES (?,?,?,?,?)',
+                      [(ingester, *entry) for entry in adopted])
+        conn.commit()
+
+    on_disk = {filepath for filepath, _ in tags}
+    deleted = [filepath for filepath in recorded | legacy if filepath not in on_disk]
+    summary['deleted'] = len(deleted)
+    return pending, entries, deleted, summary
+
+
+def record(conn, entries, filepaths, ingester='ingest'):
+    """Record the stored files in the manifest of `ingester` (without committing)"""
+    conn.executemany(
+        'INSERT OR REPLACE INTO manifest (ingester, filepath, size, mtime, hash) VALUES (?,?,?,?,?)',
+        [(ingester, filepath, *entries[filepath]) for filepath in filepaths]
+    )
+
+
+def last_run(conn):
+    """The latest ingestion run, or None"""
+    c = conn.cursor()
+    c.execute('SELECT id, started, pending, stored, finished FROM ingest_runs ORDER BY id DESC LIMIT 1')
+    row = c.fetchone()
+    if row is None:
+        return None
+    return dict(zip(('id', 'started', 'pending', 'stored', 'finished'), row))
+
+
+def start_run(conn, pending):
+    c = conn.cursor()
+    c.execute("INSERT INTO ingest_runs (started, pending) VALUES (datetime('now'), ?)", (pending,))
+    conn.commit()
+    return c.lastrowid
+
+
+def checkpoint(conn, run, stored):
+    """Count `stored` rows towards the run (without committing)"""
+    conn.execute('UPDATE ingest_runs SET stored=stored+? WHERE id=?', (stored, run))
+
+
+def finish_run(conn, run):
+    conn.execute("UPDATE ingest_runs SET finished=datetime('now') WHERE id=?", (run,))
+    conn.commit()
+
+
+def prune(conn, deleted):
+    """Remove deleted files from `tags` and the manifest"""
+    c = conn.cursor()
+    c.executemany('DELETE FROM tags WHERE filepath=?', [(filepath,) for filepath in deleted])
+    c.executemany('DELETE FROM manifest WHERE filepath=?', [(filepath,) for filepath in deleted])
+    conn.commit()
+
+
+def print_summary(summary, failed=0, pruned=False):
+    deleted = 'removed' if pruned else 'kept, use --prune to remove'
+    print(f'''Ingestion:
+    => New:         {summary['new']}
+    => Changed:     {summary['changed']}
+    => Unchanged:   {summary['unchanged']}
+    => Deleted:     {summary['deleted']} ({deleted})
+    => Failed:      {failed}
+    ''')
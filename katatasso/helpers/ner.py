@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batched named entity recognition.
+
+`juicer.extract_stanford` tags one document per call, and every call pays a
+round-trip to the Stanford NER (Java) tagger. Here the sentences of many
+documents are tagged in a single `tag_sents` call, through a tagger that is
+loaded once per process, and the results are split back per document.
+
+See `modules.metrics.ner_benchmark` for the throughput of both.
+"""
+import re
+import sys
+
+from katatasso.helpers.const import CLF_NER_BATCH
+from katatasso.helpers.logger import rootLogger as logger
+
+try:
+    import juicer
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+# End of a sentence: punctuation followed by whitespace, or a blank line
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+# Words (keeping contractions like `don't` whole) and punctuation
+_TOKEN = re.compile(r"\w+(?:'\w+)*|[^\w\s]")
+
+# The tagger of this process, loaded once by `get_tagger`
+_tagger = None
+
+
+def get_tagger():
+    """The Stanford NER tagger of this process, loaded on first use"""
+    global _tagger
+    if _tagger is None:
+        _tagger = juicer.initStanfordNERTagger()
+    return _tagger
+
+
+def sentences(text):
+    """Split a text into sentences of tokens"""
+    tokenized = (_TOKEN.findall(sentence) for sentence in _SENTENCE_END.split(text or ''))
+    return [tokens for tokens in tokenized if tokens]
+
+
+def tag_documents(texts, tagger=None, batch_size=CLF_NER_BATCH):
+    """Tag the tokens of many documents, `batch_size` documents per tagger call
+
+        Parameters
+        ----------
+        texts : iterable of str
+
+        tagger : nltk.tag.StanfordNERTagger
+            (Default: the tagger of this process)
+
+        batch_size : int
+            Number of documents tagged in one call
+
+        Yields
+        ------
+        tagged : list of (token, label)
+            The tagged tokens of each document, in order
+    """
+    tagger = tagger or get_tagger()
+    batch = []
+
+    def flush():
+        # Each document's sentences are a contiguous slice of the batch
+        bounds = [0]
+        flat = []
+        for doc in batch:
+            flat.extend(doc)
+            bounds.append(len(flat))
+        tagged = tagger.tag_sents(flat) if flat else []
+        for start, end in zip(bounds, bounds[1:]):
+            yield [pair for sentence in tagged[start:end] for pair in sentence]
+        batch.clear()
+
+    for text in texts:
+        batch.append(sentences(text))
+        if len(batch) >= batch_size:
+            yield from flush()
+    if batch:
+        yield from flush()
+
+
+def extract_batch(texts, tagger=None, named_only=False, batch_size=CLF_NER_BATCH):
+    """Batched counterpart of `juicer.extract_stanford`
+
+        Yields
+        ------
+        words : str
+            The tokens of each document (only the named entities if
+            `named_only`), separated by spaces
+    """
+    for tagged in tag_documents(texts, tagger=tagger, batch_size=batch_size):
+        yield ' '.join(token for token, label in tagged if not named_only or label != 'O')
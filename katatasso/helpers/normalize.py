@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+
+# Everything that is neither a word character nor whitespace
+_PUNCTUATION = re.compile(r'[^\w\s]')
+# Words of at least two characters (scikit-learn's default token pattern)
+_TOKEN = re.compile(r'\w\w+')
+
+
+class Normalizer(object):
+    """Normalizes and tokenizes text the same way for ingestion, training
+    and classification.
+
+    Text is lowercased and stripped of punctuation (so `don't` becomes `dont`),
+    then split into words of at least two characters. An instance is callable,
+    and is used as the `analyzer` of the vectorizers, so it is pickled along
+    with them and classification always tokenizes like the model was trained.
+    """
+    # Bump when the output changes, to invalidate cached features
+    version = 1
+
+    def normalize(self, text):
+        """Lowercase the text and strip punctuation"""
+        return _PUNCTUATION.sub('', text.lower())
+
+    def tokenize(self, text):
+        """Normalize the text and split it into words"""
+        return _TOKEN.findall(self.normalize(text))
+
+    def batch(self, texts):
+        """Tokenize an iterable of texts, yielding one list of words per text"""
+        for text in texts:
+            yield self.tokenize(text)
+
+    def __call__(self, text):
+        return self.tokenize(text)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.version == other.version
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.version))
+
+    def __repr__(self):
+        return f'{type(self).__name__}(version={self.version})'
+
+
+NORMALIZER = Normalizer()
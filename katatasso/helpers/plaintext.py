@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fast extraction of the text of an email.
+
+Two text modes are supported, for ingestion as well as classification:
+    emailyzer   the HTML body rendered to text by `emailyzer` (`html_as_text`)
+    fast        the `text/plain` part if there is one, otherwise the HTML
+                body converted by `html_to_text`, in a single regex pass
+
+The mode of the training data is saved with the model (see `TEXT_MODE_ATTR`),
+so an email is classified with the same extraction it was trained on.
+"""
+import re
+from email import errors, policy
+from email.parser import BytesParser, Parser
+from html import unescape
+from urllib.parse import urlsplit
+
+TEXT_MODES = ['emailyzer', 'fast']
+# Attribute of a saved vectorizer holding the text mode of its training data
+TEXT_MODE_ATTR = 'text_mode'
+
+# One alternative per kind of HTML token. Comments and the contents of
+# <script>/<style> are dropped, tags become whitespace, and text is kept.
+_HTML_TOKEN = re.compile(
+    r'<!--.*?(?:-->|$)'
+    r'|<(script|style)\b[^>]*>.*?(?:</\1\s*>|$)'
+    r'|<[!?/]?[a-zA-Z][^>]*>'
+    r'|([^<]+|<)',
+    re.IGNORECASE | re.DOTALL
+)
+_MARKUP = re.compile(r'<[!/]?[a-zA-Z][^>]*>')
+_WHITESPACE = re.compile(r'\s+')
+_URL = re.compile(r'https?://[^\s"\'<>]+', re.IGNORECASE)
+# Headers telling a raw email from text whose first line reads like one (`Urgent: ...`)
+_MAIL_HEADERS = {'from', 'to', 'subject', 'date', 'content-type', 'mime-version'}
+
+
+def html_to_text(html):
+    """Convert HTML to text in one pass: drop comments, `<script>` and
+    `<style>`, decode entities, and collapse whitespace"""
+    text = ' '.join(match.group(2) for match in _HTML_TOKEN.finditer(html) if match.group(2))
+    return _WHITESPACE.sub(' ', unescape(text)).strip()
+
+
+def _hosts(*bodies):
+    hosts = []
+    for body in bodies:
+        for url in _URL.findall(body or ''):
+            host = urlsplit(url).hostname
+            if host and host not in hosts:
+                hosts.append(host)
+    return hosts
+
+
+def message_text(message, prefer_plain=True):
+    """The text content of a message, and the hosts it links to
+
+        Parameters
+        ----------
+        message : bytes, str or email.message.EmailMessage
+            A raw email, or a parsed one
+
+        prefer_plain : bool
+            Use the `text/plain` part when there is one. Otherwise the
+            HTML part is preferred, like `emailyzer`'s `html_as_text`.
+
+        Returns
+        -------
+        content : str
+        hosts : list of str
+    """
+    if isinstance(message, bytes):
+        message = BytesParser(policy=policy.default).parsebytes(message)
+    elif isinstance(message, str):
+        message = Parser(policy=policy.default).parsestr(message)
+    html = message.get_body(preferencelist=('html',))
+    plain = message.get_body(preferencelist=('plain',))
+    html = html.get_content() if html is not None else None
+    plain = plain.get_content() if plain is not None else None
+
+    if plain is not None and (prefer_plain or html is None):
+        content = _WHITESPACE.sub(' ', plain).strip()
+    elif html is not None:
+        content = html_to_text(html)
+    else:
+        content = ''
+    return content, _hosts(html, plain)
+
+
+def _is_email(message):
+    """Whether parsing found a raw email: mail headers, or headers followed
+    by a blank line and a body"""
+    if any(key.lower() in _MAIL_HEADERS for key in message.keys()):
+        return True
+    separated = not any(isinstance(defect, errors.MissingHeaderBodySeparatorDefect) for defect in message.defects)
+    return bool(message.keys()) and separated and bool(str(message.get_payload()).strip())
+
+
+def input_text(input, text_mode=None):
+    """The text to classify, extracted from `input` the way the model's
+    training data was (see `TEXT_MODE_ATTR`)
+
+        In `fast` mode, a raw email is reduced to its text like at ingestion,
+        and an HTML fragment to its text. Otherwise, and for models trained
+        by older versions, the input is used as given.
+    """
+    if text_mode != 'fast' or not input:
+        return input
+    message = Parser(policy=policy.default).parsestr(input)
+    if _is_email(message):
+        return message_text(message)[0]
+    if _MARKUP.search(input):
+        return html_to_text(input)
+    return _WHITESPACE.sub(' ', input).strip()
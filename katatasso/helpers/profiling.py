@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stage timings of ingestion, training and classification (`--profile`).
+
+    with profiling.stage('ner'):
+        words = ...
+
+    @profiling.timed('fit')
+    def fit(...):
+
+Every run of a stage records its duration (`time.perf_counter_ns`), and
+`report` summarizes them per stage: count, total, p50 and p99. Profiling is
+off unless `enable` is called or `CLF_PROFILE` is set, and a disabled stage
+is a shared no-op context manager, so the instrumentation can stay in hot
+loops.
+
+Worker processes of the ingestion pool inherit `CLF_PROFILE`, and send their
+timings back with their results (see `drain` and `merge`).
+"""
+import array
+import collections
+import cProfile
+import functools
+import json
+import os
+import time
+
+from katatasso.helpers.const import CLF_PROFILE, CLF_PROFILE_FILE
+
+_enabled = CLF_PROFILE
+# stage => durations in nanoseconds
+_durations = collections.defaultdict(lambda: array.array('q'))
+_profiler = None
+_pstats_file = None
+
+
+class _Stage:
+    __slots__ = ('durations', 'start')
+
+    def __init__(self, name):
+        self.durations = _durations[name]
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.durations.append(time.perf_counter_ns() - self.start)
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def enabled():
+    return _enabled
+
+
+def enable(pstats_file=None):
+    """Start recording stage timings, and a cProfile of this process if
+    `pstats_file` is given (written by `finish`)"""
+    global _enabled, _profiler, _pstats_file
+    _enabled = True
+    # Inherited by the worker processes started from now on
+    os.environ['CLF_PROFILE'] = '1'
+    if pstats_file:
+        _pstats_file = pstats_file
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def stage(name):
+    """A context manager timing one run of the stage `name`"""
+    return _Stage(name) if _enabled else _NO_STAGE
+
+
+def timed(name):
+    """Decorator timing every call of a function as the stage `name`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def iterate(name, iterable):
+    """Time every step of an iterator as the stage `name`, e.g. to time the
+    reads of rows streamed from the database apart from their processing"""
+    if not _enabled:
+        return iterable
+    return _iterate(_durations[name], iter(iterable))
+
+
+def _iterate(durations, it):
+    clock = time.perf_counter_ns
+    while True:
+        start = clock()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        durations.append(clock() - start)
+        yield item
+
+
+def drain():
+    """The timings recorded so far (stage => list of ns), which are reset"""
+    timings = {name: durations.tolist() for name, durations in _durations.items() if durations}
+    _durations.clear()
+    return timings
+
+
+def merge(timings):
+    """Add the timings drained in another process"""
+    for name, durations in timings.items():
+        _durations[name].extend(durations)
+
+
+def _percentile(ordered, q):
+    # Nearest rank
+    return ordered[max(0, -(-len(ordered) * q // 100) - 1)]
+
+
+def report():
+    """Summary of each stage, the longest first
+
+        Returns
+        -------
+        stages : dict
+            stage => {count, total_s, p50_ms, p99_ms}
+    """
+    stages = {}
+    for name, durations in _durations.items():
+        if not durations:
+            continue
+        ordered = sorted(durations)
+        stages[name] = {
+            'count': len(ordered),
+            'total_s': round(sum(ordered) / 1e9, 4),
+            'p50_ms': round(_percentile(ordered, 50) / 1e6, 4),
+            'p99_ms': round(_percentile(ordered, 99) / 1e6, 4)
+        }
+    return dict(sorted(stages.items(), key=lambda item: -item[1]['total_s']))
+
+
+def finish(path=CLF_PROFILE_FILE):
+    """Write the stage breakdown to `path` (and the cProfile, if any).
+    Returns the breakdown as JSON, or None if profiling is disabled."""
+    global _profiler
+    if not _enabled:
+        return None
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_pstats_file)
+        _profiler = None
+    breakdown = json.dumps(report(), indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(breakdown + '\n')
+    return breakdown
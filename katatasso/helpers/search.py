@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Full-text search over the emails of the database, for bulk tagging.
+
+The text and hosts of `tags` are indexed in the FTS5 table `tags_fts`
+(created by `storage.migrate`). Queries use the FTS5 syntax, e.g.
+`invoice AND hosts:"evil.example.org"`.
+
+Emails similar to a given one are found in two steps: the full-text index
+ranks the emails sharing its most distinctive terms (by tf-idf), and the
+best `CLF_SEARCH_CANDIDATES` of them are kept if the Jaccard similarity of
+their words with the email's is at least the threshold.
+"""
+import math
+import re
+from collections import Counter
+
+from katatasso.helpers import storage
+from katatasso.helpers.const import (CLF_SEARCH_CANDIDATES,
+                                     CLF_SEARCH_SIMILARITY, CLF_SEARCH_TERMS)
+
+# Close to the `unicode61` tokenizer of the index
+_WORD = re.compile(r'\w+')
+
+
+def available():
+    """Whether the database has the full-text index"""
+    conn = storage.connect()
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name='tags_fts'").fetchone() is not None
+
+
+def _words(text):
+    return _WORD.findall((text or '').lower())
+
+
+def match(query, tag=None, limit=None):
+    """The emails matching a full-text query, best first
+
+        Parameters
+        ----------
+        query : str
+            An FTS5 query. Raises sqlite3.OperationalError if it is invalid.
+
+        tag : int
+            Only the emails with this tag
+
+        limit : int
+            Maximum number of results. (Default: All)
+
+        Returns
+        -------
+        results : list of (id, filepath, tag, snippet)
+    """
+    sql = ("SELECT t.id, t.filepath, t.tag, snippet(tags_fts, 0, '[', ']', '...', 12) "
+           'FROM tags_fts JOIN tags t ON t.id = tags_fts.rowid WHERE tags_fts MATCH ?')
+    params = [query]
+    if tag is not None:
+        sql += ' AND t.tag = ?'
+        params.append(tag)
+    sql += ' ORDER BY rank'
+    if limit:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return storage.connect().execute(sql, params).fetchall()
+
+
+def similar_query(id, k=CLF_SEARCH_TERMS):
+    """A full-text query for the `k` most distinctive terms of an email, or None"""
+    conn = storage.connect()
+    row = conn.execute('SELECT text FROM tags WHERE id=?', (id,)).fetchone()
+    counts = Counter(word for word in _words(row[0] if row else None) if len(word) > 2 and not word.isdigit())
+    if not counts:
+        return None
+    total = conn.execute('SELECT COUNT(*) FROM tags_fts').fetchone()[0]
+    terms = list(counts)
+    df = {}
+    for i in range(0, len(terms), 500):
+        chunk = terms[i:i + 500]
+        df.update(conn.execute(
+            f'SELECT term, doc FROM tags_fts_vocab WHERE term IN ({",".join("?" * len(chunk))})', chunk
+        ).fetchall())
+    weights = {term: n * math.log((total + 1) / (df.get(term, 0) + 1)) for term, n in counts.items()}
+    top = sorted(weights, key=lambda term: (-weights[term], term))[:k]
+    return 'text : (' + ' OR '.join(f'"{term}"' for term in top) + ')'
+
+
+def similar(id, threshold=CLF_SEARCH_SIMILARITY, tag=None, limit=None, candidates=CLF_SEARCH_CANDIDATES):
+    """The emails similar to an email (itself included), most similar first
+
+        Parameters
+        ----------
+        id : int
+            The `tags.id` of the email
+
+        threshold : float
+            Minimum Jaccard similarity of the words of the emails
+
+        tag : int
+            Only the emails with this tag
+
+        limit : int
+            Maximum number of results. (Default: All)
+
+        candidates : int
+            Number of the best full-text matches that are compared
+
+        Returns
+        -------
+        results : list of (id, filepath, tag, similarity)
+    """
+    query = similar_query(id)
+    if query is None:
+        return []
+    conn = storage.connect()
+    words = set(_words(conn.execute('SELECT text FROM tags WHERE id=?', (id,)).fetchone()[0]))
+    sql = ('SELECT t.id, t.filepath, t.tag, t.text FROM tags_fts JOIN tags t ON t.id = tags_fts.rowid '
+           'WHERE tags_fts MATCH ?')
+    params = [query]
+    if tag is not None:
+        sql += ' AND t.tag = ?'
+        params.append(tag)
+    sql += ' ORDER BY rank LIMIT ?'
+    params.append(candidates)
+
+    results = []
+    for row_id, filepath, row_tag, text in conn.execute(sql, params):
+        other = set(_words(text))
+        similarity = len(words & other) / len(words | other) if words | other else 0
+        if similarity >= threshold:
+            results.append((row_id, filepath, row_tag, round(similarity, 3)))
+    results.sort(key=lambda result: -result[3])
+    return results[:limit] if limit else results
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+
+from katatasso.helpers.logger import rootLogger as logger
+
+try:
+    from sklearn.feature_selection import chi2, mutual_info_classif
+    import numpy as np
+    import scipy.sparse as sp
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+SELECTION_METHODS = ['chi2', 'mi', 'logodds']
+
+
+def _log_odds(X, y, alpha=1.0):
+    """Largest absolute z-scored log-odds ratio of each feature between
+    a class and the rest (Monroe et al., 2008)"""
+    totals = np.asarray(X.sum(axis=0)).ravel()
+    scores = np.zeros(X.shape[1])
+    for cat in np.unique(y):
+        inside = np.asarray(X[y == cat].sum(axis=0)).ravel()
+        outside = totals - inside
+        n_in, n_out = inside.sum(), outside.sum()
+        delta = np.log((inside + alpha) / (n_in - inside + alpha)) \
+            - np.log((outside + alpha) / (n_out - outside + alpha))
+        var = 1 / (inside + alpha) + 1 / (outside + alpha)
+        scores = np.maximum(scores, np.abs(delta / np.sqrt(var)))
+    return scores
+
+
+def score_features(X, y, method='chi2'):
+    """Score how informative each feature (column) is about the labels
+
+        Parameters
+        ----------
+        X : sparse matrix, shape (n_samples, n_features)
+            Non-negative feature matrix (counts or TF-IDF)
+
+        y : array-like, shape (n_samples)
+
+        method : str
+            `chi2` (chi-squared), `mi` (mutual information),
+            or `logodds` (per-class log-odds ratio)
+
+        Returns
+        -------
+        scores : numpy.ndarray, shape (n_features)
+    """
+    X = sp.csr_matrix(X)
+    y = np.asarray(y)
+    if method == 'chi2':
+        scores, _ = chi2(X, y)
+    elif method == 'mi':
+        scores = mutual_info_classif(X, y, discrete_features=True, random_state=0)
+    elif method == 'logodds':
+        scores = _log_odds(X, y)
+    else:
+        logger.critical(f'Unknown feature selection method `{method}`. Defaulting to `chi2`.')
+        scores, _ = chi2(X, y)
+    return np.nan_to_num(scores)
+
+
+def top_features(scores, k):
+    """Column indices of the `k` highest scoring features, in column order"""
+    k = min(k, len(scores))
+    return np.sort(np.argsort(-scores, kind='stable')[:k])
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ingestion sources for email archives: mbox files and Maildirs.
+
+Messages are streamed out of the archive one at a time, without extracting
+them to individual files or loading the whole archive. A source is given as
+
+    <kind>:<path>[=<category>]
+
+e.g. `mbox:archive/spam.mbox=spam` or `maildir:~/Maildir`. Without a category,
+each folder (or mbox file) is mapped to the category of the same name, e.g.
+`.Phishing` or `phish.mbox` to `phishing`, and folders without one are skipped.
+
+Every message is stored with its source and its offset in the source
+(the byte offset of an mbox message), under a `filepath` of `<source>#<key>`.
+"""
+import os
+
+from katatasso.helpers.const import CATEGORIES
+from katatasso.helpers.logger import rootLogger as logger
+
+SOURCE_KINDS = ['mbox', 'maildir']
+
+# Folder and file names of each category, besides the names in CATEGORIES
+CATEGORY_ALIASES = {
+    'legit': 0,
+    'ham': 0,
+    'inbox': 0,
+    'spam2': 1,
+    'junk': 1,
+    'phish': 2,
+}
+
+
+def category_of(name):
+    """The category of a folder or file name, or None"""
+    name = os.path.basename(os.path.normpath(name)).lstrip('.').lower()
+    name = os.path.splitext(name)[0] if name.endswith('.mbox') else name
+    # Maildir++ subfolders are named `.Parent.Child`
+    name = name.split('.')[-1]
+    for tag, category in CATEGORIES.items():
+        if name == category:
+            return tag
+    return CATEGORY_ALIASES.get(name)
+
+
+def parse_spec(spec):
+    """Parse a source specification
+
+        Returns
+        -------
+        (kind, path, category) : (str, str, int or None)
+    """
+    kind, _, rest = spec.partition(':')
+    path, _, category = rest.partition('=')
+    if kind not in SOURCE_KINDS or not path:
+        raise ValueError(f'Invalid source `{spec}`, expected `<{"|".join(SOURCE_KINDS)}>:<path>[=<category>]`')
+    path = os.path.expanduser(path)
+    if category:
+        tag = int(category) if category.lstrip('-').isnumeric() else category_of(category)
+        if tag not in CATEGORIES:
+            raise ValueError(f'Unknown category `{category}` in source `{spec}`')
+        return kind, path, tag
+    return kind, path, None
+
+
+def iter_mbox(path, category=None):
+    """Stream the messages of an mbox file
+
+        Yields
+        ------
+        (filepath, tag, raw, source, offset)
+            `offset` is the byte offset of the message's `From ` line
+    """
+    tag = category_of(path) if category is None else category
+    if tag is None:
+        logger.warning(f'No category for `{path}`, skipping it. Specify one, e.g. `mbox:{path}=spam`')
+        return
+    with open(path, 'rb') as f:
+        offset = 0
+        start = None
+        lines = []
+        blank = True
+        for line in f:
+            if line.startswith(b'From ') and blank:
+                if start is not None:
+                    yield (f'{path}#{start}', tag, b''.join(lines), path, start)
+                start = offset
+                lines = []
+            elif start is not None:
+                lines.append(line)
+            blank = line in (b'\n', b'\r\n')
+            offset += len(line)
+        if start is not None:
+            yield (f'{path}#{start}', tag, b''.join(lines), path, start)
+
+
+def _maildir_folders(path):
+    """The Maildir folders under `path` (any directory with `cur` and `new`)"""
+    for root, dirs, _ in os.walk(path):
+        if 'cur' in dirs and 'new' in dirs:
+            yield root
+        dirs[:] = [d for d in dirs if d not in ('cur', 'new', 'tmp')]
+
+
+def iter_maildir(path, category=None):
+    """Stream the messages of a Maildir and its subfolders
+
+        Yields
+        ------
+        (filepath, tag, raw, source, offset)
+            `offset` is the message's position in its folder listing
+    """
+    for folder in _maildir_folders(path):
+        tag = category_of(folder) if category is None else category
+        if tag is None:
+            logger.warning(f'No category for the Maildir folder `{folder}`, skipping it')
+            continue
+        offset = 0
+        for subdir in ('cur', 'new'):
+            with os.scandir(os.path.join(folder, subdir)) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    if not entry.is_file():
+                        continue
+                    # The flags after `:` change when a message is read
+                    key = entry.name.split(':')[0]
+                    with open(entry.path, 'rb') as f:
+                        yield (f'{folder}#{key}', tag, f.read(), folder, offset)
+                    offset += 1
+
+
+def iter_source(spec):
+    """Stream the messages of a source specification (see `parse_spec`)"""
+    kind, path, category = parse_spec(spec)
+    if kind == 'mbox':
+        return iter_mbox(path, category)
+    return iter_maildir(path, category)
+
+
+def source_names(spec):
+    """The `source` of the messages of a source specification:
+    the mbox file, or each folder of the Maildir"""
+    kind, path, _ = parse_spec(spec)
+    if kind == 'mbox':
+        return [path]
+    return list(_maildir_folders(path))
+
+
+def source_paths(spec):
+    """The files or directories a source reads, to detect changes"""
+    kind, path, _ = parse_spec(spec)
+    if kind == 'mbox':
+        return [path]
+    return [os.path.join(folder, subdir) for folder in _maildir_folders(path) for subdir in ('cur', 'new')]
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shared access to the tagging database.
+
+Every module gets its connection from `connect()`, which reuses one
+connection per thread and database file, sets the pragmas, and brings the
+schema up to date. The schema version is kept in `PRAGMA user_version`, and
+each entry of `MIGRATIONS` upgrades it by one. Migrations are idempotent,
+since databases created by older versions have version 0 but may already
+contain some of the tables.
+"""
+import collections
+import sqlite3
+import threading
+import time
+
+from katatasso.helpers.const import CLF_DB_BUSY_TIMEOUT, DBFILE
+from katatasso.helpers.logger import rootLogger as logger
+
+_local = threading.local()
+_migrated = set()
+_lock = threading.Lock()
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def _create_tags(conn):
+    conn.execute('CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY AUTOINCREMENT, filepath TEXT NOT NULL, '
+                 'tag INTEGER, text TEXT, hosts TEXT)')
+    # Created by the tagger or autotagger, which didn't store the text
+    columns = _columns(conn, 'tags')
+    for column in ('text', 'hosts'):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE tags ADD COLUMN {column} TEXT')
+
+
+def _backup(conn):
+    """Copy the database next to it, as `<file>.<timestamp>.bak`. Returns the copy, or None in memory."""
+    path = conn.execute('PRAGMA database_list').fetchone()[2]
+    if not path:
+        return None
+    backup = f'{path}.{time.strftime("%Y%m%d%H%M%S")}.bak'
+    dst = sqlite3.connect(backup)
+    try:
+        conn.backup(dst)
+    finally:
+        dst.close()
+    return backup
+
+
+def _merge_duplicates(conn):
+    """Merge the rows of each file stored several times (by the tagger, the
+    autotagger and ingestion) into one: the latest row with text, with the
+    latest tag set by the tagger, i.e. on a row without text, if any"""
+    duplicated = [row[0] for row in conn.execute('SELECT filepath FROM tags GROUP BY filepath HAVING COUNT(*) > 1')]
+    if not duplicated:
+        return
+    backup = _backup(conn)
+    removed = 0
+    for filepath in duplicated:
+        rows = conn.execute('SELECT id, tag, text FROM tags WHERE filepath=? ORDER BY id', (filepath,)).fetchall()
+        keep = ([row for row in rows if row[2] is not None] or rows)[-1]
+        tags = [tag for _, tag, text in rows if text is None and tag is not None and tag != -1]
+        conn.execute('UPDATE tags SET tag=? WHERE id=?', (tags[-1] if tags else keep[1], keep[0]))
+        removed += conn.execute('DELETE FROM tags WHERE filepath=? AND id != ?', (filepath, keep[0])).rowcount
+    logger.warning(f'Merged {removed} duplicated rows of {len(duplicated)} files in `tags`'
+                   + (f', the database was backed up to `{backup}`' if backup else ''))
+
+
+def _index_tags(conn):
+    _merge_duplicates(conn)
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_tags_filepath ON tags (filepath)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tags_tag ON tags (tag, id)')
+
+
+def _create_manifest(conn):
+    # Each ingester (see helpers/manifest.py) records the files it stored in its own entries
+    conn.execute("CREATE TABLE IF NOT EXISTS manifest (ingester TEXT NOT NULL DEFAULT 'ingest', filepath TEXT NOT NULL, "
+                 'size INTEGER, mtime REAL, hash TEXT, PRIMARY KEY (ingester, filepath))')
+    conn.execute('CREATE TABLE IF NOT EXISTS ingest_runs (id INTEGER PRIMARY KEY AUTOINCREMENT, started TEXT, '
+                 'pending INTEGER, stored INTEGER DEFAULT 0, finished TEXT)')
+
+
+def _add_source(conn):
+    # Messages streamed out of an archive (see helpers/sources.py)
+    columns = _columns(conn, 'tags')
+    for column, type in (('source', 'TEXT'), ('source_offset', 'INTEGER')):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE tags ADD COLUMN {column} {type}')
+
+
+def _add_text_mode(conn):
+    # The text extraction of each row (see helpers/plaintext.py). NULL is `emailyzer`.
+    if 'text_mode' not in _columns(conn, 'tags'):
+        conn.execute('ALTER TABLE tags ADD COLUMN text_mode TEXT')
+
+
+def _create_watch_cursors(conn):
+    # The directories seen by the watch mode (see helpers/watch.py), one set
+    # of cursors per watcher, e.g. ingestion and the tagging server
+    conn.execute("CREATE TABLE IF NOT EXISTS watch_cursors (watcher TEXT NOT NULL DEFAULT 'ingest', path TEXT NOT NULL, "
+                 'parent TEXT, mtime_ns INTEGER, inode INTEGER, PRIMARY KEY (watcher, path))')
+
+
+def _add_uncertainty(conn):
+    # Active learning: how uncertain the model is about an untagged email,
+    # and the model that scored it (see modules/active_learning.py)
+    columns = _columns(conn, 'tags')
+    for column, type in (('uncertainty', 'REAL'), ('scored_model', 'TEXT')):
+        if column not in columns:
+            conn.execute(f'ALTER TABLE tags ADD COLUMN {column} {type}')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tags_uncertainty ON tags (tag, uncertainty)')
+
+
+def _create_fts(conn):
+    # Full-text index of the text and hosts (see helpers/search.py), kept up to
+    # date by triggers. Changing a tag doesn't touch it.
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tags_fts USING fts5(text, hosts, content='tags', content_rowid='id')")
+    except sqlite3.OperationalError as e:
+        logger.warning(f'SQLite was built without FTS5, full-text search is unavailable. ({e})')
+        return
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tags_fts_vocab USING fts5vocab(tags_fts, 'row')")
+    conn.execute('CREATE TRIGGER IF NOT EXISTS tags_fts_insert AFTER INSERT ON tags BEGIN '
+                 'INSERT INTO tags_fts (rowid, text, hosts) VALUES (new.id, new.text, new.hosts); END')
+    conn.execute('CREATE TRIGGER IF NOT EXISTS tags_fts_delete AFTER DELETE ON tags BEGIN '
+                 "INSERT INTO tags_fts (tags_fts, rowid, text, hosts) VALUES ('delete', old.id, old.text, old.hosts); END")
+    conn.execute('CREATE TRIGGER IF NOT EXISTS tags_fts_update AFTER UPDATE OF text, hosts ON tags BEGIN '
+                 "INSERT INTO tags_fts (tags_fts, rowid, text, hosts) VALUES ('delete', old.id, old.text, old.hosts); "
+                 'INSERT INTO tags_fts (rowid, text, hosts) VALUES (new.id, new.text, new.hosts); END')
+    conn.execute("INSERT INTO tags_fts (tags_fts) VALUES ('rebuild')")
+
+
+def _track_changes(conn):
+    # A counter bumped by every write to `tags`, whatever the writer, and each
+    # row stamped with its value at the row's last write (see cache.fingerprint
+    # and helpers/corpus_store.py). Scoring by active learning doesn't count.
+    if 'modified' not in _columns(conn, 'tags'):
+        conn.execute('ALTER TABLE tags ADD COLUMN modified INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tags_modified ON tags (modified)')
+    conn.execute('CREATE TABLE IF NOT EXISTS tags_changes (version INTEGER NOT NULL)')
+    if conn.execute('SELECT COUNT(*) FROM tags_changes').fetchone()[0] == 0:
+        conn.execute('INSERT INTO tags_changes (version) VALUES (1)')
+    stamp = ('UPDATE tags_changes SET version = version + 1; '
+             'UPDATE tags SET modified = (SELECT version FROM tags_changes) WHERE id = new.id; END')
+    conn.execute(f'CREATE TRIGGER IF NOT EXISTS tags_changes_insert AFTER INSERT ON tags BEGIN {stamp}')
+    conn.execute(f'CREATE TRIGGER IF NOT EXISTS tags_changes_update AFTER UPDATE OF tag, text, hosts ON tags BEGIN {stamp}')
+    conn.execute('CREATE TRIGGER IF NOT EXISTS tags_changes_delete AFTER DELETE ON tags BEGIN '
+                 'UPDATE tags_changes SET version = version + 1; END')
+
+
+# MIGRATIONS[i] upgrades the schema from version i to i + 1
+MIGRATIONS = [
+    _create_tags,
+    _index_tags,
+    _create_manifest,
+    _add_source,
+    _add_text_mode,
+    _create_watch_cursors,
+    _add_uncertainty,
+    _create_fts,
+    _track_changes,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(conn):
+    """Apply the pending migrations, each in its own transaction"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version > SCHEMA_VERSION:
+        logger.warning(f'The database schema (v{version}) is newer than this version of katatasso (v{SCHEMA_VERSION})')
+    for i in range(version, SCHEMA_VERSION):
+        with conn:
+            MIGRATIONS[i](conn)
+            conn.execute(f'PRAGMA user_version = {i + 1}')
+        logger.debug(f'Migrated the database schema to v{i + 1}')
+
+
+def connect(path=None):
+    """The connection of this thread to the database, opened on first use
+
+        Parameters
+        ----------
+        path : str
+            The database file. (Default: DBFILE)
+
+        Returns
+        -------
+        conn : sqlite3.Connection
+            Shared by the callers in this thread, so don't close it
+    """
+    path = path or DBFILE
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=CLF_DB_BUSY_TIMEOUT / 1000)
+        conn.execute(f'PRAGMA busy_timeout = {CLF_DB_BUSY_TIMEOUT}')
+        # Readers (e.g. the tagger) are not blocked while ingestion writes,
+        # and a commit doesn't wait for a full fsync
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        with _lock:
+            if path not in _migrated:
+                migrate(conn)
+                _migrated.add(path)
+        connections[path] = conn
+    return conn
+
+
+def close(path=None):
+    """Close the connection of this thread, if any"""
+    conn = getattr(_local, 'connections', {}).pop(path or DBFILE, None)
+    if conn is not None:
+        conn.close()
+
+
+def iter_rows(query, params=(), batch_size=1000, path=None):
+    """Stream the rows of a query, `batch_size` rows at a time"""
+    c = connect(path).execute(query, params)
+    try:
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        c.close()
+
+
+def changes(path=None):
+    """The change counter of `tags`, bumped by every insert, update and delete
+    (see `_track_changes`). Rows written since version `v` have `modified > v`."""
+    return connect(path).execute('SELECT version FROM tags_changes').fetchone()[0]
+
+
+def category_stats(path=None):
+    """Number of rows per tag, in one pass
+
+        Returns
+        -------
+        stats : dict
+            tag => count
+    """
+    return dict(connect(path).execute('SELECT tag, COUNT(*) FROM tags GROUP BY tag').fetchall())
+
+
+def text_modes(path=None):
+    """Number of rows per text mode (see helpers/plaintext.py)
+
+        Returns
+        -------
+        modes : dict
+            text mode => count
+    """
+    rows = connect(path).execute('SELECT text_mode, COUNT(*) FROM tags GROUP BY text_mode').fetchall()
+    modes = collections.Counter()
+    for mode, n in rows:
+        modes[mode or 'emailyzer'] += n
+    return dict(modes)
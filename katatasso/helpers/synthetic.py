@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic email corpus, for benchmarks.
+
+Every email is a MIME message (a `text/plain` and a `text/html` part) whose
+words come from a vocabulary shared by all categories plus one per category,
+both Zipf-distributed, so the categories overlap like real mail but can be
+told apart. Email `i` of a corpus only depends on the seed and `i`, so the
+.eml files and the database rows can be generated separately and still match.
+
+The rows are stored like the `fast` text mode ingests the emails (the plain
+part, normalized), without running NER, so a database of 1M emails is
+generated in minutes.
+
+usage: python -m katatasso.helpers.synthetic [-n <NUM_EMAILS>] [-f <NUM_FILES>] [-s <SEED>] [-o <DIRECTORY>]
+"""
+import getopt
+import os
+import random
+import sys
+import time
+from email.utils import formatdate
+
+from katatasso.helpers import storage
+from katatasso.helpers.const import CATEGORIES
+from katatasso.helpers.logger import rootLogger as logger
+from katatasso.helpers.normalize import NORMALIZER
+from katatasso.helpers.utils import progress_bar
+
+# The five categories, with a few telling words on top of the generated ones
+SEED_WORDS = {
+    0: ['meeting', 'agenda', 'report', 'schedule', 'project', 'review', 'team', 'minutes', 'budget', 'thanks'],
+    1: ['offer', 'discount', 'free', 'winner', 'deal', 'subscribe', 'limited', 'cheap', 'bonus', 'promotion'],
+    2: ['password', 'verify', 'account', 'login', 'suspended', 'confirm', 'security', 'update', 'credentials', 'bank'],
+    3: ['attachment', 'invoice', 'document', 'enable', 'macro', 'download', 'archive', 'open', 'scan', 'shipment'],
+    4: ['inheritance', 'transfer', 'beneficiary', 'million', 'funds', 'lottery', 'barrister', 'claim', 'urgent', 'fee']
+}
+_SYLLABLES = ['ka', 'ta', 'so', 'ri', 'mo', 'ne', 'lu', 'pe', 'vi', 'da', 'go', 'hu', 'ze', 'bra', 'kel', 'mon',
+              'tor', 'lis', 'fen', 'qua', 'ster', 'vin', 'dol', 'pra', 'nix']
+SHARED_WORDS = 5000
+CATEGORY_WORDS = 500
+# Share of the words of an email drawn from its category's vocabulary
+CATEGORY_SHARE = 0.3
+
+
+def _zipf(n):
+    return [1 / rank for rank in range(1, n + 1)]
+
+
+class Vocabulary(object):
+    """The words and hosts emails are made of, fixed by the seed"""
+
+    def __init__(self, seed=0):
+        rng = random.Random(f'vocabulary:{seed}')
+        words = set()
+        while len(words) < SHARED_WORDS + len(SEED_WORDS) * CATEGORY_WORDS:
+            words.add(''.join(rng.choices(_SYLLABLES, k=rng.randint(2, 4))))
+        words = sorted(words)
+        rng.shuffle(words)
+        self.shared = words[:SHARED_WORDS]
+        self.shared_weights = list(_cumulative(_zipf(SHARED_WORDS)))
+        self.categories = {}
+        for tag in SEED_WORDS:
+            start = SHARED_WORDS + tag * CATEGORY_WORDS
+            own = SEED_WORDS[tag] + words[start:start + CATEGORY_WORDS - len(SEED_WORDS[tag])]
+            self.categories[tag] = own
+        self.category_weights = list(_cumulative(_zipf(CATEGORY_WORDS)))
+        self.hosts = {
+            tag: [f'{rng.choice(self.shared)}{rng.choice(self.categories[tag])}.{rng.choice(["com", "org", "net", "info"])}'
+                  for _ in range(20)]
+            for tag in SEED_WORDS
+        }
+
+
+def _cumulative(weights):
+    total = 0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+def email(vocabulary, i, seed=0):
+    """Email `i` of the corpus
+
+        Returns
+        -------
+        tag : int
+        text : str
+            The plain text body
+        hosts : list of str
+        raw : str
+            The MIME message
+    """
+    rng = random.Random(f'email:{seed}:{i}')
+    tag = i % len(SEED_WORDS)
+    n = rng.randint(30, 300)
+    n_own = int(n * CATEGORY_SHARE)
+    words = rng.choices(vocabulary.shared, cum_weights=vocabulary.shared_weights, k=n)
+    # Spread evenly, which is much cheaper than shuffling
+    own = rng.choices(vocabulary.categories[tag], cum_weights=vocabulary.category_weights, k=n_own)
+    for j, word in enumerate(own):
+        words[j * n // n_own] = word
+    hosts = sorted(set(rng.choices(vocabulary.hosts[tag], k=rng.randint(1, 3))))
+
+    sentences = [' '.join(words[j:j + 12]).capitalize() + '.' for j in range(0, len(words), 12)]
+    text = '\n'.join(sentences)
+    links = ''.join(f'<p><a href="https://{host}/{rng.choice(words)}">{rng.choice(words)}</a></p>' for host in hosts)
+    html = ''.join(f'<p>{sentence}</p>' for sentence in sentences) + links
+    subject = ' '.join(words[:rng.randint(3, 8)]).capitalize()
+    boundary = f'=={seed}-{i}=='
+    raw = (
+        f'From: {rng.choice(vocabulary.shared)} <{rng.choice(words)}@{hosts[0]}>\n'
+        f'To: user{i % 97}@example.org\n'
+        f'Subject: {subject}\n'
+        f'Date: {formatdate(1577836800 + i * 60, usegmt=True)}\n'
+        f'Message-ID: <{seed}.{i}@{hosts[0]}>\n'
+        'MIME-Version: 1.0\n'
+        f'Content-Type: multipart/alternative; boundary="{boundary}"\n'
+        '\n'
+        f'--{boundary}\n'
+        'Content-Type: text/plain; charset="utf-8"\n'
+        '\n'
+        f'{text}\n'
+        + ''.join(f'https://{host}/\n' for host in hosts) +
+        f'--{boundary}\n'
+        'Content-Type: text/html; charset="utf-8"\n'
+        '\n'
+        f'<html><body>{html}</body></html>\n'
+        f'--{boundary}--\n'
+    )
+    return tag, text, hosts, raw
+
+
+def filepath(path, tag, i):
+    """Where email `i` is written, in the folder of its category"""
+    return os.path.join(path, CATEGORIES[tag], f'{i}.eml')
+
+
+def write_files(path, n, seed=0, vocabulary=None):
+    """Write the first `n` emails of the corpus as .eml files, one folder per category"""
+    vocabulary = vocabulary or Vocabulary(seed)
+    for tag in SEED_WORDS:
+        os.makedirs(os.path.join(path, CATEGORIES[tag]), exist_ok=True)
+    for i in progress_bar(range(n)):
+        tag, _, _, raw = email(vocabulary, i, seed=seed)
+        with open(filepath(path, tag, i), 'w', encoding='utf-8') as f:
+            f.write(raw)
+
+
+def populate_db(db, path, n, seed=0, batch_size=10000, vocabulary=None):
+    """Store `n` emails of the corpus in the database `db`, as rows of the
+    files under `path` (whether or not they were written)"""
+    vocabulary = vocabulary or Vocabulary(seed)
+    conn = storage.connect(db)
+    batch = []
+    def write():
+        conn.executemany('INSERT OR REPLACE INTO tags (filepath, tag, text, hosts, text_mode) VALUES (?,?,?,?,?)', batch)
+        conn.commit()
+        batch.clear()
+
+    for i in progress_bar(range(n)):
+        tag, text, hosts, _ = email(vocabulary, i, seed=seed)
+        batch.append((filepath(path, tag, i), tag, ' '.join(NORMALIZER.tokenize(text)), '|'.join(hosts), 'fast'))
+        if len(batch) >= batch_size:
+            write()
+    if batch:
+        write()
+
+
+def generate(path, n, n_files=None, seed=0):
+    """Generate a corpus of `n` emails under `path`: the database `tagger.db`
+    and the first `n_files` emails as files under `emails/`. (Default: all)
+
+        Returns
+        -------
+        db : str
+            The database file
+        emails : str
+            The training data directory, one folder per category
+    """
+    vocabulary = Vocabulary(seed)
+    emails = os.path.join(path, 'emails', '')
+    db = os.path.join(path, 'tagger.db')
+    n_files = n if n_files is None else min(n, n_files)
+    start = time.perf_counter()
+    write_files(emails, n_files, seed=seed, vocabulary=vocabulary)
+    populate_db(db, emails, n, seed=seed, vocabulary=vocabulary)
+    logger.info(f'Generated {n} emails ({n_files} files) in {round(time.perf_counter() - start, 2)}s')
+    return db, emails
+
+
+def main():
+    n, n_files, seed, path = 1000, None, 0, 'synthetic'
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], 'hn:f:s:o:')
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(__doc__)
+            sys.exit(0)
+        elif opt == '-o':
+            path = arg
+        elif not arg.isnumeric():
+            logger.critical(f'{opt}={arg} must be a number.')
+            sys.exit(2)
+        elif opt == '-n':
+            n = int(arg)
+        elif opt == '-f':
+            n_files = int(arg)
+        elif opt == '-s':
+            seed = int(arg)
+
+    db, emails = generate(path, n, n_files=n_files, seed=seed)
+    print(f'Generated {n} emails in `{db}`, and their files in `{emails}`')
+
+
+if __name__ == '__main__':
+    main()
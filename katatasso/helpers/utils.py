@@ -1,12 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import pickle
+import resource
 import sys
 import os
 
 import tqdm
 
-from katatasso.helpers.const import FN_MODEL
+from katatasso.helpers import profiling
+from katatasso.helpers.const import FN_MODEL, FN_VECTORIZER
 from katatasso.helpers.logger import rootLogger as logger
 
 # Force the progress bar to be displayed regardless
@@ -21,6 +23,11 @@ def progress_bar(it):
         return it
 
 
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
 def save_obj(obj, filepath):
     try:
         with open(filepath, 'wb') as f:
@@ -46,21 +53,35 @@ def load_obj(filepath):
         sys.exit(2)
 
 
+def model_file(version='v2', algo='mnb'):
+    return f'{FN_MODEL}{version}-{algo}.p'
+
+
+def vectorizer_file(version='v2'):
+    # Shared by every algorithm trained on the same data
+    return f'{FN_VECTORIZER}{version}.p'
+
+
 def save_model(model, version='v2', algo='mnb'):
-    fname = f'{FN_MODEL}{version}-{algo}.p'
-    save_obj(model, fname)
+    save_obj(model, model_file(version, algo))
 
 
+@profiling.timed('model.load')
 def load_model(version='v2', algo='mnb'):
-    fname = f'{FN_MODEL}{version}-{algo}.p'
-    return load_obj(fname)
+    return load_obj(model_file(version, algo))
 
 
-def save_vectorizer(vectorizer, algo='mnb'):
-    fn = f'vectorizer_v2-{algo}.p'
-    save_obj(vectorizer, fn)
+def save_vectorizer(vectorizer, version='v2'):
+    save_obj(vectorizer, vectorizer_file(version))
 
 
-def load_vectorizer(algo='mnb'):
-    fn = f'vectorizer_v2-{algo}.p'
+@profiling.timed('model.load')
+def load_vectorizer(algo='mnb', version='v2'):
+    fn = vectorizer_file(version)
+    if not os.path.isfile(fn):
+        if version == 'v1':
+            # Models trained by older versions rebuild the dictionary from the database
+            return None
+        # Per-algorithm vectorizer written by older versions
+        fn = f'{FN_VECTORIZER}v2-{algo}.p'
     return load_obj(fn)
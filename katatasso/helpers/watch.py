@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Watch mode: ingest the emails dropped into the training data directories
+as they arrive.
+
+Every directory under a category directory (nested ones included) has a
+cursor in `watch_cursors`: its mtime and inode when it was last listed.
+Adding, removing or renaming a file changes the mtime of its directory, so a
+poll only lists the directories whose cursor moved, and costs one `os.stat`
+per directory when nothing arrived. Cursors are saved once the new files are
+stored, so a restarted watcher carries on where it stopped. Each watcher
+(ingestion, the tagging server) keeps its own cursors.
+
+Files modified less than `settle` seconds ago may still be being copied, and
+are left for a later poll.
+"""
+import collections
+import os
+import time
+
+from katatasso.helpers import manifest, sources, storage
+from katatasso.helpers.const import (CLF_TRAININGDATA_PATH, CLF_WATCH_BATCH,
+                                     CLF_WATCH_INTERVAL, CLF_WATCH_SETTLE)
+
+
+def category_dirs(path=CLF_TRAININGDATA_PATH):
+    """The category directories under `path`, and their tags"""
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            tag = sources.category_of(entry.name) if entry.is_dir() else None
+            # The categories ingested by `load_emails`
+            if tag in range(5):
+                dirs.append((entry.path, tag))
+    return sorted(dirs)
+
+
+def load_cursors(conn, watcher='ingest'):
+    """directory => (parent, mtime_ns, inode)"""
+    return {row[0]: row[1:] for row in conn.execute(
+        'SELECT path, parent, mtime_ns, inode FROM watch_cursors WHERE watcher=?', (watcher,)
+    )}
+
+
+def _known(conn, filepaths, parsed=True):
+    """The files already in the database (with their text, if `parsed`)"""
+    text = ' AND text IS NOT NULL' if parsed else ''
+    known = set()
+    for i in range(0, len(filepaths), 400):
+        chunk = filepaths[i:i + 400]
+        known.update(row[0] for row in conn.execute(
+            f'SELECT filepath FROM tags WHERE filepath IN ({",".join("?" * len(chunk))}){text}', chunk
+        ))
+    return known
+
+
+def poll(conn, cursors, path=CLF_TRAININGDATA_PATH, settle=CLF_WATCH_SETTLE, roots=None, parsed=True):
+    """Find the files that arrived since the cursors were saved
+
+        Parameters
+        ----------
+        conn : sqlite3.Connection
+
+        cursors : dict
+            The saved cursors, see `load_cursors`
+
+        path : str
+            The training data directory
+
+        settle : float
+            Leave out files modified less than `settle` seconds ago
+
+        roots : list of (directory, tag, recursive)
+            The directories to watch. (Default: the category directories
+            under `path`, recursively)
+
+        parsed : bool
+            Whether the files are parsed. If so, a file whose row has no text
+            (e.g. one stored by the autotagger) counts as new.
+
+        Returns
+        -------
+        arrived : list of (filepath, tag)
+            The new files
+        stats : dict
+            filepath => (size, mtime) of the new files
+        updates : dict
+            directory => (parent, mtime_ns, inode), to save once the files are stored
+        removed : list of str
+            Directories that no longer exist
+    """
+    now = time.time()
+    children = collections.defaultdict(list)
+    for directory, (parent, *_) in cursors.items():
+        children[parent].append(directory)
+
+    if roots is None:
+        roots = [(directory, tag, True) for directory, tag in category_dirs(path)]
+    arrived, stats, updates, removed = [], {}, {}, []
+    stack = [(directory, None, tag, recursive) for directory, tag, recursive in roots]
+    while stack:
+        directory, parent, tag, recursive = stack.pop()
+        try:
+            stat = os.stat(directory)
+        except OSError:
+            removed.append(directory)
+            continue
+        cursor = (stat.st_mtime_ns, stat.st_ino)
+        if directory in cursors and cursors[directory][1:] == cursor:
+            if recursive:
+                stack.extend((child, directory, tag, True) for child in children[directory])
+            continue
+
+        files, subdirs = [], []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry)
+        if recursive:
+            stack.extend((subdir, directory, tag, True) for subdir in subdirs)
+            removed.extend(child for child in children[directory] if child not in subdirs)
+
+        # Moving on is only safe once nothing can change within the same mtime tick
+        settled = now - stat.st_mtime >= settle
+        known = _known(conn, [entry.path for entry in files], parsed=parsed)
+        for entry in files:
+            if entry.path in known:
+                continue
+            try:
+                st = entry.stat()
+                if now - st.st_mtime < settle:
+                    settled = False
+                    continue
+            except OSError:
+                continue
+            arrived.append((entry.path, tag))
+            stats[entry.path] = (st.st_size, st.st_mtime)
+        if settled:
+            updates[directory] = (parent, *cursor)
+    return arrived, stats, updates, removed
+
+
+def save_cursors(conn, cursors, updates, removed, watcher='ingest'):
+    """Save the cursors of the listed directories, and forget the removed ones"""
+    for directory in removed:
+        conn.execute('DELETE FROM watch_cursors WHERE watcher=? AND (path=? OR substr(path, 1, ?)=?)',
+                     (watcher, directory, len(directory) + 1, directory + os.sep))
+        for key in [key for key in cursors if key == directory or key.startswith(directory + os.sep)]:
+            del cursors[key]
+    conn.executemany('INSERT OR REPLACE INTO watch_cursors (watcher, path, parent, mtime_ns, inode) VALUES (?,?,?,?,?)',
+                     [(watcher, directory, *cursor) for directory, cursor in updates.items()])
+    conn.commit()
+    cursors.update(updates)
+
+
+def watch(ingest, path=CLF_TRAININGDATA_PATH, interval=CLF_WATCH_INTERVAL, batch_size=CLF_WATCH_BATCH,
+          settle=CLF_WATCH_SETTLE, watcher='ingest', parsed=True):
+    """Ingest the emails arriving under `path`, until interrupted (Ctrl+C)
+
+        Parameters
+        ----------
+        ingest : callable
+            Called with a batch of new files, list of (filepath, tag), and
+            their manifest entries. Stores them, records them in the
+            manifest, and returns the number of files stored.
+
+        path : str
+            The training data directory, one subdirectory per category
+
+        interval : float
+            Seconds between polls
+
+        batch_size : int
+            Number of new files passed to `ingest` at a time
+
+        settle : float
+            Seconds a file must be left unmodified before it is ingested
+
+        watcher : str
+            Whose cursors to load and save
+
+        parsed : bool
+            Whether `ingest` parses the files, see `poll`
+
+        Returns
+        -------
+        total : int
+            Number of files stored
+    """
+    conn = storage.connect()
+    cursors = load_cursors(conn, watcher=watcher)
+    total = 0
+    print(f'Watching {path} for new emails every {interval}s (Ctrl+C to stop)')
+    try:
+        while True:
+            arrived, stats, updates, removed = poll(conn, cursors, path=path, settle=settle, parsed=parsed)
+            stored = 0
+            for i in range(0, len(arrived), batch_size):
+                batch = arrived[i:i + batch_size]
+                entries = {}
+                for filepath, _ in batch:
+                    try:
+                        entries[filepath] = (*stats[filepath], manifest.file_hash(filepath))
+                    except OSError:
+                        pass
+                stored += ingest([item for item in batch if item[0] in entries], entries)
+            save_cursors(conn, cursors, updates, removed, watcher=watcher)
+            if arrived:
+                print(f'{time.strftime("%Y-%m-%d %H:%M:%S")} Ingested {stored} of {len(arrived)} new emails')
+                total += stored
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print(f'Stopped watching, {total} emails ingested')
+    return total
@@ -4,8 +4,9 @@ import os
 import sys
 
 from katatasso.helpers.logger import rootLogger as logger
-from katatasso.modules.classifier import classify, classifyv2
-from katatasso.modules.trainer import train, trainv2
+from katatasso.modules.classifier import classify, classify_many, classifyv2
+from katatasso.modules.sweep import sweep
+from katatasso.modules.trainer import train, train_many, trainv2
 
 try:
     import sklearn
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Active learning: score the untagged emails by how uncertain the v2 model is
+about them, so the tagger serves the most informative ones first (`/next`).
+
+Scores are stored in `tags.uncertainty` (higher is more uncertain) with the
+model that computed them in `tags.scored_model`. A run only scores the
+untagged emails that haven't been scored by the current model, so new emails
+are scored incrementally, and everything is rescored once a new model is
+saved (see `trainer.train_many`).
+
+usage: python -m katatasso.modules.active_learning [-a <ALGO>] [-m <margin|entropy>]
+"""
+import getopt
+import os
+import sys
+
+from katatasso.helpers import plaintext, storage
+from katatasso.helpers.const import (CLF_AL_ALGO, CLF_AL_BATCH, CLF_AL_METHOD,
+                                     CLF_INGEST_WORKERS)
+from katatasso.helpers.extraction import transform
+from katatasso.helpers.logger import rootLogger as logger
+from katatasso.helpers.utils import load_model, load_vectorizer, model_file, progress_bar
+
+try:
+    import numpy as np
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+UNCERTAINTY_METHODS = ['margin', 'entropy']
+
+
+def model_id(version='v2', algo=CLF_AL_ALGO):
+    """Identifies a saved model, and changes whenever it is trained again"""
+    stat = os.stat(model_file(version, algo))
+    return f'{version}-{algo}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def uncertainty(proba, method=CLF_AL_METHOD):
+    """Uncertainty of each prediction, from 0 (certain) to 1
+
+        Parameters
+        ----------
+        proba : numpy.ndarray
+            Class probabilities, shape (n_samples, n_classes)
+
+        method : str
+            `margin`: 1 - the gap between the two most likely classes
+            `entropy`: the entropy of the probabilities, over its maximum
+    """
+    if proba.shape[1] < 2:
+        return np.zeros(len(proba))
+    if method == 'margin':
+        top = np.partition(proba, -2, axis=1)
+        return 1 - (top[:, -1] - top[:, -2])
+    p = np.clip(proba, 1e-12, 1)
+    return -(p * np.log(p)).sum(axis=1) / np.log(proba.shape[1])
+
+
+def _texts(rows, text_mode):
+    """The extracted words of each row (id, filepath, text), parsing the
+    emails that were only tagged, not ingested"""
+    texts = {id: text for id, _, text in rows if text is not None}
+    missing = [(filepath, -1) for _, filepath, text in rows if text is None]
+    if missing:
+        # Parsed like at ingestion, so the words match the training data
+        from katatasso.helpers.dataset_generator import iter_parsed
+        ids = {filepath: id for id, filepath, _ in rows}
+        for parsed in iter_parsed(missing, workers=CLF_INGEST_WORKERS, text_mode=text_mode):
+            texts.update((ids[row[0]], row[2]) for row in parsed)
+    return texts
+
+
+def score(algo=CLF_AL_ALGO, method=CLF_AL_METHOD, batch_size=CLF_AL_BATCH, parse=True):
+    """Score the untagged emails that the current v2 model hasn't scored yet
+
+        Parameters
+        ----------
+        algo : str
+            The algorithm of the v2 model, `mnb` or `cnb`
+
+        method : str
+            How uncertainty is measured, `margin` or `entropy`
+
+        batch_size : int
+            Number of emails vectorized and written at a time
+
+        parse : bool
+            Parse the emails that were only tagged, not ingested. Otherwise
+            only the emails with text are scored, without running NER.
+
+        Returns
+        -------
+        scored : int
+            Number of emails scored
+    """
+    try:
+        current = f'{model_id(algo=algo)}/{method}'
+    except FileNotFoundError:
+        logger.warning(f'No v2-{algo} model to score the untagged emails with. Train one first.')
+        return 0
+    clf = load_model(version='v2', algo=algo)
+    vectorizer = load_vectorizer(algo=algo, version='v2')
+    text_mode = getattr(vectorizer, plaintext.TEXT_MODE_ATTR, None) or 'emailyzer'
+
+    conn = storage.connect()
+    # Listed up front, since scoring changes the rows matched by the query
+    ids = [row[0] for row in conn.execute(
+        'SELECT id FROM tags WHERE tag = -1 AND (scored_model IS NULL OR scored_model != ?)'
+        f'{"" if parse else " AND text IS NOT NULL"} ORDER BY id', (current,)
+    )]
+    scored = 0
+    for i in progress_bar(range(0, len(ids), batch_size)):
+        chunk = ids[i:i + batch_size]
+        rows = conn.execute(
+            f'SELECT id, filepath, text FROM tags WHERE id IN ({",".join("?" * len(chunk))}) ORDER BY id', chunk
+        ).fetchall()
+        texts = _texts(rows, text_mode)
+        ok = [id for id, _, _ in rows if texts.get(id) is not None]
+        updates = []
+        if ok:
+            proba = clf.predict_proba(transform(vectorizer, [texts[id] for id in ok], version='v2'))
+            updates = [(float(u), current, id) for u, id in zip(uncertainty(proba, method), ok)]
+        # Emails that can't be parsed (reported by `iter_parsed`) are queued last,
+        # and not retried until the next model
+        updates += [(None, current, id) for id, _, _ in rows if texts.get(id) is None]
+        conn.executemany('UPDATE tags SET uncertainty=?, scored_model=? WHERE id=?', updates)
+        conn.commit()
+        scored += len(ok)
+    logger.info(f'Scored {scored} untagged emails with {current}')
+    return scored
+
+
+def main():
+    algo, method = CLF_AL_ALGO, CLF_AL_METHOD
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], 'ha:m:', ['help', 'algo=', 'method='])
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            print(__doc__)
+            sys.exit(0)
+        elif opt in ('-a', '--algo'):
+            algo = arg
+        elif opt in ('-m', '--method'):
+            if arg not in UNCERTAINTY_METHODS:
+                logger.critical(f'Unknown method `{arg}`, expected one of {UNCERTAINTY_METHODS}')
+                sys.exit(2)
+            method = arg
+    print(f'Scored {score(algo=algo, method=method)} untagged emails')
+
+
+if __name__ == '__main__':
+    main()
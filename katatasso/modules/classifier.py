@@ -2,9 +2,10 @@
 # -*- coding: utf-8 -*-
 import sys
 
+from katatasso.helpers import profiling
 from katatasso.helpers.const import CATEGORIES
-from katatasso.helpers.extraction import (get_tfidf_counts, make_dictionary,
-                                          process_dataframe)
+from katatasso.helpers.extraction import (get_counts, get_counts_many,
+                                          get_tfidf_counts, make_dictionary)
 from katatasso.helpers.logger import rootLogger as logger
 from katatasso.helpers.utils import load_model
 
@@ -39,12 +40,13 @@ def classify(text, algo='mnb'):
             Predicted category for the text
     """
     clf = load_model(version='v1', algo=algo)
-    dic = make_dictionary()
-
-    features = []
-    for word in dic:
-        features.append(text.count(word[0]))
-    predicted = clf.predict([features])
+    features = get_counts(text, version='v1', algo=algo)
+    if features is None:
+        # Models trained by older versions don't have a saved dictionary
+        dic = make_dictionary()
+        features = [[text.count(word[0]) for word in dic]]
+    with profiling.stage('predict'):
+        predicted = clf.predict(features)
     logger.info(f'CLASSIFICATION => `{CATEGORIES[predicted[0]]}`')
     category = int(predicted[0])
     return category
@@ -70,7 +72,39 @@ def classifyv2(text, algo='mnb'):
     clf = load_model(version='v2', algo=algo)
     counts = get_tfidf_counts(text, algo=algo)
 
-    predicted = clf.predict(counts)
+    with profiling.stage('predict'):
+        predicted = clf.predict(counts)
     logger.info(f'CLASSIFICATION => `{CATEGORIES[predicted[0]]}`')
     category = int(predicted[0])
     return category
+
+
+def classify_many(texts, version='v2', algo='mnb'):
+    """Classify many texts at once, tagging their entities in batches
+
+        Parameters
+        ----------
+        texts : list of str
+            The text inputs to classify
+
+        version : str
+            The model version, `v1` or `v2`
+
+        algo : str
+            The algorithm to use
+            `mnb` for Multinomial Naïve Bayes,
+            `cnb` for Complement Naïve Bayes
+
+        Returns
+        -------
+        categories : list of int
+            Predicted category for each text
+    """
+    clf = load_model(version=version, algo=algo)
+    features = get_counts_many(texts, version=version, algo=algo)
+    if features is None:
+        # v1 models trained by older versions don't have a saved dictionary
+        return [classify(text, algo=algo) for text in texts]
+    with profiling.stage('predict'):
+        predicted = clf.predict(features)
+    return [int(category) for category in predicted]
@@ -18,75 +18,86 @@ dataset. The plots in the third row show how much time was required to train
 the models for each training sizes.
 """
 #print(__doc__)
+import multiprocessing
+import sys
+
+from katatasso.helpers.const import (CLF_LC_ADAPTIVE, CLF_LC_BATCH,
+                                     CLF_LC_N_JOBS, CLF_LC_SPLITS,
+                                     CLF_LC_TOLERANCE)
+from katatasso.helpers.logger import rootLogger as logger
+
+try:
+    import matplotlib
+    # Render to files only, never block on a window
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from sklearn.model_selection import learning_curve
+    from sklearn.model_selection import ShuffleSplit
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+
+def compute(estimator, X, y, splits=CLF_LC_SPLITS, adaptive=CLF_LC_ADAPTIVE,
+            tolerance=CLF_LC_TOLERANCE, batch=CLF_LC_BATCH, n_jobs=CLF_LC_N_JOBS,
+            train_sizes=np.linspace(.1, 1.0, 5)):
+    """
+    Compute the learning curve using up to `splits` random splits, each time
+    with 20% of the data randomly selected as a validation set.
 
-import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.naive_bayes import GaussianNB
-from sklearn.svm import SVC
-from sklearn.datasets import load_digits
-from sklearn.model_selection import learning_curve
-from sklearn.model_selection import ShuffleSplit
-
+    In adaptive mode, splits are added `batch` at a time, and no more are added
+    once the 95% confidence interval of the mean validation score is within
+    +/- `tolerance` for every training size.
 
-def __plot_learning_curve(estimator, title, X, y, axes=None, ylim=None, cv=None,
-                        n_jobs=None, train_sizes=np.linspace(.1, 1.0, 5)):
+    Returns
+    -------
+    train_sizes, train_scores, test_scores, fit_times
+    """
+    train_scores, test_scores, fit_times = [], [], []
+    done = 0
+    while done < splits:
+        step = min(batch if adaptive else splits, splits - done)
+        cv = ShuffleSplit(n_splits=step, test_size=0.2, random_state=done)
+        sizes, train_s, test_s, fit_t, _ = \
+            learning_curve(estimator, X, y, cv=cv, n_jobs=n_jobs,
+                           train_sizes=train_sizes,
+                           return_times=True)
+        train_scores.append(train_s)
+        test_scores.append(test_s)
+        fit_times.append(fit_t)
+        done += step
+
+        if adaptive and done > 1:
+            scores = np.hstack(test_scores)
+            halfwidth = 1.96 * np.std(scores, axis=1, ddof=1) / np.sqrt(done)
+            logger.debug(f'Learning curve: {done} splits, CI half-width {halfwidth.max():.4f}')
+            if halfwidth.max() <= tolerance:
+                break
+
+    logger.debug(f'Learning curve computed from {done} splits')
+    return sizes, np.hstack(train_scores), np.hstack(test_scores), np.hstack(fit_times)
+
+
+def __plot_learning_curve(title, train_sizes, train_scores, test_scores, fit_times,
+                        axes=None, ylim=None):
     """
     Generate 3 plots: the test and training learning curve, the training
     samples vs fit times curve, the fit times vs score curve.
 
     Parameters
     ----------
-    estimator : object type that implements the "fit" and "predict" methods
-        An object of that type which is cloned for each validation.
-
     title : string
         Title for the chart.
 
-    X : array-like, shape (n_samples, n_features)
-        Training vector, where n_samples is the number of samples and
-        n_features is the number of features.
-
-    y : array-like, shape (n_samples) or (n_samples, n_features), optional
-        Target relative to X for classification or regression;
-        None for unsupervised learning.
+    train_sizes, train_scores, test_scores, fit_times : array-like
+        The learning curve, as returned by `compute`.
 
     axes : array of 3 axes, optional (default=None)
         Axes to use for plotting the curves.
 
     ylim : tuple, shape (ymin, ymax), optional
         Defines minimum and maximum yvalues plotted.
-
-    cv : int, cross-validation generator or an iterable, optional
-        Determines the cross-validation splitting strategy.
-        Possible inputs for cv are:
-
-          - None, to use the default 5-fold cross-validation,
-          - integer, to specify the number of folds.
-          - :term:`CV splitter`,
-          - An iterable yielding (train, test) splits as arrays of indices.
-
-        For integer/None inputs, if ``y`` is binary or multiclass,
-        :class:`StratifiedKFold` used. If the estimator is not a classifier
-        or if ``y`` is neither binary nor multiclass, :class:`KFold` is used.
-
-        Refer :ref:`User Guide <cross_validation>` for the various
-        cross-validators that can be used here.
-
-    n_jobs : int or None, optional (default=None)
-        Number of jobs to run in parallel.
-        ``None`` means 1 unless in a :obj:`joblib.parallel_backend` context.
-        ``-1`` means using all processors. See :term:`Glossary <n_jobs>`
-        for more details.
-
-    train_sizes : array-like, shape (n_ticks,), dtype float or int
-        Relative or absolute numbers of training examples that will be used to
-        generate the learning curve. If the dtype is float, it is regarded as a
-        fraction of the maximum size of the training set (that is determined
-        by the selected validation method), i.e. it has to be within (0, 1].
-        Otherwise it is interpreted as absolute sizes of the training sets.
-        Note that for classification the number of samples usually have to
-        be big enough to contain at least one sample from each class.
-        (default: np.linspace(0.1, 1.0, 5))
     """
     if axes is None:
         _, axes = plt.subplots(1, 3, figsize=(20, 5))
@@ -97,10 +108,6 @@ def __plot_learning_curve(estimator, title, X, y, axes=None, ylim=None, cv=None,
     axes[0].set_xlabel("Training examples")
     axes[0].set_ylabel("Score")
 
-    train_sizes, train_scores, test_scores, fit_times, _ = \
-        learning_curve(estimator, X, y, cv=cv, n_jobs=n_jobs,
-                       train_sizes=train_sizes,
-                       return_times=True)
     train_scores_mean = np.mean(train_scores, axis=1)
     train_scores_std = np.std(train_scores, axis=1)
     test_scores_mean = np.mean(test_scores, axis=1)
@@ -143,20 +150,39 @@ def __plot_learning_curve(estimator, title, X, y, axes=None, ylim=None, cv=None,
     return plt
 
 
-def plot(estimator, X, y, title='Learning Curves', axes=None, ylim=None, cv=None, n_jobs=None, train_sizes=np.linspace(.1, 1.0, 5)):
-    fig, axes = plt.subplots(3, 2, figsize=(10, 20))
-
-    # Cross validation with 100 iterations to get smoother mean test and train
-    # score curves, each time with 20% data randomly selected as a validation set.
-    cv = ShuffleSplit(n_splits=100, test_size=0.2, random_state=0)
+def plot(estimator, X, y, title='Learning Curves', ylim=(0.7, 1.01), **kwargs):
+    """
+    Compute and plot the learning curve of `estimator`, and save it as a PNG.
+    Keyword arguments are passed on to `compute`.
 
-    #__plot_learning_curve(estimator, title, X, y, axes=axes[:, 0], ylim=(0.7, 1.01), cv=cv, n_jobs=4)
-    __plot_learning_curve(estimator, title, X, y, ylim=(0.7, 1.01),
-                        cv=cv, n_jobs=4)
+    Returns
+    -------
+    fname : str
+        The filename of the saved plot
+    """
+    curve = compute(estimator, X, y, **kwargs)
+    __plot_learning_curve(title, *curve, ylim=ylim)
 
     now = datetime.now().isoformat()
-    plt.savefig(f'{title.lower().replace(" ", "-")}_{now}.png')
-    try:
-        plt.show()
-    except:
-        pass
+    fname = f'{title.lower().replace(" ", "-")}_{now}.png'
+    plt.savefig(fname)
+    plt.close('all')
+    logger.debug(f'Learning curve saved to file `{fname}`')
+    return fname
+
+
+def plot_in_background(estimator, X, y, **kwargs):
+    """
+    Run `plot` in a separate process, so the caller can carry on.
+    The process is spawned rather than forked, since the caller may
+    hold joblib worker threads.
+
+    Returns
+    -------
+    process : multiprocessing.Process
+    """
+    ctx = multiprocessing.get_context('spawn')
+    process = ctx.Process(target=plot, args=(estimator, X, y), kwargs=kwargs)
+    process.start()
+    logger.info(f'Plotting `{kwargs.get("title", "Learning Curves")}` in the background (pid {process.pid})')
+    return process
@@ -1,32 +1,121 @@
+import json
+import pickle
 import sys
+import time
 from datetime import datetime
 
-from katatasso.helpers.const import categories
+from katatasso.helpers.const import CLF_METRICS_FILE, CLF_N_JOBS, categories
 from katatasso.helpers.logger import rootLogger as logger
+from katatasso.helpers.selection import top_features
 
 try:
-    from sklearn.metrics import classification_report, plot_confusion_matrix
-    from sklearn.model_selection import cross_val_score
+    from joblib import Parallel, delayed
+    from sklearn.base import clone
+    from sklearn.metrics import (ConfusionMatrixDisplay, accuracy_score,
+                                 classification_report, confusion_matrix,
+                                 f1_score, precision_score, recall_score)
+    from sklearn.model_selection import StratifiedKFold
+    import matplotlib
+    # Render to files only, never block on a window
+    matplotlib.use('Agg')
     import matplotlib.pyplot as plt
+    import numpy as np
+    import scipy.sparse as sp
 except ModuleNotFoundError as e:
     logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
     sys.exit(2)
 
 
-def evaluate(model, X, y):
-    num_validations = 5
+def _fold(model, X, y, train_idx, test_idx):
+    """Fit and predict a single cross-validation fold"""
+    model = clone(model)
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fit_time = time.perf_counter() - start
 
-    accuracy = cross_val_score(model, X, y, scoring='accuracy', cv=num_validations)
-    print(f'Accuracy: {str(round(100*accuracy.mean(), 2))}%')
+    start = time.perf_counter()
+    y_pred = model.predict(X[test_idx])
+    predict_time = time.perf_counter() - start
+    return test_idx, y_pred, fit_time, predict_time
 
-    f1 = cross_val_score(model, X, y, scoring='f1_weighted', cv=num_validations)
-    print(f'F1: {str(round(100*f1.mean(), 2))}%')
 
-    precision = cross_val_score(model, X, y, scoring='precision_weighted', cv=num_validations)
-    print(f'Precision: {str(round(100*precision.mean(), 2))}%')
+def evaluate(model, X, y, name='model', num_validations=5, n_jobs=CLF_N_JOBS):
+    """Cross-validate the model in a single parallel pass
 
-    recall = cross_val_score(model, X, y, scoring='recall_weighted', cv=num_validations)
-    print(f'Recall: {str(round(100*recall.mean(), 2))}%')
+        Every metric, the classification report and the confusion matrix are
+        computed from the same out-of-fold predictions, so each fold is only
+        fitted once. The results are appended as a JSON line to `CLF_METRICS_FILE`.
+
+        Parameters
+        ----------
+        model : estimator
+            The (unfitted or fitted) model to evaluate. It is cloned per fold.
+
+        X : array-like or sparse matrix
+        y : array-like
+
+        name : str
+            Name of the model in the metrics file, e.g. `v2-mnb`
+
+        num_validations : int
+            Number of folds
+
+        n_jobs : int
+            Number of folds to run in parallel
+
+        Returns
+        -------
+        metrics : dict
+    """
+    X = X if sp.issparse(X) else np.asarray(X)
+    y = np.asarray(y)
+    cv = StratifiedKFold(n_splits=num_validations)
+    folds = Parallel(n_jobs=n_jobs)(
+        delayed(_fold)(model, X, y, train_idx, test_idx)
+        for train_idx, test_idx in cv.split(X, y)
+    )
+
+    y_pred = np.empty_like(y)
+    scores = {'accuracy': [], 'f1': [], 'precision': [], 'recall': []}
+    for test_idx, fold_pred, _, _ in folds:
+        y_pred[test_idx] = fold_pred
+        y_true = y[test_idx]
+        scores['accuracy'].append(accuracy_score(y_true, fold_pred))
+        scores['f1'].append(f1_score(y_true, fold_pred, average='weighted', zero_division=0))
+        scores['precision'].append(precision_score(y_true, fold_pred, average='weighted', zero_division=0))
+        scores['recall'].append(recall_score(y_true, fold_pred, average='weighted', zero_division=0))
+
+    for metric, values in scores.items():
+        print(f'{metric.capitalize()}: {str(round(100*np.mean(values), 2))}%')
+
+    performance_report(y, y_pred)
+    matrix = plot_confusion_mat(y, y_pred)
+
+    metrics = {
+        'timestamp': datetime.now().isoformat(),
+        'model': name,
+        'samples': len(y),
+        'folds': num_validations,
+        'scores': {metric: {'mean': float(np.mean(values)), 'std': float(np.std(values)), 'folds': values}
+                   for metric, values in scores.items()},
+        'fit_time': [fit_time for _, _, fit_time, _ in folds],
+        'predict_time': [predict_time for _, _, _, predict_time in folds],
+        'report': classification_report(y, y_pred, output_dict=True, zero_division=0),
+        'confusion_matrix': matrix.tolist()
+    }
+    save_metrics(metrics)
+    return metrics
+
+
+def save_metrics(metrics, filepath=CLF_METRICS_FILE):
+    """Append the metrics as a JSON line, for tracking them over time"""
+    try:
+        with open(filepath, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(metrics, default=float) + '\n')
+        logger.debug(f'Metrics appended to `{filepath}`')
+    except Exception as e:
+        logger.critical(f'An unexpected error occurred while saving metrics to `{filepath}`.')
+        logger.error(e)
 
 
 def performance_report(y_test, y_pred):
@@ -38,11 +127,60 @@ def performance_report(y_test, y_pred):
         print(classification_report(y_test, y_pred, zero_division=0))
 
 
-def plot_confusion_mat(model, x_test, y_test):
-    plot_confusion_matrix(model, x_test, y_test, display_labels=categories, values_format='')
+def plot_confusion_mat(y_true, y_pred):
+    labels = list(range(len(categories)))
+    matrix = confusion_matrix(y_true, y_pred, labels=labels)
+    ConfusionMatrixDisplay(matrix, display_labels=categories).plot(values_format='d')
     now = datetime.now().isoformat()
     plt.savefig(f'confusion-matrix_{now}.png')
-    try:
-        plt.show()
-    except:
-        pass
+    plt.close('all')
+    return matrix
+
+
+def selection_report(model, x_train, x_test, y_train, y_test, scores, cutoffs, select, vocab_bytes):
+    """Report model size, classification latency and accuracy when keeping
+        the `k` highest scoring features, for each `k` in `cutoffs`
+
+        Parameters
+        ----------
+        model : estimator
+            The unfitted model, cloned for each cut-off
+
+        scores : array-like
+            Feature scores, see `helpers.selection.score_features`
+
+        select : callable
+            select(X, indices) returns X restricted to the given features
+
+        vocab_bytes : callable
+            vocab_bytes(indices) returns the size of the pruned vocabulary
+
+        Returns
+        -------
+        rows : list of dict
+    """
+    rows = []
+    for k in sorted(set(min(k, len(scores)) for k in cutoffs)):
+        indices = top_features(scores, k)
+        xtr, xte = select(x_train, indices), select(x_test, indices)
+        fitted = clone(model).fit(xtr, y_train)
+
+        # Classify one sample at a time, as the CLI does
+        samples = min(100, xte.shape[0])
+        start = time.perf_counter()
+        for i in range(samples):
+            fitted.predict(xte[i:i + 1])
+        latency = (time.perf_counter() - start) / max(samples, 1)
+
+        rows.append({
+            'features': k,
+            'model_kb': round(len(pickle.dumps(fitted)) / 1024, 1),
+            'vocabulary_kb': round(vocab_bytes(indices) / 1024, 1),
+            'latency_ms': round(latency * 1000, 3),
+            'accuracy': round(accuracy_score(y_test, fitted.predict(xte)), 4)
+        })
+
+    print(f'{"features":>10} {"model_kb":>10} {"vocabulary_kb":>14} {"latency_ms":>11} {"accuracy":>9}')
+    for row in rows:
+        print(f'{row["features"]:>10} {row["model_kb"]:>10} {row["vocabulary_kb"]:>14} {row["latency_ms"]:>11} {row["accuracy"]:>9}')
+    return rows
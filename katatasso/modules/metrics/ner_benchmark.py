@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput of per-document vs. batched named entity recognition.
+
+usage: python -m katatasso.modules.metrics.ner_benchmark [-n <NUM_DOCUMENTS>] [-b <BATCH_SIZE>]
+"""
+import getopt
+import sys
+import time
+
+from katatasso.helpers import ner
+from katatasso.helpers.const import CLF_NER_BATCH
+from katatasso.helpers.extraction import iter_all_tags
+from katatasso.helpers.logger import rootLogger as logger
+
+try:
+    import juicer
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+
+def benchmark(texts, batch_size=CLF_NER_BATCH):
+    """Compare the throughput of per-document and batched tagging
+
+        Parameters
+        ----------
+        texts : list of str
+
+        batch_size : int
+            Number of documents tagged in one call in batched mode
+
+        Returns
+        -------
+        results : dict
+            Documents per second of each mode
+    """
+    tagger = ner.get_tagger()
+    start = time.perf_counter()
+    for text in texts:
+        juicer.extract_stanford(text, named_only=False, stemming=False, tagger=tagger)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in ner.extract_batch(texts, tagger=tagger, batch_size=batch_size):
+        pass
+    batched = time.perf_counter() - start
+
+    return {
+        'documents': len(texts),
+        'batch_size': batch_size,
+        'per_document_docs_s': round(len(texts) / single, 2),
+        'batched_docs_s': round(len(texts) / batched, 2),
+        'speedup': round(single / batched, 2)
+    }
+
+
+def main():
+    n, batch_size = 200, CLF_NER_BATCH
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], 'n:b:')
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+    for opt, arg in opts:
+        if not arg.isnumeric() or int(arg) < 1:
+            logger.critical(f'{opt}={arg} must be a positive number.')
+            sys.exit(2)
+        if opt == '-n':
+            n = int(arg)
+        elif opt == '-b':
+            batch_size = int(arg)
+
+    texts = []
+    for _, _, text, _ in iter_all_tags():
+        if text:
+            texts.append(text)
+        if len(texts) >= n:
+            break
+    results = benchmark(texts, batch_size=batch_size)
+    for k, v in results.items():
+        print(f'{k}: {v}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput and equivalence of the text modes (see `helpers.plaintext`).
+
+Each email of a fixture directory is extracted by `emailyzer` (`html_as_text`),
+by the fast HTML tokenizer, and by the fast mode as ingested (the `text/plain`
+part when there is one). The token streams of the fast HTML tokenizer are
+compared with `emailyzer`'s, after normalization, and the exit status is 1 if
+their mean Jaccard similarity is below the threshold.
+
+usage: python -m katatasso.modules.metrics.text_benchmark [-d <DIRECTORY>] [-n <NUM_EMAILS>] [-t <THRESHOLD>]
+"""
+import getopt
+import os
+import sys
+import time
+
+from katatasso.helpers import plaintext
+from katatasso.helpers.const import CLF_TRAININGDATA_PATH
+from katatasso.helpers.logger import rootLogger as logger
+from katatasso.helpers.normalize import NORMALIZER
+
+try:
+    import emailyzer
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+
+def fixture_files(path, n=None):
+    """The .eml files under `path`, in a stable order"""
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith('.eml'))
+    return files[:n] if n else files
+
+
+def _timed(extract, raws):
+    start = time.perf_counter()
+    texts = [extract(raw) for raw in raws]
+    return texts, time.perf_counter() - start
+
+
+def _jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def benchmark(files):
+    """Compare the text modes on email files
+
+        Parameters
+        ----------
+        files : list of str
+            .eml files
+
+        Returns
+        -------
+        results : dict
+            Emails per second of each mode, and how close the token streams
+            of the fast HTML tokenizer are to `emailyzer`'s
+    """
+    raws = []
+    for filepath in files:
+        with open(filepath, 'rb') as f:
+            raws.append(f.read())
+
+    # emailyzer reads the files itself
+    start = time.perf_counter()
+    reference = [emailyzer.from_file(filepath).html_as_text for filepath in files]
+    slow = time.perf_counter() - start
+    html, fast_html = _timed(lambda raw: plaintext.message_text(raw, prefer_plain=False)[0], raws)
+    _, fast = _timed(lambda raw: plaintext.message_text(raw, prefer_plain=True)[0], raws)
+
+    identical = 0
+    similarity = []
+    for expected, actual in zip(reference, html):
+        expected, actual = NORMALIZER.tokenize(expected or ''), NORMALIZER.tokenize(actual)
+        identical += expected == actual
+        similarity.append(_jaccard(expected, actual))
+
+    return {
+        'emails': len(files),
+        'emailyzer_emails_s': round(len(files) / slow, 2),
+        'fast_html_emails_s': round(len(files) / fast_html, 2),
+        'fast_emails_s': round(len(files) / fast, 2),
+        'speedup': round(slow / fast, 2),
+        'identical_token_streams': round(identical / len(files), 4) if files else None,
+        'mean_jaccard': round(sum(similarity) / len(similarity), 4) if similarity else None,
+        'min_jaccard': round(min(similarity), 4) if similarity else None
+    }
+
+
+def main():
+    path, n, threshold = CLF_TRAININGDATA_PATH, None, 0.95
+    try:
+        opts, _ = getopt.getopt(sys.argv[1:], 'd:n:t:')
+    except getopt.GetoptError:
+        print(__doc__)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-d':
+            path = arg
+        elif opt == '-n':
+            if not arg.isnumeric() or int(arg) < 1:
+                logger.critical(f'{opt}={arg} must be a positive number.')
+                sys.exit(2)
+            n = int(arg)
+        elif opt == '-t':
+            threshold = float(arg)
+
+    files = fixture_files(path, n)
+    if not files:
+        logger.critical(f'No .eml files found in `{path}`')
+        sys.exit(2)
+    results = benchmark(files)
+    for k, v in results.items():
+        print(f'{k}: {v}')
+    if results['mean_jaccard'] < threshold:
+        logger.error(f'The fast text mode diverges from emailyzer (mean Jaccard {results["mean_jaccard"]} < {threshold})')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import itertools
+import sys
+import time
+from datetime import datetime
+
+from katatasso.helpers import cache
+from katatasso.helpers.const import (CLF_N_JOBS, CLF_SAMPLING, CLF_SEED,
+                                     SWEEP_ALGOS, SWEEP_ALPHAS,
+                                     SWEEP_DICT_NUMS, SWEEP_NORMS)
+from katatasso.helpers.extraction import (count_words, get_n_tags,
+                                          iter_all_tags, sort_by_frequency,
+                                          standardize)
+from katatasso.helpers.logger import rootLogger as logger
+from katatasso.modules.trainer import get_model, v2_cache_config
+
+try:
+    from joblib import Parallel, delayed
+    from sklearn.metrics import accuracy_score
+    from sklearn.model_selection import train_test_split
+    from sklearn.feature_extraction.text import TfidfTransformer
+    import pandas as pd
+except ModuleNotFoundError as e:
+    logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
+    sys.exit(2)
+
+
+def _evaluate(counts, labels, dict_num, norm, std, algo, alpha):
+    """Fit and score a single grid point"""
+    x = counts[:, :dict_num].tocsr()
+    x = TfidfTransformer(norm=norm).fit_transform(x)
+    x_train, x_test, y_train, y_test = train_test_split(x, labels, test_size=0.3, random_state=69)
+    if std:
+        x_train, x_test = standardize(x_train, x_test)
+    model = get_model(algo, alpha=alpha)
+
+    start = time.perf_counter()
+    model.fit(x_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_pred = model.predict(x_test)
+    predict_time = time.perf_counter() - start
+
+    return {
+        'score': accuracy_score(y_test, y_pred),
+        'fit_ms': round(fit_time * 1000, 2),
+        'predict_ms': round(predict_time * 1000, 2),
+        'algo': algo,
+        'alpha': alpha,
+        'dict_num': dict_num,
+        'std': std,
+        'norm': norm or 'none'
+    }
+
+
+def sweep(n=None, seed=CLF_SEED, strategy=CLF_SAMPLING, algos=SWEEP_ALGOS, alphas=SWEEP_ALPHAS, dict_nums=SWEEP_DICT_NUMS,
+          norms=SWEEP_NORMS, stds=(False, True), n_jobs=CLF_N_JOBS):
+    """Evaluate a grid of hyperparameters on a single vectorization of the corpus
+
+        The corpus is read and vectorized once. The vocabulary is sorted by
+        frequency, so every dictionary size is a column slice of the largest one.
+
+        Parameters
+        ----------
+        n : int
+            Select n samples from each category. (Default: All)
+
+        seed : int
+            Seed for a reproducible sample. (Default: random)
+
+        strategy : str
+            Sampling strategy, `balanced` or `proportional`
+
+        algos : list of str
+            Algorithms to evaluate (`mnb`, `cnb`)
+
+        alphas : list of float
+            Smoothing parameters to evaluate
+
+        dict_nums : list of int
+            Dictionary sizes (number of most common words) to evaluate
+
+        norms : list of str or None
+            TF-IDF normalization to evaluate (`l1`, `l2`, None)
+
+        stds : list of bool
+            Whether to standardize the data
+
+        n_jobs : int
+            Number of parallel jobs
+
+        Returns
+        -------
+        results : pandas.DataFrame
+            The grid points ranked by score
+    """
+    key = cache.make_key({'sweep': v2_cache_config()}, n, seed, strategy)
+    cached = cache.load(key)
+    if cached:
+        counts, labels, _ = cached
+    else:
+        tags = get_n_tags(n, seed=seed, strategy=strategy) if n else iter_all_tags()
+        counts, labels, vectorizer = count_words(tags)
+        counts, _ = sort_by_frequency(counts, vectorizer.vocabulary_)
+        cache.save(key, counts, labels)
+
+    dict_nums = sorted({min(d, counts.shape[1]) for d in dict_nums})
+    counts = counts[:, :dict_nums[-1]]
+
+    grid = list(itertools.product(dict_nums, norms, stds, algos, alphas))
+    logger.debug(f'Sweeping {len(grid)} grid points over {counts.shape[0]} samples using n_jobs={n_jobs}')
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_evaluate)(counts, labels, *params) for params in grid
+    )
+
+    results = pd.DataFrame(results).sort_values(['score', 'fit_ms'], ascending=[False, True])
+    results.index = range(1, len(results) + 1)
+    results.index.name = 'rank'
+
+    now = datetime.now().isoformat()
+    fname = f'sweep_{now}.csv'
+    results.to_csv(fname)
+    print(results.to_string())
+    logger.debug(f'Sweep results saved to file `{fname}`')
+    return results
@@ -1,11 +1,20 @@
+import collections
 import os
+import queue
 import sqlite3
 import sys
+import threading
+import time
+from urllib.parse import quote, urlencode
 
 import emailyzer
 from flask import Flask, redirect, render_template, request
 
-from katatasso.helpers.const import CATEGORIES, DBFILE, CLF_TRAININGDATA_PATH
+from katatasso.helpers import search, storage, watch
+from katatasso.helpers.const import (CATEGORIES, CLF_SEARCH_LIMIT,
+                                     CLF_SEARCH_SIMILARITY, CLF_TAGGER_CACHE,
+                                     CLF_TAGGER_PAGE, CLF_TAGGER_PREFETCH,
+                                     CLF_TAGGER_STATS_TTL, CLF_TRAININGDATA_PATH)
 from katatasso.helpers.extraction import get_file_paths
 
 DATAPATH = CLF_TRAININGDATA_PATH
@@ -40,99 +49,393 @@ def load_emails():
 
 def create_conn():
     """
-    Connect to the database file
+    Connect to the database file (one connection per thread)
     """
-    return sqlite3.connect(DBFILE)
+    return storage.connect()
 
 def init_db():
     """
-    Inititalize database
+    Inititalize database, or bring its schema up to date
     """
-    conn = create_conn()
-    c = conn.cursor()
-    c.execute('CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY AUTOINCREMENT, filepath TEXT NOT NULL, tag INTEGER)')
-    conn.commit()
-    conn.close()
+    create_conn()
 
 def tag():
     """
-    Add the tags to the DB
+    Add the emails that arrived since the last start to the DB (emails already in it keep their tag).
+        Only the directories that changed are listed, see `helpers.watch`.
+        Untagged emails in root dir
     """
     conn = create_conn()
-    c = conn.cursor()
-    tags = load_emails()
-    c.executemany('INSERT INTO tags (filepath, tag) VALUES (?,?)', tags)
-    conn.commit()
-    conn.close()
+    cursors = watch.load_cursors(conn, watcher='tagger')
+    roots = [(directory, tag, True) for directory, tag in watch.category_dirs(DATAPATH)] + [(DATAPATH, -1, False)]
+    arrived, _, updates, removed = watch.poll(conn, cursors, path=DATAPATH, settle=0, roots=roots, parsed=False)
+    conn.executemany('INSERT OR IGNORE INTO tags (filepath, tag) VALUES (?,?)', arrived)
+    # Commits the new rows too
+    watch.save_cursors(conn, cursors, updates, removed, watcher='tagger')
+    if arrived:
+        invalidate_stats()
+    print(f'Synced {len(arrived)} new emails')
 
-def load_tags():
-    conn = create_conn()
-    c = conn.cursor()
-    c.execute('SELECT * FROM tags')
-    res = c.fetchall()
-    conn.close()
-    return res
+def load_tags(after=None, before=None, tag=None, limit=CLF_TAGGER_PAGE):
+    """
+    A page of tags, in id order, with keyset pagination:
+        the `limit` rows after the id `after`, or before the id `before`,
+        optionally only those tagged `tag`
+    """
+    where = []
+    params = []
+    if tag is not None:
+        where.append('tag = ?')
+        params.append(tag)
+    if before is not None:
+        where.append('id < ?')
+        params.append(before)
+        order = 'DESC'
+    else:
+        where.append('id > ?')
+        params.append(after or 0)
+        order = 'ASC'
+    c = create_conn().cursor()
+    c.execute(f'SELECT id, filepath, tag FROM tags WHERE {" AND ".join(where)} ORDER BY id {order} LIMIT ?',
+              (*params, limit))
+    rows = c.fetchall()
+    return rows[::-1] if before is not None else rows
+
+_stats = {'stats': None, 'time': 0}
+_stats_lock = threading.Lock()
+
+def load_stats():
+    """
+    Number of emails per tag, from one GROUP BY query, cached for CLF_TAGGER_STATS_TTL seconds
+    """
+    with _stats_lock:
+        if _stats['stats'] is None or time.monotonic() - _stats['time'] > CLF_TAGGER_STATS_TTL:
+            _stats['stats'] = storage.category_stats()
+            _stats['time'] = time.monotonic()
+        return _stats['stats']
+
+def invalidate_stats():
+    with _stats_lock:
+        _stats['stats'] = None
 
 def load_tag(filepath):
-    conn = create_conn()
-    c = conn.cursor()
-    c.execute('SELECT * FROM tags WHERE filename=?', (filepath,))
-    res = c.fetchone()
-    conn.close()
-    return res
+    c = create_conn().cursor()
+    c.execute('SELECT id, filepath, tag FROM tags WHERE filepath=?', (filepath,))
+    return c.fetchone()
 
 def save_tag(filepath, tag):
     conn = create_conn()
     c = conn.cursor()
-    c.execute('UPDATE tags SET tag=? WHERE filename=?', (tag, filepath))
+    c.execute('UPDATE tags SET tag=? WHERE filepath=?', (tag, filepath))
     conn.commit()
-    conn.close()
+    invalidate_stats()
+    render_cache.discard(filepath)
 
-def get_next(filename):
+def save_tags(ids, tag):
+    """
+    Tag many emails in one transaction
+    """
     conn = create_conn()
-    c = conn.cursor()
-    c.execute('SELECT id FROM tags WHERE filename=?', (filename,))
-    cid = c.fetchone()[0]
-    c.execute('SELECT * FROM tags WHERE id=?', (cid + 1,))
-    return c.fetchone()
+    filepaths = []
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        filepaths += [row[0] for row in conn.execute(
+            f'SELECT filepath FROM tags WHERE id IN ({",".join("?" * len(chunk))})', chunk
+        )]
+    with conn:
+        conn.executemany('UPDATE tags SET tag=? WHERE id=?', [(tag, id) for id in ids])
+    invalidate_stats()
+    render_cache.discard(*filepaths)
+    return len(filepaths)
+
+# Orders of the queue: by id, or the untagged emails the model is least sure about first
+QUEUE_ORDERS = ['id', 'uncertainty']
+
+def get_next(filepath, n=1, order='id'):
+    """
+    The next email after `filepath` in the queue, or the next `n` (a list) if n > 1
+    """
+    c = create_conn().cursor()
+    if order == 'uncertainty':
+        # Scored by `modules.active_learning`, unscored emails come last
+        c.execute('SELECT id, filepath, tag FROM tags WHERE tag = -1 AND filepath != ? '
+                  'ORDER BY uncertainty DESC, id DESC LIMIT ?', (filepath, n))
+    else:
+        c.execute('SELECT id, filepath, tag FROM tags WHERE id > (SELECT id FROM tags WHERE filepath=?) ORDER BY id LIMIT ?',
+                  (filepath, n))
+    return c.fetchone() if n == 1 else c.fetchall()
+
+class RenderCache(object):
+    """
+    LRU cache of rendered email pages, keyed by (filepath, tag, queue order)
+    so a page is rendered again once its tag changes
+    """
+    def __init__(self, size=CLF_TAGGER_CACHE):
+        self.size = size
+        self.pages = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    def get(self, key):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.pages.move_to_end(key)
+            return page
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.pages
+
+    def touch(self, key):
+        """
+        Mark a page as recently used, without counting a hit. False if it isn't cached
+        """
+        with self.lock:
+            if key not in self.pages:
+                return False
+            self.pages.move_to_end(key)
+            return True
+
+    def discard(self, *filepaths):
+        """
+        Drop the pages of emails, e.g. once their tag changed
+        """
+        filepaths = set(filepaths)
+        with self.lock:
+            for key in [key for key in self.pages if key[0] in filepaths]:
+                del self.pages[key]
+
+    def put(self, key, page):
+        if self.size < 1:
+            return
+        with self.lock:
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': f'{self.hits / lookups:.1%}' if lookups else '-',
+                'prefetched': self.prefetched,
+                'cached': f'{len(self.pages)}/{self.size}'
+            }
+
+render_cache = RenderCache()
+_prefetch_queue = queue.Queue()
+_prefetch_thread = None
+
+def render_email(tag, order='id'):
+    """
+    Parse and render the page of an email (id, filepath, tag)
+    """
+    email = emailyzer.from_file(tag[1])
+    return render_template('email.html', email=email, tag=tag, cat=CATEGORIES.get(tag[2]), order=order)
+
+def _prefetch_worker():
+    while True:
+        tag, order = _prefetch_queue.get()
+        key = (tag[1], tag[2], order)
+        if key in render_cache:
+            continue
+        try:
+            with app.app_context():
+                page = render_email(tag, order=order)
+        except Exception as e:
+            # Left to `/show`, which reports the error
+            print(e)
+            continue
+        render_cache.put(key, page)
+        with render_cache.lock:
+            render_cache.prefetched += 1
+
+def prefetch(filepath, depth=CLF_TAGGER_PREFETCH, order='id'):
+    """
+    Render the next `depth` emails of the queue in the background
+    """
+    global _prefetch_thread
+    if depth < 1 or render_cache.size < 1:
+        return
+    if _prefetch_thread is None:
+        _prefetch_thread = threading.Thread(target=_prefetch_worker, name='prefetch', daemon=True)
+        _prefetch_thread.start()
+    # The upcoming pages that are already cached are kept from being evicted
+    for tag in get_next(filepath, n=depth, order=order):
+        if not render_cache.touch((tag[1], tag[2], order)):
+            _prefetch_queue.put((tag, order))
+
+def _int_arg(name):
+    value = request.args.get(name, '')
+    return int(value) if value.lstrip('-').isnumeric() else None
 
 @app.route('/', methods=['GET'])
 def index():
-    tags = load_tags()
+    """
+    Category stats, and a page of emails
+        ?tag=<TAG>          Only the emails with this tag
+        ?untagged=1         Only the untagged emails (same as ?tag=-1)
+        ?after=<ID>         The page after this id
+        ?before=<ID>        The page before this id
+    """
+    tag = -1 if request.args.get('untagged') else _int_arg('tag')
+    tags = load_tags(after=_int_arg('after'), before=_int_arg('before'), tag=tag)
+    stats = load_stats()
     tagstats = {}
-    for tag, cat in CATEGORIES.items():
-        tagstats[tag] = { 'count': 0, 'category': cat }
-    for tag in tags:
-        tagstats[tag[2]]['count'] += 1
+    for t, cat in CATEGORIES.items():
+        tagstats[t] = { 'count': stats.get(t, 0), 'category': cat }
     return render_template(
         'index.html',
         appname = 'katatasso tagger',
         tags = tags,
         tagstats = tagstats,
-        total = len(tags)
+        total = sum(stats.values()),
+        tag = tag,
+        # Links to the previous and next pages, keeping the filter
+        filter = '' if tag is None else f'tag={tag}&',
+        cachestats = render_cache.stats(),
+        prev_id = tags[0][0] if tags and load_tags(before=tags[0][0], tag=tag, limit=1) else None,
+        next_id = tags[-1][0] if len(tags) == CLF_TAGGER_PAGE else None
     )
 
+def _show_url(filepath, order='id'):
+    return f'/show?filepath={quote(filepath)}' + (f'&order={order}' if order != 'id' else '')
+
+@app.route('/next', methods=['GET'])
+def next_informative():
+    """
+    The untagged email the model is the least sure about (see `modules.active_learning`).
+    Tagging it moves on to the next most informative one.
+    """
+    c = create_conn().cursor()
+    c.execute('SELECT id, filepath, tag FROM tags WHERE tag = -1 ORDER BY uncertainty DESC, id DESC LIMIT 1')
+    tag = c.fetchone()
+    if tag:
+        return redirect(_show_url(tag[1], order='uncertainty'))
+    else:
+        return '201 donkey needs a nap'
+
 @app.route('/show', methods=['GET'])
 def show():
-    filepath = request.form.get('filepath')
+    filepath = request.args.get('filepath')
+    order = request.args.get('order', 'id')
+    order = order if order in QUEUE_ORDERS else 'id'
     try:
         if filepath:
             tag = load_tag(filepath)
-            cat = CATEGORIES.get(tag[2])
-            email = emailyzer.from_file(filepath)
-            return render_template('email.html', email=email, tag=tag, cat=cat)
+            key = (tag[1], tag[2], order)
+            page = render_cache.get(key)
+            if page is None:
+                page = render_email(tag, order=order)
+                render_cache.put(key, page)
+            prefetch(filepath, order=order)
+            return page
     except Exception as e:
         print(e)
         return '500 an error occurred'
 
+def _search_params(args):
+    """
+    The search of a request: (query, similar, tag, threshold)
+    """
+    similar = args.get('similar', '')
+    tag = args.get('tag', '')
+    try:
+        threshold = float(args.get('threshold') or CLF_SEARCH_SIMILARITY)
+    except ValueError:
+        threshold = CLF_SEARCH_SIMILARITY
+    return (
+        args.get('q', '').strip(),
+        int(similar) if similar.isnumeric() else None,
+        int(tag) if tag.lstrip('-').isnumeric() else None,
+        threshold
+    )
+
+def _search(q, similar, tag, threshold, limit=None):
+    """
+    The results of a search, list of (id, filepath, tag, snippet or similarity)
+    """
+    if similar is not None:
+        return search.similar(similar, threshold=threshold, tag=tag, limit=limit)
+    if q:
+        return search.match(q, tag=tag, limit=limit)
+    return []
+
+@app.route('/search', methods=['GET'])
+def search_page():
+    """
+    Full-text search, to tag many emails at once
+        ?q=<QUERY>          Emails matching an FTS5 query
+        ?similar=<ID>       Emails similar to this email
+        ?threshold=<X>      Minimum similarity (Jaccard) of similar emails
+        ?tag=<TAG>          Only the emails with this tag
+    """
+    q, similar, tag, threshold = _search_params(request.args)
+    error = None
+    results = []
+    total = 0
+    if not search.available():
+        error = 'Full-text search is unavailable: SQLite was built without FTS5'
+    else:
+        try:
+            results = _search(q, similar, tag, threshold)
+            total = len(results)
+            results = results[:CLF_SEARCH_LIMIT]
+        except sqlite3.OperationalError as e:
+            error = f'Invalid query: {e}'
+    return render_template(
+        'search.html',
+        appname = 'katatasso tagger',
+        q = q,
+        similar = similar,
+        tag = tag,
+        threshold = threshold,
+        results = results,
+        total = total,
+        tagged = request.args.get('tagged'),
+        error = error,
+        categories = CATEGORIES
+    )
+
+@app.route('/bulk_tag', methods=['POST'])
+def receive_bulk_tag():
+    """
+    Tag the selected results of a search, or all of them (`all`), in one transaction
+    """
+    q, similar, tag, threshold = _search_params(request.form)
+    cat = request.form.get('cat', '')
+    if not cat.lstrip('-').isnumeric() or int(cat) not in CATEGORIES:
+        return f'400 invalid category `{cat}`', 400
+    cat = int(cat)
+    if request.form.get('all'):
+        ids = [result[0] for result in _search(q, similar, tag, threshold)]
+    else:
+        ids = [int(id) for id in request.form.getlist('ids') if id.isnumeric()]
+    tagged = save_tags(ids, cat)
+    params = {k: v for k, v in (('q', q), ('similar', similar), ('tag', tag)) if v not in (None, '')}
+    if similar is not None:
+        params['threshold'] = threshold
+    return redirect(f'/search?{urlencode({**params, "tagged": tagged})}')
+
 @app.route('/tag', methods=['POST'])
 def receive_tag():
     filepath = request.form.get('filepath')
     cat = request.form.get('cat')
+    order = request.form.get('order', 'id')
+    order = order if order in QUEUE_ORDERS else 'id'
     save_tag(filepath, cat)
-    next_tag = get_next(filepath)
+    next_tag = get_next(filepath, order=order)
     if next_tag:
-        return redirect(f'/show/{next_tag[1]}')
+        return redirect(_show_url(next_tag[1], order=order))
     else:
         return '201 donkey needs a nap'
 
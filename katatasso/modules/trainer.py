@@ -1,22 +1,40 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import pickle
 import sys
-from datetime import datetime
+import time
 
-from katatasso.helpers.const import FN_MODEL
-from katatasso.helpers.extraction import (create_dataframe, make_dataset,
-                                          make_dictionary, standardize,
-                                          process_dataframe)
+from katatasso.helpers import cache, corpus_store, plaintext, profiling
+from katatasso.helpers.const import (CLF_AL_ALGO, CLF_AL_RESCORE, CLF_DEDUP,
+                                     CLF_DEDUP_NUM_PERM, CLF_DEDUP_SHINGLE,
+                                     CLF_DEDUP_THRESHOLD, CLF_DICT_NUM,
+                                     CLF_N_JOBS, CLF_SAMPLING,
+                                     CLF_SEED, CLF_SELECT_CUTOFFS,
+                                     CLF_SELECT_K, CLF_SELECT_METHOD)
+from katatasso.helpers.dedup import deduplicate
+from katatasso.helpers.extraction import (count_words, dictionary_vectorizer,
+                                          get_all_tags, get_n_tags,
+                                          iter_all_tags, iter_tags_by_id,
+                                          make_dataset, make_dictionary,
+                                          sample_tag_ids, standardize,
+                                          tfidf_vectorizer, training_text_mode,
+                                          vocabulary_terms)
+from katatasso.modules import active_learning
 from katatasso.modules.metrics import learning_curve, measure
 from katatasso.helpers.logger import rootLogger as logger
-from katatasso.helpers.utils import save_model, load_model, save_obj, load_obj
+from katatasso.helpers.normalize import NORMALIZER
+from katatasso.helpers.selection import score_features, top_features
+from katatasso.helpers.utils import save_model, save_vectorizer
 
 try:
+    from joblib import Parallel, delayed
+    from sklearn.base import clone
     from sklearn.metrics import accuracy_score
     from sklearn.model_selection import train_test_split
     from sklearn.naive_bayes import MultinomialNB, ComplementNB
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler, normalize
     from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
-    import matplotlib.pyplot as plt
 except ModuleNotFoundError as e:
     logger.critical(f'Module `{e.name}` not found. Please install before proceeding.')
     sys.exit(2)
@@ -26,52 +44,410 @@ def generate_dataset():
     pass
 
 
-def train(std=False, algo='mnb'):
-    """Train a model using Naive Bayes
+def get_model(algo='mnb', alpha=1.0):
+    """Create an unfitted Naive Bayes model
 
         Parameters
         ----------
-        std : bool
-            Standardize the data
-
         algo : str
             The algorithm to use. Can be either `mnb` or `cnb`
 
+        alpha : float
+            Additive (Laplace/Lidstone) smoothing parameter
+
         Returns
         -------
+        model : MultinomialNB or ComplementNB
     """
-    dictionary = make_dictionary()
-    features, labels = make_dataset(dictionary)
-    ### Todo: Remove
-    save_obj(features, 'v1_features.p')
-    save_obj(labels, 'v1_labels.p')
-    ###
-
-    x_train, x_test, y_train, y_test = train_test_split(features, labels, test_size=0.3, random_state=69)
-    
-    if std:
-        x_train, x_test = standardize(x_train, x_test)
     if algo == 'cnb':
-        model = ComplementNB()
+        return ComplementNB(alpha=alpha)
     elif algo == 'mnb':
-        model = MultinomialNB()
+        return MultinomialNB(alpha=alpha)
     else:
         logger.critical(f'Parameter `algo` specifies unknown algorithm. Defaulting to `mnb`.')
-        model = MultinomialNB()
+        return MultinomialNB(alpha=alpha)
+
+
+def v2_cache_config():
+    """The preprocessing/vectorizer config that determines the v2 feature matrix"""
+    return {
+        'version': 'v2',
+        'normalizer': NORMALIZER,
+        'vectorizer': CountVectorizer().get_params(),
+        'tfidf': TfidfTransformer().get_params()
+    }
+
+
+def _dedup_config(dedup):
+    if not dedup:
+        return None
+    return {'threshold': CLF_DEDUP_THRESHOLD, 'num_perm': CLF_DEDUP_NUM_PERM, 'shingle': CLF_DEDUP_SHINGLE}
+
+
+def deduplicate_corpus(n=None, seed=None, strategy=CLF_SAMPLING):
+    """Collapse the near-duplicates among the tags to train on (see `helpers.dedup`)
+
+        Returns
+        -------
+        ids : numpy.ndarray
+            The ids of the kept tags
+        weights : numpy.ndarray
+            Their sample weights (near-duplicate cluster sizes)
+    """
+    if n:
+        rows = iter_tags_by_id(sample_tag_ids(n, seed=seed, strategy=strategy), columns='id, tag, text')
+    else:
+        rows = iter_all_tags(columns='id, tag, text')
+    with profiling.stage('dedup'):
+        return deduplicate(rows)
+
+
+def read_corpus(n=None, seed=None, strategy=CLF_SAMPLING, dedup=CLF_DEDUP, stream=True):
+    """Read the tags to train on, streamed from the database or as a list
+
+        Returns
+        -------
+        tags : iterable of (filepath, tag, text, hosts)
+        weights : numpy.ndarray or None
+            The sample weights (near-duplicate cluster sizes) if `dedup`
+    """
+    if dedup:
+        ids, weights = deduplicate_corpus(n, seed=seed, strategy=strategy)
+        # Only the ids were kept, so the text of the kept tags is read again
+        tags = iter_tags_by_id(ids)
+        return (tags if stream else list(tags)), weights
+    if n:
+        return get_n_tags(n, seed=seed, strategy=strategy), None
+    return (iter_all_tags() if stream else get_all_tags()), None
+
+
+def load_features(version, n=None, corpus=None, seed=None, strategy=CLF_SAMPLING, dedup=CLF_DEDUP):
+    """Build the feature matrix and labels for a model version,
+        or load them from the cache
+
+        Parameters
+        ----------
+        version : str
+            The model version, `v1` or `v2`
+
+        n : int
+            Select n samples from each category. (Default: All)
 
-    model.fit(x_train, y_train)
-    save_model(model, version='v1', algo=algo)
+        corpus : callable
+            Returns the tags (a list or a stream) to build the features from,
+            and their weights (see `read_corpus`). Shared between versions,
+            so the database is only read (and deduplicated) once per training run.
 
-    y_pred = model.predict(x_test)
-    print(f'Accuracy: {accuracy_score(y_test, y_pred)}')
-    measure.evaluate(model, x_test, y_test)
-    measure.performance_report(y_test, y_pred)
-    measure.plot_confusion_mat(model, x_test, y_test)
-    title = f'Learning Curves ({algo.upper()})'
-    learning_curve.plot(model, x_test, y_test, title=title)
+        seed : int
+            Seed for a reproducible sample. (Default: random)
 
+        strategy : str
+            Sampling strategy, `balanced` or `proportional`
 
-def trainv2(std=False, algo='mnb', n=None):
+        dedup : bool
+            Collapse near-duplicate emails into one weighted sample
+
+        Returns
+        -------
+        features : sparse matrix
+        labels : array-like
+        vectorizer : CountVectorizer or TfidfVectorizer
+            The vectorizer that turns text into these features,
+            i.e. the v1 dictionary counts or the fitted v2 TF-IDF
+        weights : numpy.ndarray or None
+            The sample weights (near-duplicate cluster sizes) if `dedup`
+    """
+    if corpus is None:
+        corpus = lambda: read_corpus(n, seed=seed, strategy=strategy, dedup=dedup)
+    if version == 'v1':
+        config = {'version': 'v1', 'normalizer': NORMALIZER, 'dict_num': CLF_DICT_NUM}
+    else:
+        config = v2_cache_config()
+    key = cache.make_key(dict(config, dedup=_dedup_config(dedup)), n, seed, strategy)
+    with profiling.stage('cache.load'):
+        cached = cache.load(key)
+    if cached:
+        features, labels, extra = cached
+        return features, labels, extra['vectorizer'], extra['weights']
+
+    # Without deduplication, the pre-tokenized corpus store can stand in for the text.
+    # Tagging makes it out of date, and usually only needs the labels updated.
+    store = None if dedup else corpus_store.open_store(refresh=True)
+    if store is not None:
+        start = time.perf_counter()
+        with profiling.stage('vectorize.store'):
+            rows = store.select(n, seed=seed, strategy=strategy)
+            labels = store.labels[rows]
+            if version == 'v1':
+                dictionary, ids = store.dictionary(rows, CLF_DICT_NUM)
+                features = store.counts(rows)[:, ids]
+                vectorizer = dictionary_vectorizer(dictionary)
+            else:
+                counts, vectorizer = store.count_words(store.counts(rows))
+                transformer = TfidfTransformer().fit(counts)
+                features = transformer.transform(counts)
+                vectorizer = tfidf_vectorizer(vectorizer, transformer)
+        logger.info(f'[{version}] Vectorized {len(rows)} documents from the corpus store '
+                    f'in {round(time.perf_counter() - start, 2)}s')
+        cache.save(key, features, labels, extra={'vectorizer': vectorizer, 'weights': None})
+        return features, labels, vectorizer, None
+
+    tags, weights = corpus()
+
+    start = time.perf_counter()
+    if version == 'v1':
+        # Two passes over the tags, so a stream is read into memory
+        tags = list(tags)
+        dictionary = make_dictionary(tags=tags)
+        features, labels = make_dataset(dictionary, tags=tags)
+        vectorizer = dictionary_vectorizer(dictionary)
+    else:
+        counts, labels, vectorizer = count_words(tags)
+        with profiling.stage('tfidf'):
+            transformer = TfidfTransformer().fit(counts)
+            features = transformer.transform(counts)
+        del counts
+        vectorizer = tfidf_vectorizer(vectorizer, transformer)
+    elapsed = time.perf_counter() - start
+    del tags
+
+    if weights is not None:
+        # Vectorizing (and fitting) scale linearly with the number of documents
+        print(f'[{version}] Vectorized {len(weights)} documents in {round(elapsed, 2)}s, '
+              f'~{round(elapsed * (weights.sum() / len(weights) - 1), 2)}s saved by deduplication')
+
+    with profiling.stage('cache.save'):
+        cache.save(key, features, labels, extra={'vectorizer': vectorizer, 'weights': weights})
+    return features, labels, vectorizer, weights
+
+
+def select_features(version, X, indices):
+    """Restrict the feature matrix to the given columns"""
+    X = X[:, indices]
+    if version == 'v2':
+        # TF-IDF rows are l2-normalized over the whole vocabulary, so renormalize
+        X = normalize(X)
+    return X
+
+
+def prune_vectorizer(vectorizer, indices):
+    """Restrict the vectorizer's vocabulary (and IDF weights) to the given features"""
+    if indices is None:
+        return vectorizer
+    terms = vocabulary_terms(vectorizer)
+    pruned = clone(vectorizer).set_params(vocabulary=[terms[i] for i in indices])
+    if hasattr(vectorizer, 'idf_'):
+        pruned.idf_ = vectorizer.idf_[indices]
+    return pruned
+
+
+@profiling.timed('fit')
+def _fit(model, x_train, y_train, w_train=None):
+    return model.fit(x_train, y_train, sample_weight=w_train)
+
+
+def _report(model, version, algo, x_test, y_test):
+    with profiling.stage('predict'):
+        y_pred = model.predict(x_test)
+    print(f'[{version}-{algo}] Accuracy: {accuracy_score(y_test, y_pred)}')
+    with profiling.stage('evaluate'):
+        measure.evaluate(model, x_test, y_test, name=f'{version}-{algo}')
+
+
+def plot_learning_curves(data, algos, std=False, background=False):
+    """Plot the learning curve of every algorithm for each version
+
+        Parameters
+        ----------
+        data : dict
+            Maps each version to its (features, labels)
+
+        algos : list of str
+            The algorithms to use, `mnb` and/or `cnb`
+
+        std : bool
+            Standardize the data (within each split).
+
+        background : bool
+            Plot in background processes and return immediately
+
+        Returns
+        -------
+        processes : list of multiprocessing.Process
+            The background processes, if any
+    """
+    processes = []
+    for version, (features, labels) in data.items():
+        for algo in algos:
+            estimator = get_model(algo)
+            if std:
+                estimator = make_pipeline(StandardScaler(with_mean=False), estimator)
+            title = f'Learning Curves ({version} {algo.upper()})'
+            if background:
+                processes.append(learning_curve.plot_in_background(estimator, features, labels, title=title))
+            else:
+                learning_curve.plot(estimator, features, labels, title=title)
+    return processes
+
+
+def train_many(versions=('v2',), algos=('mnb',), std=False, n=None, n_jobs=CLF_N_JOBS,
+               curve=False, background=False, select_k=CLF_SELECT_K,
+               select_method=CLF_SELECT_METHOD, select_cutoffs=CLF_SELECT_CUTOFFS,
+               seed=CLF_SEED, strategy=CLF_SAMPLING, dedup=CLF_DEDUP):
+    """Train several Naive Bayes models in one pass
+
+        The database is read once, each version is vectorized once, and
+        every algorithm is fitted in parallel on the shared features.
+
+        Parameters
+        ----------
+        versions : list of str
+            The model versions to train, `v1` and/or `v2`
+
+        algos : list of str
+            The algorithms to use, `mnb` and/or `cnb`
+
+        std : bool
+            Standardize the data.
+
+        n : int
+            Select n samples from each category. (Default: All)
+
+        n_jobs : int
+            Number of models to fit in parallel
+
+        curve : bool
+            Plot learning curves once the models are saved
+
+        background : bool
+            Plot the learning curves in background processes
+
+        select_k : int
+            Keep only the `select_k` most informative features. (Default: All)
+            The pruned vocabulary is saved with the model.
+
+        select_method : str
+            How to score features, `chi2`, `mi` or `logodds`
+
+        select_cutoffs : list of int
+            Report model size, latency and accuracy at these numbers of features
+
+        seed : int
+            Seed for a reproducible sample. (Default: random)
+
+        strategy : str
+            Sampling strategy, `balanced` or `proportional`
+
+        dedup : bool
+            Collapse near-duplicate emails into one sample, weighted by the
+            size of the cluster, before vectorizing
+
+        Returns
+        -------
+    """
+    shared = []
+    def corpus():
+        if dedup:
+            # Deduplicate once, and stream the text of the kept tags for each version
+            if not shared:
+                shared.append(deduplicate_corpus(n, seed=seed, strategy=strategy))
+            ids, weights = shared[0]
+            return iter_tags_by_id(ids), weights
+        if len(versions) == 1:
+            # Nothing to share, stream the tags straight from the database
+            return read_corpus(n, seed=seed, strategy=strategy, dedup=False)
+        if not shared:
+            tags, weights = read_corpus(n, seed=seed, strategy=strategy, dedup=False, stream=False)
+            shared.append((list(tags), weights))
+        return shared[0]
+
+    # Saved with the vectorizers, so emails are classified with the same text extraction
+    text_mode = training_text_mode()
+
+    data = {}
+    splits = {}
+    for version in versions:
+        features, labels, vectorizer, weights = load_features(
+            version, n=n, corpus=corpus, seed=seed, strategy=strategy, dedup=dedup
+        )
+        # messages_train, messages_test, labels_train, labels_test
+        if weights is None:
+            x_train, x_test, y_train, y_test = train_test_split(features, labels, test_size=0.3, random_state=69)
+            w_train = None
+        else:
+            x_train, x_test, y_train, y_test, w_train, _ = \
+                train_test_split(features, labels, weights, test_size=0.3, random_state=69)
+
+        indices = None
+        if select_k:
+            with profiling.stage('select'):
+                scores = score_features(x_train, y_train, method=select_method)
+            if select_cutoffs:
+                print(f'[{version}] Feature selection ({select_method}):')
+                measure.selection_report(
+                    get_model(algos[0]), x_train, x_test, y_train, y_test, scores, select_cutoffs,
+                    select=lambda X, indices: select_features(version, X, indices),
+                    vocab_bytes=lambda indices: len(pickle.dumps(prune_vectorizer(vectorizer, indices)))
+                )
+            indices = top_features(scores, select_k)
+            logger.info(f'[{version}] Selected {len(indices)} of {features.shape[1]} features')
+            x_train, x_test = select_features(version, x_train, indices), select_features(version, x_test, indices)
+            features = select_features(version, features, indices)
+        vectorizer = prune_vectorizer(vectorizer, indices)
+        setattr(vectorizer, plaintext.TEXT_MODE_ATTR, text_mode)
+        save_vectorizer(vectorizer, version=version)
+
+        if curve:
+            data[version] = (features, labels)
+        if std:
+            x_train, x_test = standardize(x_train, x_test)
+        splits[version] = (x_train, x_test, y_train, y_test, w_train)
+    del shared[:]
+
+    jobs = [(version, algo) for version in versions for algo in algos]
+    # Naive Bayes fitting is mostly numpy, so threads share the data without copies
+    models = Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(_fit)(get_model(algo), splits[version][0], splits[version][2], splits[version][4])
+        for version, algo in jobs
+    )
+    with profiling.stage('model.save'):
+        for (version, algo), model in zip(jobs, models):
+            save_model(model, version=version, algo=algo)
+
+    for (version, algo), model in zip(jobs, models):
+        _, x_test, _, y_test, _ = splits[version]
+        _report(model, version, algo, x_test, y_test)
+
+    if CLF_AL_RESCORE and ('v2', CLF_AL_ALGO) in jobs:
+        # The queue of the tagger follows the new model. Only the emails with
+        # text are rescored, parsing the others is left to active_learning.
+        print(f'Rescored {active_learning.score(parse=False)} untagged emails for active learning')
+
+    if curve:
+        plot_learning_curves(data, algos, std=std, background=background)
+
+
+def train(std=False, algo='mnb', curve=False):
+    """Train a model using Naive Bayes
+
+        Parameters
+        ----------
+        std : bool
+            Standardize the data
+
+        algo : str
+            The algorithm to use. Can be either `mnb` or `cnb`
+
+        curve : bool
+            Plot the learning curve once the model is saved
+
+        Returns
+        -------
+    """
+    train_many(versions=['v1'], algos=[algo], std=std, curve=curve)
+
+
+def trainv2(std=False, algo='mnb', n=None, curve=False):
     """Train a model using Naive Bayes
 
         Parameters
@@ -85,35 +461,10 @@ def trainv2(std=False, algo='mnb', n=None):
         n : int
             Select n samples from each category. (Default: All)
 
+        curve : bool
+            Plot the learning curve once the model is saved
+
         Returns
         -------
     """
-    df = create_dataframe(n=n)
-    counts, df = process_dataframe(df, algo=algo)
-    ### Todo: Remove
-    save_obj(df, 'v2_dataframe.p')
-    save_obj(counts, 'v2_counts.p')
-    ###
-    # messages_train, messages_test, labels_train, labels_test
-    x_train, x_test, y_train, y_test = train_test_split(counts, df['label'], test_size=0.3, random_state=69)
-    if std:
-        x_train, x_test = standardize(x_train, x_test)
-    if algo == 'cnb':
-        model = ComplementNB()
-    elif algo == 'mnb':
-        model = MultinomialNB()
-    else:
-        logger.critical(f'Parameter `algo` specifies unknown algorithm. Defaulting to `mnb`.')
-        model = MultinomialNB()
-
-    model.fit(x_train, y_train)
-    save_model(model, version='v2', algo=algo)
-
-    y_pred = model.predict(x_test)
-    
-    print(f'Accuracy: {accuracy_score(y_test, y_pred)}')
-    measure.evaluate(model, x_test, y_test)
-    measure.performance_report(y_test, y_pred)
-    measure.plot_confusion_mat(model, x_test, y_test)
-    title = f'Learning Curves ({algo.upper()})'
-    learning_curve.plot(model, x_test, y_test, title=title)
\ No newline at end of file
+    train_many(versions=['v2'], algos=[algo], std=std, n=n, curve=curve)
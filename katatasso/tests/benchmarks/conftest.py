@@ -0,0 +1,64 @@
+"""
+The synthetic corpus of the benchmarks (see `helpers.synthetic`), sized with
+`--corpus-size`, `--corpus-files` and `--corpus-seed`.
+
+The corpus of each size and seed is generated once, under `--corpus-dir`,
+and reused by later runs. The models are trained in a temporary directory
+for each run, so a benchmark never classifies with the models of an older
+version of katatasso.
+"""
+import json
+import os
+
+import pytest
+
+from katatasso.helpers import cache, profiling, storage, synthetic, utils
+
+
+@pytest.fixture(scope='session')
+def corpus_dir(request):
+    """The directory of the corpus, generated unless it already exists"""
+    config = request.config
+    n, seed = config.getoption('corpus_size'), config.getoption('corpus_seed')
+    workdir = os.path.join(config.rootpath, config.getoption('corpus_dir'), f'{n}-{seed}')
+    spec = {'n': n, 'n_files': min(n, config.getoption('corpus_files')), 'seed': seed}
+    marker = os.path.join(workdir, 'corpus.json')
+    try:
+        with open(marker) as f:
+            if json.load(f) == spec:
+                return workdir
+    except (OSError, ValueError):
+        pass
+    synthetic.generate(workdir, n, n_files=spec['n_files'], seed=seed)
+    with open(marker, 'w') as f:
+        json.dump(spec, f)
+    return workdir
+
+
+@pytest.fixture(scope='module')
+def workdir(corpus_dir, tmp_path_factory):
+    """Point katatasso at the corpus, and at a temporary directory for the
+    models and everything else it writes"""
+    from katatasso.modules import trainer
+    models = tmp_path_factory.mktemp('models')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(storage, 'DBFILE', os.path.join(corpus_dir, 'tagger.db'))
+        mp.setattr(utils, 'FN_MODEL', str(models / 'model_'))
+        mp.setattr(utils, 'FN_VECTORIZER', str(models / 'vectorizer_'))
+        # Measure the work, not the caches, and nothing but the benchmark
+        mp.setattr(cache, 'CLF_CACHE', False)
+        mp.setattr(trainer, 'CLF_AL_RESCORE', False)
+        mp.setattr(profiling, '_enabled', True)
+        mp.chdir(models)
+        yield corpus_dir
+    storage.close(os.path.join(corpus_dir, 'tagger.db'))
+    profiling.drain()
+
+
+@pytest.fixture
+def stages(benchmark, workdir):
+    """Add the `--profile` stage breakdown of its rounds to the results"""
+    profiling.drain()
+    yield
+    benchmark.extra_info['stages'] = profiling.report()
+    profiling.drain()
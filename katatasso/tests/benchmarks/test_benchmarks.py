@@ -0,0 +1,111 @@
+"""
+Benchmarks of ingestion, training and classification, to catch performance
+regressions. They need `pytest-benchmark`, see the README.
+"""
+import itertools
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from katatasso.helpers import extraction, storage, utils, watch  # noqa: E402
+from katatasso.helpers.dataset_generator import iter_parsed  # noqa: E402
+from katatasso.modules import classifier, trainer  # noqa: E402
+from katatasso.modules.metrics.text_benchmark import fixture_files  # noqa: E402
+
+VERSIONS = ['v1', 'v2']
+# Number of emails classified one at a time
+CLASSIFY_SINGLE = 100
+# Training is slow enough on large corpora that a few rounds are enough
+TRAIN_ROUNDS = 3
+
+
+@pytest.fixture(scope='module')
+def tags(workdir):
+    return extraction.get_all_tags()
+
+
+@pytest.fixture(scope='module')
+def files(workdir):
+    return [(filepath, tag) for directory, tag in watch.category_dirs(os.path.join(workdir, 'emails'))
+            for filepath in fixture_files(directory)]
+
+
+@pytest.fixture(scope='module')
+def texts(files):
+    texts = []
+    for filepath, _ in files:
+        with open(filepath, encoding='utf-8') as f:
+            texts.append(f.read())
+    return texts
+
+
+def _train(version):
+    trainer.train_many(versions=(version,), algos=('mnb',), select_k=0, dedup=False)
+
+
+@pytest.fixture(scope='module')
+def model(workdir):
+    """Train the model of a version once per run"""
+    trained = set()
+    def train(version):
+        if version not in trained:
+            _train(version)
+            trained.add(version)
+    return train
+
+
+def test_make_dictionary(benchmark, stages, tags):
+    benchmark.extra_info['items'] = len(tags)
+    benchmark(extraction.make_dictionary, tags=tags)
+
+
+def test_make_dataset(benchmark, stages, tags):
+    dictionary = extraction.make_dictionary(tags=tags)
+    benchmark.extra_info['items'] = len(tags)
+    benchmark(extraction.make_dataset, dictionary, tags=tags)
+
+
+def test_create_dataframe(benchmark, stages):
+    df = benchmark(extraction.create_dataframe)
+    benchmark.extra_info['items'] = len(df)
+
+
+def test_process_dataframe(benchmark, stages, monkeypatch, tmp_path):
+    # Not the vectorizer of the v2 model the classification benchmarks use
+    monkeypatch.setattr(utils, 'FN_VECTORIZER', str(tmp_path / 'vectorizer_'))
+    df = extraction.create_dataframe()
+    benchmark.extra_info['items'] = len(df)
+    benchmark(extraction.process_dataframe, df)
+
+
+@pytest.mark.parametrize('text_mode', ['emailyzer', 'fast'])
+def test_parse(benchmark, stages, files, text_mode):
+    if text_mode == 'emailyzer' and getattr(__import__('emailyzer'), 'STANDIN', False):
+        pytest.skip('`emailyzer` is not installed')
+    benchmark.extra_info['items'] = len(files)
+    benchmark(lambda: [rows for rows in iter_parsed(files, workers=1, text_mode=text_mode)])
+
+
+@pytest.mark.parametrize('version', VERSIONS)
+def test_train(benchmark, stages, version):
+    # Training reads the database itself
+    benchmark.extra_info['items'] = sum(storage.category_stats().values())
+    benchmark.pedantic(_train, args=(version,), rounds=TRAIN_ROUNDS)
+
+
+@pytest.mark.parametrize('version', VERSIONS)
+def test_classify(benchmark, stages, model, texts, version):
+    model(version)
+    classify = classifier.classify if version == 'v1' else classifier.classifyv2
+    texts = itertools.cycle(texts[:CLASSIFY_SINGLE])
+    # One email per round, so the statistics are the latency of each one
+    benchmark.pedantic(lambda: classify(next(texts)), rounds=CLASSIFY_SINGLE)
+
+
+@pytest.mark.parametrize('version', VERSIONS)
+def test_classify_many(benchmark, stages, model, texts, version):
+    model(version)
+    benchmark.extra_info['items'] = len(texts)
+    benchmark(classifier.classify_many, texts, version=version)
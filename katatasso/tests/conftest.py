@@ -0,0 +1,26 @@
+import pytest
+
+from katatasso.helpers import storage
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """An empty database, used by every module, in a temporary working directory"""
+    monkeypatch.setattr(storage, 'DBFILE', str(tmp_path / 'tagger.db'))
+    monkeypatch.chdir(tmp_path)
+    yield storage.connect()
+    storage.close()
+
+
+class StubTagger(object):
+    """Stands in for the Stanford NER tagger: tags capitalized tokens as
+    named entities, and the rest as outside of one"""
+
+    def tag_sents(self, sentences):
+        return [[(token, 'PERSON' if token[:1].isupper() else 'O') for token in tokens] for tokens in sentences]
+
+
+@pytest.fixture
+def stub_ner(monkeypatch):
+    from katatasso.helpers import ner
+    monkeypatch.setattr(ner, 'get_tagger', StubTagger)
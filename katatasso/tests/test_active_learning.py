@@ -0,0 +1,19 @@
+from katatasso.helpers import cache, synthetic
+from katatasso.modules import trainer
+
+
+def test_training_rescores_untagged_emails(db, stub_ner, monkeypatch):
+    monkeypatch.setattr(cache, 'CLF_CACHE', False)
+    vocabulary = synthetic.Vocabulary()
+    rows = []
+    for i in range(200):
+        tag, text, _, _ = synthetic.email(vocabulary, i)
+        rows.append((f'{i}.eml', tag, text))
+    rows += [('new.eml', -1, 'hello world'), ('tagged.eml', -1, None)]
+    db.executemany('INSERT INTO tags (filepath, tag, text) VALUES (?,?,?)', rows)
+    db.commit()
+
+    trainer.train_many(versions=('v2',), algos=('mnb',), n_jobs=1, select_k=0, dedup=False)
+    scored = dict(db.execute("SELECT filepath, scored_model FROM tags WHERE tag = -1"))
+    # Only tagged, not ingested: left to `active_learning`, which parses it
+    assert scored['new.eml'] and scored['tagged.eml'] is None
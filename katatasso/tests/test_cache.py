@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from katatasso.helpers import cache
+
+
+def test_fingerprint_follows_content(db):
+    db.execute("INSERT INTO tags (filepath, tag, text, hosts) VALUES ('a.eml', 0, 'hello world', 'a.com')")
+    db.commit()
+    before = cache.fingerprint()
+
+    # Same length, same tag
+    db.execute("UPDATE tags SET text = 'hello wordl' WHERE filepath = 'a.eml'")
+    db.commit()
+    assert cache.fingerprint() != before
+
+    before = cache.fingerprint()
+    db.execute("UPDATE tags SET hosts = 'b.com' WHERE filepath = 'a.eml'")
+    db.commit()
+    assert cache.fingerprint() != before
+
+
+def test_fingerprint_follows_tags_and_deletes(db):
+    db.executemany('INSERT INTO tags (filepath, tag) VALUES (?,?)', [('a.eml', 0), ('b.eml', 1), ('c.eml', 2)])
+    db.commit()
+    before = cache.fingerprint()
+    # Swapping two tags leaves every aggregate of the rows as it was
+    db.execute("UPDATE tags SET tag = 1 WHERE filepath = 'a.eml'")
+    db.execute("UPDATE tags SET tag = 0 WHERE filepath = 'b.eml'")
+    db.commit()
+    assert cache.fingerprint() != before
+
+    before = cache.fingerprint()
+    db.execute("DELETE FROM tags WHERE filepath = 'b.eml'")
+    db.execute("INSERT INTO tags (filepath, tag) VALUES ('b.eml', 0)")
+    db.commit()
+    assert cache.fingerprint() != before
+
+
+def test_fingerprint_ignores_scoring(db):
+    db.execute("INSERT INTO tags (filepath, tag, text) VALUES ('a.eml', -1, 'hello')")
+    db.commit()
+    before = cache.fingerprint()
+    db.execute("UPDATE tags SET uncertainty = 0.5, scored_model = 'm' WHERE filepath = 'a.eml'")
+    db.commit()
+    assert cache.fingerprint() == before
+
+
+@pytest.fixture
+def entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CLF_CACHE_DIR', str(tmp_path / 'cache'))
+    cache.save('key', sp.identity(3, format='csr'), np.arange(3), extra={'weights': None})
+    return tmp_path / 'cache'
+
+
+def test_load(entry):
+    X, y, extra = cache.load('key')
+    assert X.shape == (3, 3) and list(y) == [0, 1, 2] and extra == {'weights': None}
+
+
+def test_unreadable_extra_is_a_miss(entry):
+    (entry / 'key.extra.p').write_bytes(b'not a pickle')
+    assert cache.load('key') is None
+
+
+def test_missing_extra_is_a_miss(entry):
+    (entry / 'key.extra.p').unlink()
+    assert cache.load('key') is None
+
+
+def test_failed_save_leaves_no_entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CLF_CACHE_DIR', str(tmp_path / 'cache'))
+    # Can't be pickled
+    cache.save('key', sp.identity(3, format='csr'), np.arange(3), extra={'vectorizer': lambda: None})
+    assert cache.load('key') is None
@@ -0,0 +1,79 @@
+import numpy as np
+
+from katatasso.helpers import cache, corpus_store
+from katatasso.modules import trainer
+
+
+def _insert(db, rows):
+    db.executemany('INSERT INTO tags (filepath, tag, text) VALUES (?,?,?)', rows)
+    db.commit()
+
+
+def _assert_same(store, rebuilt):
+    assert store.vocab == rebuilt.vocab
+    for name in ('offsets', 'ids', 'labels', 'valid'):
+        assert np.array_equal(getattr(store, name), getattr(rebuilt, name)), name
+    assert np.array_equal(store.tokens, rebuilt.tokens)
+
+
+def test_update_appends(db, tmp_path):
+    path = str(tmp_path / 'corpus')
+    _insert(db, [('a.eml', 0, 'hello world'), ('b.eml', 1, None)])
+    store = corpus_store.update(path)
+    assert len(store) == 2
+
+    _insert(db, [('c.eml', 2, 'hello new world'), ('d.eml', 3, 'brand new')])
+    db.execute("UPDATE tags SET tag = 4 WHERE filepath = 'a.eml'")
+    db.commit()
+    built = store.meta
+    store = corpus_store.update(path)
+    assert store.is_fresh()
+    assert list(store.labels) == [4, 1, 2, 3]
+    # Appended, not rebuilt: the earlier documents keep their token ids
+    assert store.vocab[:2] == ['hello', 'world']
+    assert store.meta['version'] > built['version']
+    _assert_same(store, corpus_store.build(str(tmp_path / 'rebuilt')))
+    assert corpus_store.update(path).meta == store.meta
+
+
+def test_update_rebuilds(db, tmp_path):
+    path = str(tmp_path / 'corpus')
+    _insert(db, [('a.eml', 0, 'hello world'), ('b.eml', 1, 'spam spam')])
+    corpus_store.update(path)
+
+    db.execute("UPDATE tags SET text = 'goodbye world' WHERE filepath = 'a.eml'")
+    db.commit()
+    _assert_same(corpus_store.update(path), corpus_store.build(str(tmp_path / 'rebuilt')))
+
+    db.execute("DELETE FROM tags WHERE filepath = 'a.eml'")
+    db.commit()
+    store = corpus_store.update(path)
+    assert list(store.ids) == [2]
+    _assert_same(store, corpus_store.build(str(tmp_path / 'rebuilt')))
+
+
+def test_update_after_interruption(db, tmp_path):
+    path = str(tmp_path / 'corpus')
+    _insert(db, [('a.eml', 0, 'hello world')])
+    corpus_store.update(path)
+    # Tokens of an update that didn't get to save the offsets
+    with open(f'{path}/tokens.bin', 'ab') as f:
+        np.asarray([7, 7, 7], dtype=np.int32).tofile(f)
+
+    _insert(db, [('b.eml', 1, 'more words')])
+    _assert_same(corpus_store.update(path), corpus_store.build(str(tmp_path / 'rebuilt')))
+
+
+def test_training_relabels_the_store(db, monkeypatch):
+    monkeypatch.setattr(cache, 'CLF_CACHE', False)
+    _insert(db, [('a.eml', 0, 'hello world'), ('b.eml', 1, 'spam spam')])
+    corpus_store.update()
+    # Tagged after ingestion
+    db.execute("UPDATE tags SET tag = 2 WHERE filepath = 'a.eml'")
+    db.commit()
+    assert corpus_store.open_store() is None
+
+    _, labels, _, _ = trainer.load_features('v2', dedup=False)
+    assert sorted(labels) == [1, 2]
+    store = corpus_store.open_store()
+    assert store is not None and list(store.labels) == [2, 1]
@@ -0,0 +1,26 @@
+import random
+
+from katatasso.modules import trainer
+
+
+def test_read_corpus_streams_kept_tags(db):
+    rng = random.Random(0)
+    words = [f'word{i}' for i in range(500)]
+    a, b = (' '.join(rng.choices(words, k=200)) for _ in range(2))
+    db.executemany('INSERT INTO tags (filepath, tag, text) VALUES (?,?,?)', [
+        ('a.eml', 0, a),
+        ('b.eml', 0, b),
+        ('a2.eml', 0, a + ' word1'),
+        # Not a duplicate of `a`, being in another category
+        ('a3.eml', 1, a),
+        ('none.eml', 1, None)
+    ])
+    db.commit()
+
+    tags, weights = trainer.read_corpus(dedup=True, stream=True)
+    assert [(filepath, tag) for filepath, tag, _, _ in tags] == [('a.eml', 0), ('b.eml', 0), ('a3.eml', 1)]
+    assert list(weights) == [2, 1, 1]
+
+    tags, weights = trainer.read_corpus(n=5, seed=1, dedup=True, stream=False)
+    assert sorted(filepath for filepath, _, _, _ in tags) == ['a.eml', 'a3.eml', 'b.eml']
+    assert sum(weights) == 4
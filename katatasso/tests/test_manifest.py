@@ -0,0 +1,40 @@
+from katatasso.helpers import autotagger, manifest, watch
+
+
+def _files(tmp_path, n=3):
+    tags = []
+    for i in range(n):
+        filepath = tmp_path / f'{i}.eml'
+        filepath.write_text(f'Subject: {i}\n\nHello {i}\n')
+        tags.append((str(filepath), i))
+    return tags
+
+
+def test_autotagged_files_are_parsed(db, tmp_path):
+    tags = _files(tmp_path)
+    pending, entries, _, _ = manifest.scan(db, tags, ingester='autotagger', parsed=False)
+    autotagger._insert(db, pending, entries)
+    assert manifest.scan(db, tags, ingester='autotagger', parsed=False)[3]['unchanged'] == 3
+
+    # Tagged, but without text
+    pending, _, _, summary = manifest.scan(db, tags)
+    assert sorted(pending) == sorted(tags)
+    assert summary['new'] == 3
+    assert watch._known(db, [filepath for filepath, _ in tags]) == set()
+    assert len(watch._known(db, [filepath for filepath, _ in tags], parsed=False)) == 3
+
+
+def test_only_rows_with_text_are_adopted(db, tmp_path):
+    (parsed, _), (tagged, _), (new, _) = tags = _files(tmp_path)
+    db.execute('INSERT INTO tags (filepath, tag, text) VALUES (?, 0, ?)', (parsed, 'hello'))
+    db.execute('INSERT INTO tags (filepath, tag) VALUES (?, 1)', (tagged,))
+    db.commit()
+
+    pending, entries, deleted, summary = manifest.scan(db, tags)
+    assert sorted(filepath for filepath, _ in pending) == sorted([tagged, new])
+    assert summary == {'new': 2, 'changed': 0, 'unchanged': 1, 'deleted': 0}
+
+    # Recorded, but the text was never stored
+    manifest.record(db, entries, [tagged])
+    db.commit()
+    assert sorted(filepath for filepath, _ in manifest.scan(db, tags)[0]) == sorted([tagged, new])
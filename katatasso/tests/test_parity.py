@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from katatasso.helpers import cache, corpus_store, dataset_generator, extraction, plaintext, synthetic
+from katatasso.helpers.utils import save_vectorizer
+from katatasso.modules import trainer
+
+
+@pytest.fixture
+def corpus(db, stub_ner, tmp_path, monkeypatch):
+    """Emails ingested in `fast` text mode, and their raw text"""
+    monkeypatch.setattr(cache, 'CLF_CACHE', False)
+    vocabulary = synthetic.Vocabulary()
+    raws, tags = [], []
+    for i in range(40):
+        tag, _, _, raw = synthetic.email(vocabulary, i)
+        filepath = tmp_path / f'{i}.eml'
+        filepath.write_text(raw)
+        raws.append(raw)
+        tags.append((str(filepath), tag))
+    rows = [row for chunk in dataset_generator.iter_parsed(tags, workers=1, text_mode='fast') for row in chunk]
+    db.executemany('INSERT INTO tags (filepath, tag, text, hosts, source, source_offset, text_mode) '
+                   'VALUES (?,?,?,?,?,?,?)', rows)
+    db.commit()
+    return raws
+
+
+@pytest.mark.parametrize('store', [False, True], ids=['text', 'store'])
+@pytest.mark.parametrize('version', ['v1', 'v2'])
+def test_training_and_classification_features_match(corpus, version, store):
+    if store:
+        corpus_store.build()
+    features, labels, vectorizer, _ = trainer.load_features(version, dedup=False)
+    assert (corpus_store.open_store() is not None) == store
+    setattr(vectorizer, plaintext.TEXT_MODE_ATTR, extraction.training_text_mode())
+    save_vectorizer(vectorizer, version=version)
+
+    single = sp.vstack([extraction.get_counts(raw, version=version) for raw in corpus])
+    many = extraction.get_counts_many(corpus, version=version)
+    assert features.shape == single.shape == many.shape
+    assert np.allclose(features.toarray(), single.toarray())
+    assert np.allclose(features.toarray(), many.toarray())
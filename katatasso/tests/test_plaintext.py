@@ -0,0 +1,63 @@
+import glob
+import os
+
+import pytest
+
+from katatasso.helpers import dataset_generator, plaintext
+from katatasso.helpers.normalize import NORMALIZER
+
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'fixtures', 'emails', '*.eml')))
+# Emails with a `text/plain` alternative to their HTML body
+ALTERNATIVES = [fn for fn in FIXTURES if not fn.endswith('html_only.eml')]
+
+
+def _read(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+
+def _tokens(text):
+    return NORMALIZER.tokenize(text)
+
+
+@pytest.mark.parametrize('filepath', FIXTURES, ids=os.path.basename)
+def test_fast_html_matches_emailyzer(filepath):
+    emailyzer = pytest.importorskip('emailyzer')
+    if getattr(emailyzer, 'STANDIN', False):
+        pytest.skip('emailyzer is not installed')
+    html, _ = plaintext.message_text(_read(filepath), prefer_plain=False)
+    assert _tokens(html) == _tokens(emailyzer.from_file(filepath).html_as_text)
+
+
+@pytest.mark.parametrize('filepath', ALTERNATIVES, ids=os.path.basename)
+def test_fast_html_matches_plain_part(filepath):
+    raw = _read(filepath)
+    plain, hosts = plaintext.message_text(raw)
+    html, html_hosts = plaintext.message_text(raw, prefer_plain=False)
+    assert _tokens(plain) and _tokens(html) == _tokens(plain)
+    assert hosts == html_hosts
+
+
+@pytest.mark.parametrize('filepath', FIXTURES, ids=os.path.basename)
+def test_ingestion_matches_classification(filepath):
+    ingested, _, _, _ = dataset_generator._read((filepath, 0), text_mode='fast')
+    classified = plaintext.input_text(_read(filepath).decode('utf-8'), text_mode='fast')
+    assert _tokens(ingested) and _tokens(classified) == _tokens(ingested)
+
+
+def test_html_fragment():
+    html = '<style>p {}</style><p>Claim your <b>free</b>&nbsp;bonus</p><!-- x --><script>track()</script>'
+    assert _tokens(plaintext.input_text(html, text_mode='fast')) == ['claim', 'your', 'free', 'bonus']
+
+
+@pytest.mark.parametrize('text', [
+    'Urgent: verify your account at http://x.com now',
+    'Urgent: verify your account\nat http://x.com now'
+])
+def test_text_that_looks_like_a_header(text):
+    assert plaintext.input_text(text, text_mode='fast') == 'Urgent: verify your account at http://x.com now'
+
+
+def test_raw_email_headers():
+    assert plaintext.input_text('Subject: Hi\n\nClaim your bonus', text_mode='fast') == 'Claim your bonus'
+    assert plaintext.input_text('X-Mailer: x\n\nClaim your bonus', text_mode='fast') == 'Claim your bonus'
@@ -0,0 +1,55 @@
+import collections
+
+from katatasso.helpers import corpus_store, extraction, storage
+
+# Number of emails in each category
+SIZES = {0: 400, 1: 200, 2: 100, 3: 60, 4: 40}
+
+
+def _populate(db):
+    rows = [(f'{tag}-{i}.eml', tag, f'email {i}') for tag, size in SIZES.items() for i in range(size)]
+    db.executemany('INSERT INTO tags (filepath, tag, text) VALUES (?,?,?)', rows)
+    db.commit()
+
+
+def _tags(ids):
+    conn = storage.connect()
+    return collections.Counter(conn.execute('SELECT tag FROM tags WHERE id = ?', (id,)).fetchone()[0] for id in ids)
+
+
+def test_same_seed_same_sample(db):
+    _populate(db)
+    for strategy in ('balanced', 'proportional'):
+        sample = extraction.sample_tag_ids(20, seed=7, strategy=strategy)
+        assert extraction.sample_tag_ids(20, seed=7, strategy=strategy) == sample
+        assert extraction.sample_tag_ids(20, seed=8, strategy=strategy) != sample
+
+
+def test_balanced(db):
+    _populate(db)
+    ids = extraction.sample_tag_ids(30, seed=0, strategy='balanced')
+    assert len(set(ids)) == len(ids)
+    assert _tags(ids) == {tag: 30 for tag in SIZES}
+
+
+def test_proportional(db):
+    _populate(db)
+    # 100 emails in total, divided like the 800 of the database
+    ids = extraction.sample_tag_ids(20, seed=0, strategy='proportional')
+    assert _tags(ids) == {tag: round(size / 8) for tag, size in SIZES.items()}
+
+
+def test_more_than_a_category_holds(db):
+    _populate(db)
+    assert _tags(extraction.sample_tag_ids(50, seed=0, strategy='balanced'))[4] == 40
+
+
+def test_store_selects_the_same_sample(db, tmp_path):
+    _populate(db)
+    store = corpus_store.update(str(tmp_path / 'corpus'))
+    for strategy in ('balanced', 'proportional'):
+        rows = store.select(20, seed=3, strategy=strategy)
+        ids = extraction.sample_tag_ids(20, seed=3, strategy=strategy)
+        assert sorted(store.ids[rows]) == sorted(ids)
+        # In the order the tags are read from the database
+        assert list(store.labels[rows]) == [tag for _, tag, _, _ in extraction.get_tags_by_id(ids)]
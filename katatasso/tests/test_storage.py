@@ -0,0 +1,39 @@
+import glob
+import sqlite3
+
+from katatasso.helpers import storage
+
+
+def test_duplicates_are_merged_after_a_backup(tmp_path):
+    path = str(tmp_path / 'tagger.db')
+    # Written by a version without the unique index on `filepath`
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE tags (id INTEGER PRIMARY KEY AUTOINCREMENT, filepath TEXT NOT NULL, tag INTEGER, '
+                 'text TEXT, hosts TEXT)')
+    conn.executemany('INSERT INTO tags (filepath, tag, text) VALUES (?,?,?)', [
+        ('a.eml', 0, 'ingested'),
+        # Tagged by an analyst
+        ('a.eml', 2, None),
+        ('b.eml', -1, None),
+        ('b.eml', 1, 'ingested'),
+        ('c.eml', 1, None),
+        ('c.eml', 3, None),
+        ('d.eml', 4, 'ingested')
+    ])
+    conn.commit()
+    conn.close()
+
+    try:
+        rows = storage.connect(path).execute('SELECT id, filepath, tag, text FROM tags ORDER BY id').fetchall()
+    finally:
+        storage.close(path)
+    assert rows == [
+        (1, 'a.eml', 2, 'ingested'),
+        (4, 'b.eml', 1, 'ingested'),
+        (6, 'c.eml', 3, None),
+        (7, 'd.eml', 4, 'ingested')
+    ]
+
+    backups = glob.glob(f'{path}.*.bak')
+    assert len(backups) == 1
+    assert sqlite3.connect(backups[0]).execute('SELECT COUNT(*) FROM tags').fetchone()[0] == 7
@@ -0,0 +1,67 @@
+import random
+import sys
+
+import numpy as np
+import pytest
+
+from katatasso.helpers import extraction
+
+N_DOCUMENTS = 10000
+WORDS_PER_DOCUMENT = 600
+
+
+def _corpus(db):
+    """About 50 MB of text, in 40 distinct words per document, so that the
+    text dwarfs the count matrix built from it"""
+    rng = random.Random(0)
+    vocabulary = [f'word{i:04d}' for i in range(200)]
+    rows = ((f'{i}.eml', i % 5, ' '.join(rng.choices(vocabulary[i % 150:i % 150 + 40], k=WORDS_PER_DOCUMENT)), 'example.com')
+            for i in range(N_DOCUMENTS))
+    db.executemany('INSERT INTO tags (filepath, tag, text, hosts) VALUES (?,?,?,?)', rows)
+    db.commit()
+    return db.execute('SELECT TOTAL(LENGTH(text)) FROM tags').fetchone()[0]
+
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1])
+
+
+def _peak_rss_growth_mb(func):
+    """Growth of the peak RSS of this process while calling `func`"""
+    # Resets the peak (VmHWM) to the current RSS
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    before = _status_kb('VmRSS')
+    func()
+    return (_status_kb('VmHWM') - before) / 1024
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='reads the peak RSS from /proc')
+def test_count_words_streams(db):
+    text_mb = _corpus(db) / 1024 / 1024
+    result = {}
+    growth = _peak_rss_growth_mb(lambda: result.update(counts=extraction.count_words(extraction.iter_all_tags())[0]))
+
+    assert result['counts'].shape[0] == N_DOCUMENTS
+    # Holding the corpus, as a list of rows or a DataFrame, takes more than the
+    # text itself (about 65 MB with `get_all_tags`, against 20 MB streamed)
+    assert growth < text_mb / 2, f'peak RSS grew by {growth:.1f} MB over {text_mb:.1f} MB of text'
+
+
+def test_dataframe_wrappers(db):
+    db.executemany('INSERT INTO tags (filepath, tag, text) VALUES (?,?,?)',
+                   [('a.eml', 0, 'Hello, world'), ('b.eml', 1, 'free offer'), ('c.eml', 1, None)])
+    db.commit()
+    df = extraction.create_dataframe()
+    assert list(df.label) == [0, 1, 1]
+
+    counts, df = extraction.process_dataframe(df)
+    expected, labels, _ = extraction.count_words(extraction.iter_all_tags())
+    assert list(df.label) == list(labels)
+    assert counts.shape == expected.shape
+    assert np.array_equal(counts.toarray() > 0, expected.toarray() > 0)
+    # Saved for classification
+    assert extraction.load_vectorizer(version='v2').transform(['hello world']).nnz == 2
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip('flask')
+
+from katatasso.modules import tagger  # noqa: E402
+
+
+@pytest.fixture
+def client(db):
+    db.executemany('INSERT INTO tags (filepath, tag) VALUES (?,?)', [('a.eml', -1), ('b.eml', -1)])
+    db.commit()
+    return tagger.app.test_client()
+
+
+@pytest.mark.parametrize('cat', [None, '', 'spam', '1.5', '9', '-2'])
+def test_bulk_tag_rejects_invalid_categories(client, db, cat):
+    form = {'ids': ['1', '2']}
+    if cat is not None:
+        form['cat'] = cat
+    response = client.post('/bulk_tag', data=form)
+    assert response.status_code == 400
+    assert [row[0] for row in db.execute('SELECT tag FROM tags ORDER BY id')] == [-1, -1]
+
+
+def test_bulk_tag(client, db):
+    response = client.post('/bulk_tag', data={'ids': ['1', '2'], 'cat': '1'})
+    assert response.status_code == 302
+    assert [row[0] for row in db.execute('SELECT tag FROM tags ORDER BY id')] == [1, 1]
@@ -0,0 +1,94 @@
+import os
+import shutil
+import time
+
+from katatasso.helpers import watch
+
+
+def _write(path, name, age=0):
+    """Write an email, modified `age` seconds ago"""
+    os.makedirs(os.path.dirname(path / name), exist_ok=True)
+    (path / name).write_text('Subject: hi\n\nhello')
+    if age:
+        mtime = time.time() - age
+        os.utime(path / name, (mtime, mtime))
+    return str(path / name)
+
+
+def _age(directory, age):
+    mtime = time.time() - age
+    os.utime(directory, (mtime, mtime))
+
+
+def _poll(db, cursors, path, settle=0):
+    """Poll, then store the new files and save the cursors like `watch` does"""
+    arrived, _, updates, removed = watch.poll(db, cursors, path=str(path), settle=settle)
+    db.executemany("INSERT INTO tags (filepath, tag, text) VALUES (?,?,'hello')", arrived)
+    watch.save_cursors(db, cursors, updates, removed)
+    return sorted(arrived), updates, removed
+
+
+def test_new_files(db, tmp_path):
+    a = _write(tmp_path, 'legitimate/a.eml')
+    b = _write(tmp_path, 'spam/b.eml')
+    # Not a category
+    _write(tmp_path, 'other/c.eml')
+    cursors = {}
+    assert _poll(db, cursors, tmp_path)[0] == [(a, 0), (b, 1)]
+    assert watch.load_cursors(db) == cursors
+
+    # Nothing moved, nothing is listed
+    assert _poll(db, cursors, tmp_path) == ([], {}, [])
+    c = _write(tmp_path, 'spam/c.eml')
+    arrived, updates, _ = _poll(db, cursors, tmp_path)
+    assert arrived == [(c, 1)] and list(updates) == [str(tmp_path / 'spam')]
+
+    # Restarted, from the saved cursors
+    assert _poll(db, watch.load_cursors(db), tmp_path)[0] == []
+
+
+def test_new_subfolder(db, tmp_path):
+    _write(tmp_path, 'phishing/a.eml')
+    cursors = {}
+    _poll(db, cursors, tmp_path)
+
+    b = _write(tmp_path, 'phishing/2024/06/b.eml')
+    assert _poll(db, cursors, tmp_path)[0] == [(b, 2)]
+    assert cursors[str(tmp_path / 'phishing' / '2024' / '06')][0] == str(tmp_path / 'phishing' / '2024')
+
+    # A file in a nested folder only moves the cursor of its own folder
+    c = _write(tmp_path, 'phishing/2024/06/c.eml')
+    arrived, updates, _ = _poll(db, cursors, tmp_path)
+    assert arrived == [(c, 2)] and list(updates) == [str(tmp_path / 'phishing' / '2024' / '06')]
+
+
+def test_unsettled_files_are_left_for_later(db, tmp_path):
+    directory = tmp_path / 'malware'
+    _write(tmp_path, 'malware/old.eml', age=120)
+    new = _write(tmp_path, 'malware/new.eml')
+    cursors = {}
+    arrived, updates, _ = _poll(db, cursors, tmp_path, settle=60)
+    assert arrived == [(str(directory / 'old.eml'), 3)]
+    # Listed again by the next poll
+    assert not updates and not cursors
+
+    os.utime(new, (time.time() - 120, time.time() - 120))
+    _age(directory, 120)
+    arrived, updates, _ = _poll(db, cursors, tmp_path, settle=60)
+    assert arrived == [(new, 3)] and list(updates) == [str(directory)]
+
+
+def test_removed_directory(db, tmp_path):
+    _write(tmp_path, 'fraud/a.eml')
+    _write(tmp_path, 'fraud/2024/b.eml')
+    _write(tmp_path, 'fraud/2024/06/c.eml')
+    cursors = {}
+    _poll(db, cursors, tmp_path)
+    assert len(cursors) == 3
+
+    shutil.rmtree(tmp_path / 'fraud' / '2024')
+    arrived, _, removed = _poll(db, cursors, tmp_path)
+    assert not arrived and removed == [str(tmp_path / 'fraud' / '2024')]
+    # Nested folders are forgotten with it
+    assert list(cursors) == [str(tmp_path / 'fraud')]
+    assert watch.load_cursors(db) == cursors
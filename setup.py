@@ -50,9 +50,12 @@ setup(
     url='https://github.com/mortea15/katatasso.git',
     author=__author__,
     author_email=__contact__,
-    packages=['katatasso', 'katatasso.modules', 'katatasso.modules.metrics', 'katatasso.helpers', 'katatasso.tests'], #find_packages(),
+    packages=['katatasso', 'katatasso.modules', 'katatasso.modules.metrics', 'katatasso.helpers',
+              'katatasso.tests', 'katatasso.tests.benchmarks'], #find_packages(),
+    package_data={'katatasso.tests': ['fixtures/emails/*.eml']},
+    extras_require={'test': ['pytest', 'pytest-benchmark']},
     classifiers=classifiers,
     zip_safe=False,
     entry_points={'console_scripts': ['katatasso = katatasso.__main__:main', 'katag = katatasso.modules.tagger:run_server']},
-    data_files=[('tagserver/templates', ['katatasso/modules/templates/index.html','katatasso/modules/templates/email.html'])]
+    data_files=[('tagserver/templates', ['katatasso/modules/templates/index.html','katatasso/modules/templates/email.html','katatasso/modules/templates/search.html'])]
 )